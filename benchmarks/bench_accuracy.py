@@ -0,0 +1,121 @@
+"""
+Accuracy and cost of the full WigglerCV.write path on synthetic streams with ground truth:
+marker recall, pose recall, position and angle RMSE, and the time of write() per frame,
+for a clean stream and with blur, noise and lighting changes.
+
+    python -m benchmarks.bench_accuracy [--count 500] [--resolution 640x480] [--config wiggler_cv.json]
+    python -m benchmarks.bench_accuracy --dataset frames.npy  # written by synthetic.py, poses next to it
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_wigglerCV import STREAMING_KEYS
+from channel import EVERY
+from frame_sources import open_source
+from markers import Markers
+from synthetic import load_poses, write_dataset
+from wiggler_cv import WigglerCV
+
+CONDITIONS = (
+    ('clean', {}),
+    ('blur', {'blur': 2.}),
+    ('noise', {'noise': 8.}),
+    ('lighting', {'lighting': 0.4}),
+    ('all', {'blur': 2., 'noise': 8., 'lighting': 0.4}),
+)
+
+
+class TimedWigglerCV(WigglerCV):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_times = []
+        self.markers_found = []
+
+    def write(self, buffer):
+        start_time = time.perf_counter()
+        super().write(buffer)
+        self.write_times.append(time.perf_counter() - start_time)
+
+    def _processed(self, frame):
+        super()._processed(frame)
+        found = set() if frame.ids is None else set(frame.ids[:, 0])
+        self.markers_found.append(len(found & set(self._robots[0].markers.marker_ids)))
+
+
+def run(path, cfg_file='wiggler_cv.json'):
+    """
+    Feeds the dataset through WigglerCV.write inline, without streaming
+    :return: (write seconds per frame, markers found per frame, {frame: RobotLocation} of the first robot)
+    """
+    wcv = TimedWigglerCV(None, source=open_source(path, realtime=False))
+    wcv.setup(cfg_file=cfg_file)
+    for k in STREAMING_KEYS:
+        if hasattr(wcv.config, k):
+            delattr(wcv.config, k)
+    wcv.config.pipeline = False
+    subscription = wcv.subscribe(EVERY, maxsize=len(np.load(path, mmap_mode='r')) + 1)
+    wcv.run()
+    locations = {location.frame: location for location in subscription}
+    wcv.terminate()
+    return np.array(wcv.write_times), np.array(wcv.markers_found), locations
+
+
+def evaluate(poses, write_times, markers_found, locations, markers=Markers):
+    """
+    :return: dict of marker recall, pose recall, position RMSE px, angle RMSE deg, write time mean and p95 s
+    """
+    position_errors = []
+    angle_errors = []
+    for index, location in locations.items():
+        pose = poses[index]
+        position_errors.append(np.sum((np.array(location.coordinates) - pose[:2]) ** 2))
+        angle = np.arctan2(location.rotscale[1], location.rotscale[0]) - np.arctan2(pose[3], pose[2])
+        angle_errors.append(np.angle(np.exp(1j * angle)) ** 2)
+    return {
+        'marker_recall': markers_found.sum() / (len(poses) * len(markers.marker_ids)),
+        'pose_recall': len(locations) / len(poses),
+        'position_rmse': np.sqrt(np.mean(position_errors)) if position_errors else np.nan,
+        'angle_rmse': np.degrees(np.sqrt(np.mean(angle_errors))) if angle_errors else np.nan,
+        'write_mean': write_times.mean() if len(write_times) else np.nan,
+        'write_p95': np.percentile(write_times, 95) if len(write_times) else np.nan,
+    }
+
+
+def report_header():
+    print('{:10s} {:>8s} {:>8s} {:>9s} {:>9s} {:>8s} {:>8s}'.format(
+        'condition', 'markers', 'poses', 'pos rmse', 'ang rmse', 'write', 'p95'))
+
+
+def report(name, result):
+    print('{:10s} {:7.1f}% {:7.1f}% {:7.2f}px {:7.2f}deg {:6.2f}ms {:6.2f}ms'.format(
+        name, result['marker_recall'] * 100, result['pose_recall'] * 100, result['position_rmse'],
+        result['angle_rmse'], result['write_mean'] * 1000, result['write_p95'] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', help='.npy frames with ground truth poses written by synthetic.py')
+    parser.add_argument('--count', type=int, default=500, help='frames per generated condition')
+    parser.add_argument('--resolution', default='640x480')
+    parser.add_argument('--motion', default='walk', choices=('walk', 'random'))
+    parser.add_argument('--config', default='wiggler_cv.json')
+    args = parser.parse_args()
+
+    report_header()
+    if args.dataset:
+        report(os.path.basename(args.dataset), evaluate(load_poses(args.dataset), *run(args.dataset, args.config)))
+        return
+    resolution = tuple(int(v) for v in args.resolution.split('x'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, effects in CONDITIONS:
+            path = os.path.join(directory, name + '.npy')
+            poses = write_dataset(path, args.count, resolution=resolution, motion=args.motion, **effects)
+            report(name, evaluate(poses, *run(path, args.config)))
+
+
+if __name__ == '__main__':
+    main()
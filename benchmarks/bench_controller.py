@@ -0,0 +1,66 @@
+"""
+Closed-loop control of the simulated robot: target steps and a circling target, with and
+without latency compensation. Reports tracking error, control loop jitter and capture-to-actuation latency.
+
+    python -m benchmarks.bench_controller [--duration 4] [--rate 50] [--fps 25] [--latency 0.08]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from channel import LATEST
+from controller import Controller, SimulatedPlant
+
+
+def run(duration, rate, fps, latency, compensate, circle):
+    """
+    :return: (RMS distance to the target in px, Controller.stats())
+    """
+    plant = SimulatedPlant(fps=fps, latency=latency)
+    controller = Controller(plant, rate=rate, compensate=compensate, tolerance=1.)
+    controller.follow(plant.poses.subscribe(LATEST))
+    plant.start()
+    controller.start()
+    errors = []
+    start_time = time.perf_counter()
+    while True:
+        t = time.perf_counter() - start_time
+        if t > duration:
+            break
+        if circle:
+            target = (320 + 100 * math.cos(t * 2 * math.pi / 4), 240 + 100 * math.sin(t * 2 * math.pi / 4))
+        else:
+            target = (420, 240) if int(t) % 2 == 0 else (320, 300)
+        controller.set_target(target)
+        time.sleep(0.01)
+        plant.step(time.perf_counter())
+        # settle first
+        if t > 0.5:
+            errors.append(np.hypot(*(plant.position - target)))
+    controller.stop()
+    plant.close()
+    return np.sqrt(np.mean(np.square(errors))), controller.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=4.)
+    parser.add_argument('--rate', type=float, default=50., help='control ticks per second')
+    parser.add_argument('--fps', type=float, default=25.)
+    parser.add_argument('--latency', type=float, default=0.08, help='capture to pose latency, seconds')
+    args = parser.parse_args()
+
+    print('{:8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        'target', 'compensate', 'RMS px', 'jitter p50', 'jitter p99', 'lat p50', 'lat p99'))
+    for circle in (False, True):
+        for compensate in (False, True):
+            error, stats = run(args.duration, args.rate, args.fps, args.latency, compensate, circle)
+            print('{:8s} {:>10s} {:10.1f} {:8.2f}ms {:8.2f}ms {:8.1f}ms {:8.1f}ms'.format(
+                'circle' if circle else 'steps', str(compensate), error, stats['jitter']['p50'] * 1000,
+                stats['jitter']['p99'] * 1000, stats['latency']['p50'] * 1000, stats['latency']['p99'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Full-frame marker detection on synthetic frames:
+single cv2.aruco.detectMarkers call against the tiled parallel detector,
+and accuracy against speed of coarse-to-fine (pyramid) detection per downscale factor.
+
+    python -m benchmarks.bench_detection [--count 50] [--grid 2x2] [--workers 4] [--scales 1,2,4]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from detection import PyramidDetector, TiledDetector, detect_markers
+from markers import Markers
+from synthetic import marker_corners, random_frames
+
+RESOLUTIONS = ((640, 480), (1280, 720))
+
+
+def measure(detect, grays):
+    """
+    :return: (seconds per frame, markers found per frame)
+    """
+    found = 0
+    start_time = time.perf_counter()
+    for gray in grays:
+        _, ids = detect(gray)
+        found += 0 if ids is None else len(ids)
+    return (time.perf_counter() - start_time) / len(grays), found / len(grays)
+
+
+def accuracy(detect, grays, poses, markers=Markers):
+    """
+    :return: (seconds per frame, share of markers found, corner RMSE px, position RMSE px)
+    """
+    results = []
+    start_time = time.perf_counter()
+    for gray in grays:
+        results.append(detect(gray))
+    seconds = (time.perf_counter() - start_time) / len(grays)
+    corner_errors = []
+    position_errors = []
+    for (corners, ids), pose in zip(results, poses):
+        if ids is None:
+            continue
+        true_corners, true_ids = marker_corners(markers, pose[:2], pose[2:])
+        true_index = {marker_id: i for i, marker_id in enumerate(true_ids[:, 0])}
+        for c, marker_id in zip(corners, ids[:, 0]):
+            if marker_id in true_index:
+                corner_errors.extend(((c - true_corners[true_index[marker_id]]) ** 2).sum(axis=-1).ravel())
+        try:
+            location = markers.get_location(corners, ids)
+            position_errors.append(((np.array(location.coordinates) - pose[:2]) ** 2).sum())
+        except Exception:
+            pass
+    recall = len(corner_errors) / 4 / (len(grays) * len(markers.marker_ids))
+    corner_rmse = np.sqrt(np.mean(corner_errors)) if corner_errors else np.nan
+    position_rmse = np.sqrt(np.mean(position_errors)) if position_errors else np.nan
+    return seconds, recall, corner_rmse, position_rmse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--grid', default='2x2', help='columns x rows of tiles')
+    parser.add_argument('--overlap', type=int, default=80)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--scales', default='1,2,4', help='pyramid downscale factors')
+    args = parser.parse_args()
+
+    dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+    grid = tuple(int(v) for v in args.grid.split('x'))
+    scales = [int(v) for v in args.scales.split(',')]
+    tiled = TiledDetector(dictionary, grid=grid, overlap=args.overlap, workers=args.workers)
+    frame_sets = {}
+    print('{:>10s} {:>10s} {:>8s} {:>10s} {:>8s}'.format('resolution', 'single', 'markers', 'tiled', 'markers'))
+    for resolution in RESOLUTIONS:
+        # same field of view at every resolution: constellation scale grows with the width
+        factor = resolution[0] / 640
+        frames, poses = random_frames(args.count, resolution=resolution, scale=(1.5 * factor, 3. * factor))
+        grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+        frame_sets[resolution] = grays, poses
+        single_time, single_found = measure(lambda gray: detect_markers(gray, dictionary), grays)
+        tiled_time, tiled_found = measure(tiled.detect, grays)
+        print('{:>10s} {:8.2f}ms {:8.2f} {:8.2f}ms {:8.2f}'.format('{}x{}'.format(*resolution), single_time * 1000,
+                                                                 single_found, tiled_time * 1000, tiled_found))
+    tiled.close()
+
+    print()
+    print('{:>10s} {:>6s} {:>10s} {:>8s} {:>10s} {:>10s}'.format('resolution', 'scale', 'time', 'recall',
+                                                                 'corner px', 'pos px'))
+    for resolution, (grays, poses) in frame_sets.items():
+        for scale in scales:
+            if scale > 1:
+                detect = PyramidDetector(dictionary, scale=scale).detect
+            else:
+                detect = lambda gray: detect_markers(gray, dictionary)
+            seconds, recall, corner_rmse, position_rmse = accuracy(detect, grays, poses)
+            print('{:>10s} {:>6d} {:8.2f}ms {:7.1f}% {:10.3f} {:10.3f}'.format(
+                '{}x{}'.format(*resolution), scale, seconds * 1000, recall * 100, corner_rmse, position_rmse))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of Markers.get_location against the lstsq reference implementation
+and of Markers.get_locations_batch.
+
+    python -m benchmarks.bench_markers [--count 10000]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from markers import Markers
+
+
+def make_detections(count, seed=0):
+    """
+    Random constellation poses with noisy corners in cv2.aruco.detectMarkers format
+    """
+    rng = np.random.default_rng(seed)
+    detections = []
+    for _ in range(count):
+        angle = rng.uniform(-np.pi, np.pi)
+        scale = rng.uniform(1, 5)
+        transform = np.array([
+            [scale * np.cos(angle), -scale * np.sin(angle), rng.uniform(0, 640)],
+            [scale * np.sin(angle), scale * np.cos(angle), rng.uniform(0, 480)],
+        ])
+        ids = rng.permutation(Markers.marker_ids)[:rng.integers(1, 4)]
+        corners = tuple((np.dot(transform, Markers.markers[i]).T[None, :, :] + rng.normal(0, 0.5, (1, 4, 2)))
+                        .astype(np.float32) for i in ids)
+        detections.append((corners, ids.reshape((-1, 1))))
+    return detections
+
+
+def measure(function, detections):
+    start_time = time.perf_counter()
+    for corners, ids in detections:
+        function(corners, ids)
+    return (time.perf_counter() - start_time) / len(detections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+
+    detections = make_detections(args.count)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        lstsq_time = measure(Markers.get_location_lstsq, detections)
+    closed_form_time = measure(Markers.get_location, detections)
+    print('lstsq       {:7.1f}us/call'.format(lstsq_time * 1e6))
+    print('closed form {:7.1f}us/call ({:.1f}x)'.format(closed_form_time * 1e6, lstsq_time / closed_form_time))
+
+    corners_list, ids_list = zip(*detections)
+    start_time = time.perf_counter()
+    Markers.get_locations_batch(corners_list, ids_list)
+    batch_time = (time.perf_counter() - start_time) / len(detections)
+    print('batch       {:7.1f}us/frame ({:.1f}x)'.format(batch_time * 1e6, lstsq_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
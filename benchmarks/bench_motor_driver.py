@@ -0,0 +1,63 @@
+"""
+Motor commands issued at the camera rate, written directly or through the MotorDriver,
+against the in-process fake pigpio. --latency emulates the pigpio socket round trip.
+
+    python -m benchmarks.bench_motor_driver [--duration 2] [--command-rate 90] [--rate 50] [--latency 0.0001]
+"""
+import argparse
+import colorsys
+import time
+
+from fake_pigpio import FakePi
+from motor_driver import MotorDriver
+from vibromotors import Motors
+
+
+def commands(duration, command_rate):
+    for i in range(int(duration * command_rate)):
+        t = i / command_rate
+        yield colorsys.hsv_to_rgb(t % 1., 1., 1.)
+
+
+def run(duration, command_rate, rate=None, call_latency=0.):
+    """
+    :param rate: flush rate of the MotorDriver, motors are set directly if None
+    :return: (mean time the caller spends in set() in seconds, pigpio duty cycle writes per second)
+    """
+    pi = FakePi(call_latency=call_latency)
+    motors = Motors(pi)
+    target = motors if rate is None else MotorDriver(motors, rate=rate)
+    blocked = 0.
+    count = 0
+    start_time = time.perf_counter()
+    for i, speeds in enumerate(commands(duration, command_rate)):
+        # pace the commands like poses arriving from the camera
+        delay = start_time + i / command_rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        set_time = time.perf_counter()
+        target.set(speeds)
+        blocked += time.perf_counter() - set_time
+        count += 1
+    if rate is not None:
+        target.close()
+    elapsed = time.perf_counter() - start_time
+    return blocked / count, pi.calls.get('set_PWM_dutycycle', 0) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=2.)
+    parser.add_argument('--command-rate', type=float, default=90.)
+    parser.add_argument('--rate', type=float, default=50., help='driver flushes per second')
+    parser.add_argument('--latency', type=float, default=0.0001, help='seconds per pigpio call')
+    args = parser.parse_args()
+
+    print('{:10s} {:>14s} {:>12s}'.format('mode', 'set() blocks', 'writes/s'))
+    for name, rate in (('direct', None), ('driver', args.rate)):
+        blocked, writes = run(args.duration, args.command_rate, rate=rate, call_latency=args.latency)
+        print('{:10s} {:12.1f}us {:12.1f}'.format(name, blocked * 1e6, writes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Update rate sonicmotors.Motors.set() sustains, against the in-process fake pigpio.
+--latency emulates the pigpio socket round trip of every call (around 100us on a Pi).
+
+    python -m benchmarks.bench_sonicmotors [--count 2000] [--latency 0.0001]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from fake_pigpio import FakePi
+from sonicmotors import Motors
+
+
+def sweep(count, seed=0):
+    """
+    Phases drifting slowly, as from a controller
+    """
+    t = np.arange(count)[:, None] * 0.002
+    return 0.5 + 0.5 * np.sin(t * np.array([1., 1.3, 1.7]) + np.array([0., 1., 2.]))
+
+
+def random_phases(count, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1, (count, 3))
+
+
+def run(phases, call_latency=0., **kwargs):
+    """
+    :return: (sets per second, cache hit rate, pigpio calls per set)
+    """
+    pi = FakePi(call_latency=call_latency)
+    motors = Motors(pi, **kwargs)
+    pi.calls.clear()
+    start_time = time.perf_counter()
+    for speeds in phases.tolist():
+        motors.set(speeds)
+    elapsed = time.perf_counter() - start_time
+    return len(phases) / elapsed, motors.hits / len(phases), sum(pi.calls.values()) / len(phases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0., help='seconds per pigpio call')
+    parser.add_argument('--phase-steps', type=int, default=64)
+    parser.add_argument('--cache-size', type=int, default=64)
+    args = parser.parse_args()
+
+    print('{:10s} {:>10s} {:>8s} {:>12s}'.format('phases', 'sets/s', 'hits', 'calls/set'))
+    for name, phases in (('sweep', sweep(args.count)), ('random', random_phases(args.count))):
+        rate, hit_rate, calls = run(phases, call_latency=args.latency, phase_steps=args.phase_steps,
+                                    cache_size=args.cache_size)
+        print('{:10s} {:10.0f} {:7.1f}% {:12.2f}'.format(name, rate, hit_rate * 100, calls))
+
+
+if __name__ == '__main__':
+    main()
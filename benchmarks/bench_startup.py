@@ -0,0 +1,86 @@
+"""
+Time to the first pose after process start, with and without the detector warm-up.
+Every run is a fresh interpreter importing wiggler_cv and starting WigglerCV on an emulated camera:
+PiCameraSource is replaced by a replay of synthetic frames taking --camera-init seconds to open.
+
+    python -m benchmarks.bench_startup [--runs 5] [--camera-init 1.0] [--resolution 640x480]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from subprocess import check_output
+
+
+def child(frames_path, camera_init, warmup):
+    """
+    Runs in the fresh interpreter, prints the timings as JSON
+    """
+    start_time = time.monotonic()
+    import wiggler_cv
+    from frame_sources import RawDumpSource
+    import_time = time.monotonic() - start_time
+
+    class EmulatedCamera(RawDumpSource):
+        def __init__(self, resolution, framerate, format='bgr'):
+            time.sleep(camera_init)
+            super().__init__(frames_path, framerate=framerate, realtime=True, loop=True, format=format)
+
+    wiggler_cv.PiCameraSource = EmulatedCamera
+    wcv = wiggler_cv.WigglerCV(None)
+    wcv.setup(cfg_file='wiggler_cv.json')
+    for k in ('stream_cmd', 'gstreamer_pipe'):
+        if hasattr(wcv.config, k):
+            delattr(wcv.config, k)
+    wcv.config.warmup = warmup
+    poses = wcv.subscribe()
+    wcv.run()
+    poses.get(timeout=30)
+    first_pose = time.monotonic()
+    wcv.terminate()
+    stats = wcv.stats()
+    print(json.dumps({'import': import_time, 'first_pose': first_pose,
+                      'run_to_first_pose': stats['gauges']['time_to_first_pose'],
+                      'warmup': stats['histograms'].get('warmup', {}).get('max', 0.)}))
+
+
+def run(frames_path, camera_init, warmup):
+    spawn_time = time.monotonic()
+    output = check_output([sys.executable, '-m', 'benchmarks.bench_startup', '--child', frames_path,
+                           '--camera-init', str(camera_init)] + (['--warmup'] if warmup else []))
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result['total'] = result.pop('first_pose') - spawn_time
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--camera-init', type=float, default=1., help='seconds the emulated camera takes to open')
+    parser.add_argument('--resolution', default='640x480')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.camera_init, args.warmup)
+        return
+
+    import numpy as np
+    from synthetic import random_frames
+
+    resolution = tuple(int(v) for v in args.resolution.split('x'))
+    with tempfile.TemporaryDirectory() as directory:
+        frames_path = os.path.join(directory, 'frames.npy')
+        np.save(frames_path, random_frames(25, resolution=resolution)[0])
+        print('{:8s} {:>8s} {:>8s} {:>10s} {:>8s}'.format('warmup', 'import', 'warmup', 'run->pose', 'total'))
+        for warmup in (False, True):
+            results = [run(frames_path, args.camera_init, warmup) for _ in range(args.runs)]
+            print('{:8s} {:6.0f}ms {:6.0f}ms {:8.0f}ms {:6.0f}ms'.format(
+                'on' if warmup else 'off', *(np.median([r[k] for r in results]) * 1000
+                                              for k in ('import', 'warmup', 'run_to_first_pose', 'total'))))
+
+
+if __name__ == '__main__':
+    main()
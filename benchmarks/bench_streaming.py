@@ -0,0 +1,72 @@
+"""
+Cost of streaming a frame on the frame thread: in-process conversion, tobytes() and pipe write
+against the shared-memory ring feeding the encoder process. The stream goes to a reader that
+drops it, --delay slows the reader down to emulate an encoder falling behind.
+
+    python -m benchmarks.bench_streaming [--resolution 1280x720] [--count 200] [--delay 0]
+"""
+import argparse
+import sys
+import time
+from subprocess import Popen, PIPE
+
+import cv2
+import numpy as np
+
+from streaming import StreamSink
+
+
+def reader_cmd(delay):
+    script = ('import sys, time\n'
+              'while sys.stdin.buffer.read(1 << 20):\n'
+              '    time.sleep(float(sys.argv[1]))\n')
+    return [sys.executable, '-c', script, str(delay)]
+
+
+def run_pipe(frames, delay):
+    proc = Popen(reader_cmd(delay), stdin=PIPE)
+    times = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        proc.stdin.write(cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).tobytes())
+        times.append(time.perf_counter() - start_time)
+    proc.stdin.close()
+    proc.wait()
+    return np.array(times), 0
+
+
+def run_ring(frames, resolution, delay):
+    sink = StreamSink(resolution, 25, stream_cmd=reader_cmd(delay))
+    times = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        sink.write(image=frame)
+        times.append(time.perf_counter() - start_time)
+        # camera frame interval, gives the encoder process the chance to run
+        time.sleep(0.005)
+    sink.wait_streamed(len(frames))
+    sink.close()
+    return np.array(times), sink.skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0., help='reader delay per MB, seconds')
+    args = parser.parse_args()
+
+    resolution = tuple(int(v) for v in args.resolution.split('x'))
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (resolution[1], resolution[0], 3), dtype=np.uint8) for _ in range(8)]
+    frames = [frames[i % len(frames)] for i in range(args.count)]
+    print('{:6s} {:>10s} {:>10s} {:>10s} {:>8s}'.format('sink', 'mean', 'p95', 'max', 'skipped'))
+    for name, (times, skipped) in (('pipe', run_pipe(frames, args.delay)),
+                                   ('ring', run_ring(frames, resolution, args.delay))):
+        print('{:6s} {:8.2f}ms {:8.2f}ms {:8.2f}ms {:8d}'.format(name, times.mean() * 1000,
+                                                               np.percentile(times, 95) * 1000, times.max() * 1000,
+                                                               skipped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Throughput benchmark of the WigglerCV frame pipeline on recorded footage.
+
+    python -m benchmarks.bench_wigglerCV frames.npy [--realtime] [--stream] [--pipeline] [--yuv]
+        [--stream-res WxH] [--stream-fps FPS] [--stream-adaptive]
+
+osd and streaming times are of the streamed frames only.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from frame_sources import open_source
+from wiggler_cv import WigglerCV
+
+STREAMING_KEYS = ('stream_cmd', 'gstreamer_pipe')
+
+
+class StageTimingWigglerCV(WigglerCV):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_times = []
+
+    def _processed(self, frame):
+        super()._processed(frame)
+        if frame.streamed:
+            self.stage_times.append((frame.detect_time, frame.osd_time, frame.stream_time - frame.osd_time))
+        else:
+            self.stage_times.append((frame.detect_time, np.nan, np.nan))
+
+
+def run(source, cfg_file='wiggler_cv.json', stream=False, debug_level=None, pipeline=False, stream_res=None,
+        stream_fps=None, stream_adaptive=False):
+    """
+    Feeds all frames of the source through WigglerCV
+    :return: (frame count, positions count, wall time, array of (aruco, osd, streaming) seconds per frame,
+              NaN for frames not streamed, frames dropped per pipeline stage, ROI hit rate)
+    """
+    wcv = StageTimingWigglerCV(None, source=source)
+    wcv.setup(cfg_file=cfg_file)
+    if not stream:
+        for k in STREAMING_KEYS:
+            if hasattr(wcv.config, k):
+                delattr(wcv.config, k)
+    if debug_level is not None:
+        wcv.config.debug_level = debug_level
+    wcv.config.pipeline = pipeline
+    if stream_res is not None:
+        wcv.config.stream_res = stream_res
+    if stream_fps is not None:
+        wcv.config.stream_fps = stream_fps
+    wcv.config.stream_adaptive = stream_adaptive
+
+    positions = 0
+    start_time = time.perf_counter()
+    wcv.run()
+    for _ in wcv:
+        positions += 1
+    wall_time = time.perf_counter() - start_time
+    wcv.terminate()
+    return len(wcv.stage_times), positions, wall_time, np.array(wcv.stage_times).reshape((-1, 3)), \
+        wcv.dropped_frames, wcv.roi_hit_rate
+
+
+def report(frames, positions, wall_time, stage_times, dropped_frames, roi_hit_rate):
+    print('frames {}, positions {}, {:.1f}s, {:.1f} frames/s'.format(frames, positions, wall_time,
+                                                                 frames / wall_time if wall_time else 0))
+    if not frames:
+        return
+    print('ROI hit rate {:.1f}%'.format(roi_hit_rate * 100))
+    print('{:10s} {:>8s} {:>8s} {:>8s} {:>8s}'.format('stage', 'mean', 'p50', 'p95', 'max'))
+    for name, times in zip(('aruco', 'osd', 'streaming'), stage_times.T * 1000):
+        times = times[~np.isnan(times)]
+        if not len(times):
+            continue
+        print('{:10s} {:6.2f}ms {:6.2f}ms {:6.2f}ms {:6.2f}ms'.format(name, times.mean(), np.percentile(times, 50),
+                                                                     np.percentile(times, 95), times.max()))
+    print('streamed {} frames'.format(int(np.sum(~np.isnan(stage_times[:, 1])))))
+    if dropped_frames:
+        print('dropped ' + ', '.join('{} {}'.format(name, count) for name, count in dropped_frames.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='video file, directory of images, .npy, raw BGR or I420 (.yuv) dump')
+    parser.add_argument('--config', default='wiggler_cv.json')
+    parser.add_argument('--resolution', help='WxH of a raw dump')
+    parser.add_argument('--fps', type=float, default=25., help='frame rate of sources without one')
+    parser.add_argument('--realtime', action='store_true', help='pace frames at the recorded frame rate')
+    parser.add_argument('--stream', action='store_true', help='keep streaming sinks from the config')
+    parser.add_argument('--debug-level', type=int)
+    parser.add_argument('--pipeline', action='store_true', help='run stages on separate threads')
+    parser.add_argument('--yuv', action='store_true', help='feed YUV420 frames as the camera yuv capture format does')
+    parser.add_argument('--stream-res', help='WxH of the debug stream')
+    parser.add_argument('--stream-fps', type=float, help='frame rate of the debug stream')
+    parser.add_argument('--stream-adaptive', action='store_true', help='lower the stream rate when over budget')
+    args = parser.parse_args()
+
+    resolution = tuple(int(v) for v in args.resolution.split('x')) if args.resolution else None
+    source = open_source(args.source, resolution=resolution, framerate=args.fps, realtime=args.realtime,
+                         format='yuv' if args.yuv else 'bgr')
+    report(*run(source, cfg_file=args.config, stream=args.stream, debug_level=args.debug_level,
+               pipeline=args.pipeline,
+               stream_res=[int(v) for v in args.stream_res.split('x')] if args.stream_res else None,
+               stream_fps=args.stream_fps, stream_adaptive=args.stream_adaptive))
+
+
+if __name__ == '__main__':
+    main()
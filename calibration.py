@@ -0,0 +1,220 @@
+"""
+Lens calibration: intrinsics from chessboard images, applied to the detected corner points only.
+
+    python calibration.py images/ [--board 9x6] [--square 25] [--floor floor.jpg] [--config wiggler_cv.json]
+
+Finds the inner corners of the chessboard in every image of the directory, calibrates the camera and writes
+the intrinsics into the config as calibration. With --floor, an image of the board lying flat on the floor
+also gives the homography from undistorted pixels to floor millimetres, the first inner corner of the board
+being the origin.
+"""
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+from config import store
+
+
+def board_points(board, square):
+    """
+    :param board: (columns, rows) of inner corners
+    :param square: side of a square, mm
+    :return: (columns * rows, 3) corners on the board plane, in the order cv2.findChessboardCorners reports them
+    """
+    columns, rows = board
+    points = np.zeros((rows * columns, 3), np.float32)
+    points[:, :2] = np.mgrid[:columns, :rows].T.reshape((-1, 2)) * square
+    return points
+
+
+def find_board(gray, board):
+    """
+    :return: (columns * rows, 1, 2) refined inner corners of the chessboard or None if not found
+    """
+    found, corners = cv2.findChessboardCorners(gray, tuple(board))
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    return cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
+
+
+def calibrate(image_points, board, square, resolution):
+    """
+    :param image_points: list of find_board() results
+    :return: (camera matrix (3, 3), distortion coefficients, RMS reprojection error px)
+    """
+    object_points = [board_points(board, square)] * len(image_points)
+    rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(object_points, image_points, tuple(resolution),
+                                                                None, None)
+    return camera_matrix, dist_coeffs.reshape(-1), rms
+
+
+class Calibration:
+    """
+    Undistorts points through a lookup grid precomputed with cv2.undistortPoints: every grid_step pixels the
+    displacement to the undistorted position is stored, cv2.remap samples it bilinearly at the points.
+    Cost is a few microseconds per frame, independent of the resolution, whole frames are never remapped.
+    The displacement varies slowly, so the fixed point interpolation of cv2.remap keeps the error in
+    hundredths of a pixel.
+    Undistorted points keep the pixel scale of the camera matrix, poses stay in pixels.
+    A second grid maps undistorted points back to raw pixels.
+    Optionally maps undistorted pixels to floor millimetres with a homography.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, resolution, floor_homography=None, grid_step=4):
+        """
+        :param camera_matrix: (3, 3) intrinsics at resolution
+        :param dist_coeffs: OpenCV distortion coefficients
+        :param resolution: (width, height) of the frames
+        :param floor_homography: (3, 3) from undistorted pixels to floor mm, None without floor mapping
+        :param grid_step: spacing of the lookup grid, px
+        """
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).reshape(-1)
+        self.resolution = tuple(resolution)
+        self.floor_homography = None if floor_homography is None else np.asarray(floor_homography, np.float64)
+        self.grid_step = grid_step
+        width, height = self.resolution
+        # grid covers the frame including its far edges
+        xs = np.arange(0, width + grid_step, grid_step, dtype=np.float64)
+        ys = np.arange(0, height + grid_step, grid_step, dtype=np.float64)
+        grid = np.stack(np.meshgrid(xs, ys), axis=-1)
+        undistorted = cv2.undistortPoints(grid.reshape((-1, 1, 2)), self.camera_matrix, self.dist_coeffs,
+                                          P=self.camera_matrix)
+        self._displacement = (undistorted.reshape(grid.shape) - grid).astype(np.float32)
+        # inverse grid covers the undistorted frame, its points are projected through the lens
+        low = np.floor(undistorted.reshape((-1, 2)).min(axis=0))
+        high = undistorted.reshape((-1, 2)).max(axis=0)
+        self._inverse_origin = low.astype(np.float32)
+        grid = np.stack(np.meshgrid(np.arange(low[0], high[0] + 2 * grid_step, grid_step),
+                                    np.arange(low[1], high[1] + 2 * grid_step, grid_step)), axis=-1)
+        normalized = cv2.undistortPoints(grid.reshape((-1, 1, 2)), self.camera_matrix, None)
+        rays = cv2.convertPointsToHomogeneous(normalized).astype(np.float64)
+        distorted, _ = cv2.projectPoints(rays, np.zeros(3), np.zeros(3), self.camera_matrix, self.dist_coeffs)
+        self._inverse_displacement = (distorted.reshape(grid.shape) - grid).astype(np.float32)
+
+    @classmethod
+    def from_config(cls, values, resolution=None):
+        """
+        :param values: dict with camera_matrix, dist_coeffs, resolution and optional floor_homography,
+                       as written by this module
+        :param resolution: frame resolution when it differs from the calibrated one (same aspect ratio),
+                           the camera matrix and the homography are scaled
+        """
+        camera_matrix = np.array(values['camera_matrix'], dtype=np.float64)
+        floor_homography = values.get('floor_homography')
+        if floor_homography is not None:
+            floor_homography = np.array(floor_homography, dtype=np.float64)
+        if resolution is not None and tuple(resolution) != tuple(values['resolution']):
+            scale = np.diag([resolution[0] / values['resolution'][0], resolution[1] / values['resolution'][1], 1.])
+            camera_matrix = np.dot(scale, camera_matrix)
+            if floor_homography is not None:
+                floor_homography = np.dot(floor_homography, np.linalg.inv(scale))
+        else:
+            resolution = values['resolution']
+        return cls(camera_matrix, values['dist_coeffs'], resolution, floor_homography=floor_homography,
+                   grid_step=values.get('grid_step', 4))
+
+    def to_config(self):
+        values = {'resolution': list(self.resolution), 'camera_matrix': self.camera_matrix.tolist(),
+                  'dist_coeffs': self.dist_coeffs.tolist()}
+        if self.floor_homography is not None:
+            values['floor_homography'] = self.floor_homography.tolist()
+        return values
+
+    def _displaced(self, points, displacement, origin=0.):
+        points = np.asarray(points, dtype=np.float32)
+        grid_points = ((points - origin) / self.grid_step).reshape((1, -1, 2))
+        displacement = cv2.remap(displacement, grid_points, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return points + displacement.reshape(points.shape)
+
+    def undistort(self, points):
+        """
+        :param points: (..., 2) pixel coordinates
+        :return: (..., 2) undistorted pixel coordinates, float32
+        """
+        return self._displaced(points, self._displacement)
+
+    def distort(self, points):
+        """
+        :param points: (..., 2) undistorted pixel coordinates
+        :return: (..., 2) raw pixel coordinates, float32
+        """
+        return self._displaced(points, self._inverse_displacement, self._inverse_origin)
+
+    def undistort_corners(self, corners):
+        """
+        :param corners: corners as cv2.aruco.detectMarkers returns them
+        :return: undistorted corners (n, 1, 4, 2)
+        """
+        if not len(corners):
+            return corners
+        return self.undistort(np.asarray(corners, dtype=np.float32).reshape((-1, 1, 4, 2)))
+
+    def to_floor(self, point):
+        """
+        :param point: undistorted (x, y) px
+        :return: (x, y) on the floor, mm, None without floor mapping
+        """
+        if self.floor_homography is None:
+            return None
+        x, y, w = np.dot(self.floor_homography, (point[0], point[1], 1.))
+        return x / w, y / w
+
+
+def floor_homography(calibration, image_points, board, square):
+    """
+    :param image_points: find_board() result of the board lying on the floor
+    :return: (3, 3) homography from undistorted pixels to floor mm
+    """
+    pixels = calibration.undistort(image_points.reshape((-1, 2)))
+    homography, _ = cv2.findHomography(pixels, board_points(board, square)[:, :2])
+    return homography
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', help='directory of chessboard images taken with the robot camera')
+    parser.add_argument('--board', default='9x6', help='inner corners, columns x rows')
+    parser.add_argument('--square', type=float, default=25., help='side of a square, mm')
+    parser.add_argument('--floor', help='image of the board lying on the floor, for the floor mapping')
+    parser.add_argument('--config', default='wiggler_cv.json')
+    parser.add_argument('--dry-run', action='store_true', help='print the result only')
+    args = parser.parse_args()
+
+    board = tuple(int(v) for v in args.board.split('x'))
+    image_points = []
+    resolution = None
+    for name in sorted(os.listdir(args.images)):
+        gray = cv2.imread(os.path.join(args.images, name), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            continue
+        resolution = gray.shape[::-1]
+        corners = find_board(gray, board)
+        print('{}: {}'.format(name, 'found' if corners is not None else 'no board'))
+        if corners is not None:
+            image_points.append(corners)
+    if len(image_points) < 3:
+        print('board found in {} images, at least 3 needed'.format(len(image_points)))
+        return
+    camera_matrix, dist_coeffs, rms = calibrate(image_points, board, args.square, resolution)
+    print('RMS reprojection error {:.3f}px'.format(rms))
+    calibration = Calibration(camera_matrix, dist_coeffs, resolution)
+    if args.floor:
+        corners = find_board(cv2.imread(args.floor, cv2.IMREAD_GRAYSCALE), board)
+        if corners is None:
+            print('no board in the floor image')
+            return
+        calibration.floor_homography = floor_homography(calibration, corners, board, args.square)
+    values = calibration.to_config()
+    print(json.dumps(values))
+    if not args.dry_run:
+        store(args.config, 'calibration', values)
+        print('written to ' + args.config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import collections
+import threading
+
+EVERY = 'every'
+LATEST = 'latest'
+MODES = (EVERY, LATEST)
+
+
+class Subscription:
+    """
+    Subscriber end of a Channel, iterable both with for and async for.
+    In every mode each published item is delivered, up to maxsize items are buffered and the oldest
+    one is dropped (and counted) when the subscriber lags behind.
+    In latest mode only the newest item is kept, a get() waits for an item not seen yet.
+    """
+
+    def __init__(self, channel, mode=EVERY, maxsize=100, predicate=None):
+        if mode not in MODES:
+            raise ValueError('Unknown subscription mode: {}. Must be one of {}'.format(mode, MODES))
+        self.mode = mode
+        self.maxsize = 1 if mode == LATEST else max(1, int(maxsize))
+        self.predicate = predicate
+        self.dropped = 0
+        self._channel = channel
+        self._items = collections.deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def _put(self, item):
+        if self.predicate is not None and not self.predicate(item):
+            return
+        with self._cond:
+            if self._closed:
+                return
+            while len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._notify()
+
+    def _close(self):
+        with self._cond:
+            self._closed = True
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # loop closed
+                pass
+        self._waiters = []
+
+    def get(self, timeout=None):
+        """
+        :return: next item
+        :raises StopIteration: once the channel is closed and the buffered items are consumed
+        :raises TimeoutError: when nothing was published within timeout seconds
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                raise TimeoutError()
+            if self._items:
+                return self._items.popleft()
+            raise StopIteration
+
+    def close(self):
+        """
+        Unsubscribes, items buffered already can still be read
+        """
+        self._channel.unsubscribe(self)
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # imported by async subscribers only, it adds to the start-up time
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._items:
+                    return self._items.popleft()
+                if self._closed:
+                    raise StopAsyncIteration
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Channel:
+    """
+    Broadcast channel: every subscriber gets its own view of the published items, so several
+    consumers never take items from one another.
+    """
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.latest = None
+
+    def subscribe(self, mode=EVERY, maxsize=100, predicate=None):
+        """
+        :param mode: every or latest
+        :param maxsize: buffered items in every mode
+        :param predicate: function selecting the items delivered to this subscriber
+        :return: Subscription, receives items published from now on
+        """
+        subscription = Subscription(self, mode=mode, maxsize=maxsize, predicate=predicate)
+        with self._lock:
+            if self._closed:
+                subscription._close()
+            else:
+                self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, item):
+        with self._lock:
+            self.latest = item
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription._put(item)
+
+    def close(self):
+        """
+        Ends all subscriptions after their buffered items
+        """
+        with self._lock:
+            self._closed = True
+            subscriptions = self._subscriptions
+            self._subscriptions = []
+        for subscription in subscriptions:
+            subscription._close()
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import threading
+
+from detection import PARAMETER_NAMES
+
+# when a change of the field takes effect
+RUNTIME = 'runtime'
+STREAM = 'stream'
+RESTART = 'restart'
+
+NUMBER = (int, float)
+LIST = (list,)
+
+# name: (types, nullable, group)
+FIELDS = {
+    'input_res_h': ((int,), False, RESTART),
+    'input_res_v': ((int,), False, RESTART),
+    'input_fps': (NUMBER, False, RESTART),
+    'capture_format': ((str,), False, RESTART),
+    'pipeline': ((bool,), False, RESTART),
+    'pipeline_queue_size': ((int,), False, RESTART),
+    'pipeline_drop_policy': ((str, dict), True, RESTART),
+    'record_path': ((str,), True, RESTART),
+    'record_slots': ((int,), False, RESTART),
+    'record_format': ((str,), False, RESTART),
+    'metrics_host': ((str,), False, RESTART),
+    'metrics_port': ((int,), True, RESTART),
+    'config_watch': (NUMBER, True, RESTART),
+    'warmup': ((bool,), False, RESTART),
+    'debug_level': ((int,), False, RUNTIME),
+    'fast_area_size': ((int,), False, RUNTIME),
+    'robots': (LIST, False, RUNTIME),
+    'roi_mode': ((str,), False, RUNTIME),
+    'roi_margin': (NUMBER, False, RUNTIME),
+    'roi_sigma': (NUMBER, False, RUNTIME),
+    'roi_min_size': ((int,), False, RUNTIME),
+    'roi_max_size': ((int,), True, RUNTIME),
+    'fallback_tiles': (LIST, False, RUNTIME),
+    'fallback_tile_overlap': ((int,), False, RUNTIME),
+    'fallback_workers': ((int,), True, RUNTIME),
+    'fallback_scale': ((int,), False, RUNTIME),
+    'fallback_refine_window': ((int,), True, RUNTIME),
+    'detector_parameters': ((dict,), True, RUNTIME),
+    'restrict_marker_ids': ((bool,), False, RUNTIME),
+    'calibration': ((dict,), True, RUNTIME),
+    'flow_tracking': ((bool,), False, RUNTIME),
+    'flow_redetect_every': ((int,), False, RUNTIME),
+    'flow_window': ((int,), False, RUNTIME),
+    'flow_max_error': (NUMBER, False, RUNTIME),
+    'flow_max_residual': (NUMBER, False, RUNTIME),
+    'frame_scheduler': ((bool,), False, RUNTIME),
+    'frame_budget': (NUMBER, True, RUNTIME),
+    'fallback_defer_every': ((int,), False, RUNTIME),
+    'metrics_window': ((int,), False, RUNTIME),
+    'streaming_host': ((str,), False, STREAM),
+    'streaming_port': ((int,), False, STREAM),
+    'stream_cmd': (LIST, False, STREAM),
+    'gstreamer_pipe': (LIST, False, STREAM),
+    'stream_process': ((bool,), False, STREAM),
+    'stream_slots': ((int,), False, STREAM),
+    'stream_res': (LIST, True, STREAM),
+    'stream_fps': (NUMBER, True, STREAM),
+    'stream_adaptive': ((bool,), False, STREAM),
+    'stream_min_fps': (NUMBER, False, STREAM),
+    'stream_budget': (NUMBER, True, STREAM),
+}
+CHOICES = {
+    'capture_format': ('bgr', 'yuv'),
+    'record_format': ('gray', 'yuv', 'bgr'),
+    'roi_mode': ('fixed', 'predictive'),
+}
+PAIRS = ('stream_res', 'fallback_tiles')
+
+
+def validate(values):
+    """
+    Checks the types of the known fields, other keys (e.g. disabled "-stream_cmd") are left alone
+    :raises ValueError: listing all invalid fields
+    """
+    errors = []
+    for name, value in values.items():
+        if name not in FIELDS:
+            continue
+        types, nullable, _ = FIELDS[name]
+        if value is None:
+            if not nullable:
+                errors.append('{} must not be null'.format(name))
+        elif not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            errors.append('{} must be {}, not {!r}'.format(name, ' or '.join(t.__name__ for t in types), value))
+        elif name in CHOICES and value not in CHOICES[name]:
+            errors.append('{} must be one of {}, not {!r}'.format(name, CHOICES[name], value))
+        elif name in PAIRS and (len(value) != 2 or not all(isinstance(v, int) and v > 0 for v in value)):
+            errors.append('{} must be two positive integers, not {!r}'.format(name, value))
+        elif name == 'detector_parameters' and set(value) - set(PARAMETER_NAMES):
+            errors.append('{} has unknown names {}'.format(name, sorted(set(value) - set(PARAMETER_NAMES))))
+    if errors:
+        raise ValueError('Invalid configuration: ' + '; '.join(errors))
+
+
+def load(path):
+    """
+    :return: validated dict of the JSON config file
+    """
+    with open(path, 'r') as f:
+        values = json.load(f)
+    validate(values)
+    return values
+
+
+def store(path, name, value):
+    """
+    Sets a field of the JSON config file, e.g. from a tuning or calibration tool. Other fields are kept,
+    lists of numbers stay on one line as written by hand.
+    """
+    with open(path, 'r') as f:
+        values = json.load(f)
+    values[name] = value
+    text = json.dumps(values, indent=2)
+    text = re.sub(r'\[\s+(-?[\d.e+-]+(?:,\s+-?[\d.e+-]+)*)\s+\]',
+                  lambda match: '[' + ', '.join(re.split(r',\s+', match.group(1))) + ']', text)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def changes(old, new):
+    """
+    :return: {group: set of names} of the known fields added, removed or changed
+    """
+    changed = {}
+    for name in set(old) | set(new):
+        if name in FIELDS and old.get(name, KeyError) != new.get(name, KeyError):
+            changed.setdefault(FIELDS[name][2], set()).add(name)
+    return changed
+
+
+class ConfigWatcher:
+    """
+    Calls callback() from a thread whenever the modification time of the file changes
+    """
+
+    def __init__(self, path, callback, interval=1.):
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self._mtime = self._stat()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='config-watch', daemon=True)
+        self._thread.start()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            mtime = self._stat()
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    self.callback()
+                except Exception as e:
+                    print(e)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
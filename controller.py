@@ -0,0 +1,374 @@
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+
+from channel import Channel
+from markers import RobotLocation
+from metrics import Histogram
+
+
+class DirectionMixer:
+    """
+    Maps a force in the robot frame to motor speeds, each motor pushing the robot along its own direction.
+    With directions summing up to zero (e.g. three motors 120 degrees apart) the same speed can be added
+    to all motors without changing the force, so any force is reachable with non-negative speeds.
+    """
+
+    def __init__(self, angles=(0., 2 * math.pi / 3, 4 * math.pi / 3)):
+        """
+        :param angles: direction of each motor in the robot frame, radians
+        """
+        self.directions = np.array([(math.cos(a), math.sin(a)) for a in angles])
+        self._inverse = np.linalg.pinv(self.directions.T)
+        self._balanced = np.allclose(self.directions.sum(axis=0), 0.)
+
+    def speeds(self, force):
+        """
+        :param force: (x, y) in the robot frame, 1 is the force of one motor at full speed
+        :return: tuple of motor speeds in [0, 1]
+        """
+        speeds = np.dot(self._inverse, force)
+        if self._balanced:
+            speeds -= speeds.min()
+        speeds = np.clip(speeds, 0., None)
+        peak = speeds.max()
+        if peak > 1.:
+            speeds /= peak
+        return tuple(speeds.tolist())
+
+    def force(self, speeds):
+        """
+        :return: (x, y) force of the motor speeds in the robot frame
+        """
+        return np.dot(np.asarray(speeds, dtype=float), self.directions)
+
+
+class Controller:
+    """
+    Fixed-rate closed-loop position controller.
+    Poses arrive at the camera rate through update() (or follow()), the control loop runs at its own rate.
+    Every tick the last pose is extrapolated to the time the command takes effect: the pose age since
+    capture plus the actuation latency, with the velocity estimated from the pose timestamps.
+    The actuation latency is measured: the time the motors take to accept a command plus, for motors
+    reporting their command_latency like MotorDriver, the time until the command is written.
+    """
+
+    def __init__(self, motors, mixer=None, rate=50., gain=0.05, tolerance=5., actuation_latency=None,
+                 stale_timeout=0.5, compensate=True, velocity_smoothing=0.5, latency_smoothing=0.9, window=1000):
+        """
+        :param motors: vibromotors.Motors, sonicmotors.Motors or a MotorDriver, anything with set(speeds) and off()
+        :param mixer: maps the force in the robot frame to motor speeds, DirectionMixer by default
+        :param rate: control ticks per second
+        :param gain: force per pixel of position error, force is limited to 1
+        :param tolerance: distance to the target in pixels to stop at
+        :param actuation_latency: time from the command to the motors reacting, seconds, measured if None
+        :param stale_timeout: motors are stopped when the last pose is older, seconds
+        :param compensate: extrapolate the pose for the latency
+        :param velocity_smoothing: weight of the previous velocity estimate
+        :param latency_smoothing: weight of the previous actuation latency measurement
+        :param window: samples in the jitter and latency histograms
+        """
+        self.motors = motors
+        self.mixer = mixer if mixer is not None else DirectionMixer()
+        self.rate = rate
+        self.gain = gain
+        self.tolerance = tolerance
+        self.actuation_latency = actuation_latency
+        self.stale_timeout = stale_timeout
+        self.compensate = compensate
+        self.velocity_smoothing = velocity_smoothing
+        self.latency_smoothing = latency_smoothing
+        # measured actuation latency, seconds
+        self.actuation = 0.
+        self.target = None
+        self.ticks = 0
+        self.commands = 0
+        self.stale = 0
+        self.jitter = Histogram(window)
+        self.latency = Histogram(window)
+        self._pose = None
+        self._capture_time = None
+        self._velocity = (0., 0.)
+        self._stopped = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def set_target(self, target):
+        """
+        :param target: (x, y) in pixels or None to stop
+        """
+        with self._lock:
+            self.target = None if target is None else tuple(target)
+
+    def update(self, pose, receive_time=None):
+        """
+        New measured pose
+        :param pose: wiggler_cv.RobotLocation
+        :param receive_time: time.perf_counter() when the pose was received, now by default
+        """
+        if receive_time is None:
+            receive_time = time.perf_counter()
+        with self._lock:
+            previous = self._pose
+            if previous is not None and pose.timestamp > previous.timestamp:
+                dt = pose.timestamp - previous.timestamp
+                vx = (pose.coordinates[0] - previous.coordinates[0]) / dt
+                vy = (pose.coordinates[1] - previous.coordinates[1]) / dt
+                k = self.velocity_smoothing
+                self._velocity = (k * self._velocity[0] + (1 - k) * vx, k * self._velocity[1] + (1 - k) * vy)
+            self._pose = pose
+            self._capture_time = receive_time - pose.latency
+
+    def follow(self, subscription):
+        """
+        Feeds update() from a pose subscription (see WigglerCV.subscribe) on a thread
+        """
+        thread = threading.Thread(target=self._follow, args=(subscription,), name='controller-poses', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _follow(self, subscription):
+        for pose in subscription:
+            self.update(pose)
+            if self._stop.is_set():
+                break
+
+    def predict(self, now):
+        """
+        :return: ((x, y) expected when a command given now takes effect, heading in radians, pose age in seconds)
+                 or None without a pose
+        """
+        with self._lock:
+            pose = self._pose
+            capture_time = self._capture_time
+            velocity = self._velocity
+        if pose is None:
+            return None
+        age = now - capture_time
+        x, y = pose.coordinates
+        if self.compensate:
+            horizon = age + self._actuation_latency()
+            x += velocity[0] * horizon
+            y += velocity[1] * horizon
+        return (x, y), math.atan2(pose.rotscale[1], pose.rotscale[0]), age
+
+    def command(self, now):
+        """
+        One control step
+        :return: motor speeds or None if the motors were stopped
+        """
+        prediction = self.predict(now)
+        target = self.target
+        if prediction is None or target is None:
+            return None
+        (x, y), heading, age = prediction
+        if age > self.stale_timeout:
+            self.stale += 1
+            return None
+        ex = target[0] - x
+        ey = target[1] - y
+        if math.hypot(ex, ey) <= self.tolerance:
+            return None
+        fx = ex * self.gain
+        fy = ey * self.gain
+        norm = math.hypot(fx, fy)
+        if norm > 1.:
+            fx /= norm
+            fy /= norm
+        # world to robot frame
+        cos = math.cos(heading)
+        sin = math.sin(heading)
+        speeds = self.mixer.speeds((cos * fx + sin * fy, -sin * fx + cos * fy))
+        self.latency.add(age + self._actuation_latency())
+        return speeds
+
+    def _actuation_latency(self):
+        return self.actuation if self.actuation_latency is None else self.actuation_latency
+
+    def tick(self, now=None):
+        """
+        One control step applied to the motors
+        :param now: time of the step, time.perf_counter() by default, the simulated time in tests
+        """
+        if now is None:
+            now = time.perf_counter()
+        speeds = self.command(now)
+        try:
+            if speeds is None:
+                if not self._stopped:
+                    self.motors.off()
+                    self._stopped = True
+            else:
+                start_time = time.perf_counter()
+                self.motors.set(speeds)
+                measured = time.perf_counter() - start_time + getattr(self.motors, 'command_latency', 0.)
+                k = self.latency_smoothing if self.commands else 0.
+                self.actuation = k * self.actuation + (1 - k) * measured
+                self._stopped = False
+                self.commands += 1
+        except Exception as e:
+            print(e)
+        self.ticks += 1
+
+    def start(self):
+        self._stop.clear()
+        thread = threading.Thread(target=self._run, name='controller', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _run(self):
+        period = 1. / self.rate
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self.jitter.add(time.perf_counter() - next_time)
+            self.tick()
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                # overrun, skip the missed ticks
+                next_time += math.ceil(-delay / period) * period
+                delay = next_time - time.perf_counter()
+            self._stop.wait(delay)
+
+    def stop(self):
+        """
+        Stops the control loop (a follow() thread ends with its subscription) and the motors
+        """
+        self._stop.set()
+        for thread in self._threads:
+            if thread.name == 'controller':
+                thread.join()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        try:
+            self.motors.off()
+        except Exception as e:
+            print(e)
+        self._stopped = True
+
+    def stats(self):
+        """
+        :return: dict of ticks, commands, stale, measured actuation latency, jitter and latency summaries
+                 (seconds, see metrics.Histogram)
+        """
+        return {'ticks': self.ticks, 'commands': self.commands, 'stale': self.stale, 'actuation': self.actuation,
+                'jitter': self.jitter.summary(), 'latency': self.latency.summary()}
+
+
+class SimulatedPlant:
+    """
+    Simulated robot standing in for both the motors and the camera, for tests and benchmarks.
+    Motor forces accelerate the robot with a first order lag, the camera captures the pose at fps
+    and publishes it on poses after the detection latency, as WigglerCV does.
+    Runs in real time on a thread after start(), or in simulated time: advance() with a clock
+    returning the simulated time.
+    """
+
+    def __init__(self, mixer=None, position=(320., 240.), heading=0., scale=2., max_speed=200., time_constant=0.1,
+                 fps=25., latency=0.04, noise=0., name='wigglebot', seed=0, clock=time.perf_counter):
+        """
+        :param mixer: motor directions, DirectionMixer by default
+        :param scale: marker scale, px/mm
+        :param max_speed: speed of one motor at full speed, px/s
+        :param time_constant: of the velocity response, seconds
+        :param latency: capture to publish delay, seconds
+        :param noise: standard deviation of the measured position, px
+        :param clock: function returning the current time, seconds
+        """
+        self.mixer = mixer if mixer is not None else DirectionMixer()
+        self.position = np.array(position, dtype=float)
+        self.velocity = np.zeros(2)
+        self.heading = heading
+        self.scale = scale
+        self.max_speed = max_speed
+        self.time_constant = time_constant
+        self.fps = fps
+        self.latency = latency
+        self.noise = noise
+        self.name = name
+        self.clock = clock
+        self.poses = Channel()
+        self._speeds = np.zeros(len(self.mixer.directions))
+        self._time = None
+        self._start_time = None
+        self._next_capture = None
+        self._frame = 0
+        self._pending = collections.deque()
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def step(self, now):
+        """
+        Integrates the motion up to now
+        """
+        with self._lock:
+            if self._time is not None and now > self._time:
+                dt = now - self._time
+                force = self.mixer.force(self._speeds)
+                cos = math.cos(self.heading)
+                sin = math.sin(self.heading)
+                target = self.max_speed * np.array((cos * force[0] - sin * force[1], sin * force[0] + cos * force[1]))
+                previous = self.velocity.copy()
+                self.velocity = target + (self.velocity - target) * math.exp(-dt / self.time_constant)
+                self.position += (previous + self.velocity) / 2 * dt
+            self._time = now
+
+    def set(self, speeds):
+        self.step(self.clock())
+        with self._lock:
+            self._speeds = np.array(speeds, dtype=float)
+
+    def off(self):
+        self.set(np.zeros(len(self.mixer.directions)))
+
+    def advance(self, now=None):
+        """
+        Captures the frames due up to now and publishes the poses whose detection is done
+        :param now: clock() by default
+        :return: time of the next capture or publication
+        """
+        if now is None:
+            now = self.clock()
+        if self._start_time is None:
+            self.step(now)
+            self._start_time = self._next_capture = now
+        while now >= self._next_capture:
+            self.step(self._next_capture)
+            with self._lock:
+                coordinates = self.position + self._rng.normal(0., self.noise, 2) if self.noise \
+                    else self.position.copy()
+            rotscale = (self.scale * math.cos(self.heading), self.scale * math.sin(self.heading))
+            self._pending.append((self._next_capture + self.latency, self._next_capture, self._frame,
+                                  tuple(coordinates.tolist()), rotscale))
+            self._frame += 1
+            self._next_capture += 1. / self.fps
+        self.step(now)
+        while self._pending and self._pending[0][0] <= now:
+            _, capture_time, index, coordinates, rotscale = self._pending.popleft()
+            self.poses.publish(RobotLocation(self.name, coordinates, rotscale, 0., frame=index,
+                                             timestamp=capture_time - self._start_time,
+                                             latency=self.clock() - capture_time))
+        return self._next_capture if not self._pending else min(self._next_capture, self._pending[0][0])
+
+    def start(self):
+        self._stop.clear()
+        self.advance()
+        self._thread = threading.Thread(target=self._run, name='plant-camera', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            wake = self.advance()
+            self._stop.wait(max(0., wake - self.clock()))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.poses.close()
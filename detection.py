@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+PARAMETER_NAMES = ('adaptiveThreshConstant', 'adaptiveThreshWinSizeMax', 'adaptiveThreshWinSizeMin',
+                   'adaptiveThreshWinSizeStep', 'cornerRefinementMaxIterations', 'cornerRefinementMethod',
+                   'cornerRefinementMinAccuracy', 'cornerRefinementWinSize', 'detectInvertedMarker',
+                   'errorCorrectionRate', 'markerBorderBits', 'maxErroneousBitsInBorderRate', 'maxMarkerPerimeterRate',
+                   'minCornerDistanceRate', 'minDistanceToBorder', 'minMarkerDistanceRate', 'minMarkerPerimeterRate',
+                   'minOtsuStdDev', 'perspectiveRemoveIgnoredMarginPerCell', 'perspectiveRemovePixelPerCell',
+                   'polygonalApproxAccuracyRate')
+
+
+def copy_parameters(parameters=None):
+    """
+    :return: new cv2.aruco.DetectorParameters with the values of parameters (defaults if None)
+    """
+    copy = cv2.aruco.DetectorParameters_create()
+    if parameters is not None:
+        for name in PARAMETER_NAMES:
+            setattr(copy, name, getattr(parameters, name))
+    return copy
+
+
+def parameters_from_dict(values, parameters=None):
+    """
+    :param values: {name: value} of cv2.aruco.DetectorParameters attributes, e.g. from the config
+    :param parameters: values not given are copied from these, defaults if None
+    :raises ValueError: on unknown names
+    """
+    unknown = set(values) - set(PARAMETER_NAMES)
+    if unknown:
+        raise ValueError('Unknown detector parameters: ' + ', '.join(sorted(unknown)))
+    result = copy_parameters(parameters)
+    for name, value in values.items():
+        setattr(result, name, value)
+    return result
+
+
+def parameters_to_dict(parameters, names=PARAMETER_NAMES):
+    """
+    :return: {name: value} of the parameters, JSON serializable
+    """
+    values = {}
+    for name in names:
+        value = getattr(parameters, name)
+        values[name] = value if isinstance(value, (bool, int, float)) else float(value)
+    return values
+
+
+def scale_parameters(parameters, ratio):
+    """
+    Marker perimeter limits are relative to the image size: copy of the parameters keeping the limits
+    of an image ratio times larger than the one detected (e.g. a tile or ROI of the frame)
+    """
+    scaled = copy_parameters(parameters)
+    scaled.minMarkerPerimeterRate *= ratio
+    scaled.maxMarkerPerimeterRate *= ratio
+    return scaled
+
+
+def restrict_dictionary(dictionary, marker_ids):
+    """
+    Dictionary of the marker_ids only: candidates are matched against these codes and other markers
+    are rejected while decoding. cv2.aruco.detectMarkers reports the index into marker_ids as id,
+    detect_markers(..., marker_ids=marker_ids) maps it back.
+    """
+    restricted = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_50)
+    restricted.markerSize = dictionary.markerSize
+    restricted.maxCorrectionBits = dictionary.maxCorrectionBits
+    restricted.bytesList = np.ascontiguousarray(dictionary.bytesList[np.asarray(marker_ids, dtype=int)])
+    return restricted
+
+
+def detect_markers(gray, dictionary, parameters=None, marker_ids=None):
+    """
+    cv2.aruco.detectMarkers returning only (corners, ids)
+    :param marker_ids: ids of a restrict_dictionary() dictionary, None for a complete one
+    """
+    if parameters is None:
+        corners, ids, _ = cv2.aruco.detectMarkers(gray, dictionary)
+    else:
+        corners, ids, _ = cv2.aruco.detectMarkers(gray, dictionary, parameters=parameters)
+    if ids is not None and marker_ids is not None:
+        ids = np.asarray(marker_ids, dtype=np.int32)[ids]
+    return corners, ids
+
+
+class TiledDetector:
+    """
+    Full-frame marker detection split into overlapping tiles detected in parallel.
+    cv2 releases the GIL while detecting, so a thread pool keeps all cores busy.
+    Overlap must be larger than the biggest expected marker (in pixels) so that every marker
+    lies entirely within at least one tile. Markers found in several tiles are reported once.
+    Marker perimeter limits are relative to the image size, they are rescaled for each tile
+    to keep the limits of the full frame.
+    """
+
+    def __init__(self, dictionary, parameters=None, grid=(2, 2), overlap=80, workers=None, marker_ids=None):
+        """
+        :param dictionary: ArUco dictionary
+        :param parameters: cv2.aruco.DetectorParameters or None for defaults
+        :param grid: (columns, rows) of tiles
+        :param overlap: overlap of neighbour tiles, px
+        :param workers: threads in the pool, one per tile by default
+        :param marker_ids: ids of a restrict_dictionary() dictionary
+        """
+        self.dictionary = dictionary
+        self.parameters = parameters
+        self.marker_ids = marker_ids
+        self.grid = tuple(grid)
+        self.overlap = overlap
+        self.workers = workers or self.grid[0] * self.grid[1]
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._tiles = None
+        self._tile_parameters = None
+        self._shape = None
+
+    def tiles(self, shape):
+        """
+        :param shape: (height, width) of the frame
+        :return: list of (left, top, right, bottom) tiles, right and bottom exclusive
+        """
+        if shape != self._shape:
+            self._tile_parameters = []
+            height, width = shape[:2]
+            columns, rows = self.grid
+            tiles = []
+            for row in range(rows):
+                for column in range(columns):
+                    left = max(0, width * column // columns - self.overlap // 2)
+                    right = min(width, width * (column + 1) // columns + self.overlap // 2)
+                    top = max(0, height * row // rows - self.overlap // 2)
+                    bottom = min(height, height * (row + 1) // rows + self.overlap // 2)
+                    tiles.append((left, top, right, bottom))
+                    ratio = max(width, height) / max(right - left, bottom - top)
+                    self._tile_parameters.append(scale_parameters(self.parameters, ratio))
+            self._tiles = tiles
+            self._shape = shape
+        return self._tiles
+
+    def _detect_tile(self, gray, tile, parameters):
+        left, top, right, bottom = tile
+        corners, ids = detect_markers(gray[top:bottom, left:right], self.dictionary, parameters, self.marker_ids)
+        for marker_corners in corners:
+            marker_corners += (left, top)
+        return corners, ids
+
+    def detect(self, gray):
+        """
+        :return: (corners, ids) in frame coordinates, as cv2.aruco.detectMarkers returns them
+        """
+        tiles = self.tiles(gray.shape[:2])
+        results = self._pool.map(lambda tile, parameters: self._detect_tile(gray, tile, parameters),
+                                 tiles, self._tile_parameters)
+        corners = []
+        ids = []
+        centers = []
+        for tile_corners, tile_ids in results:
+            if tile_ids is None:
+                continue
+            for marker_corners, marker_id in zip(tile_corners, tile_ids[:, 0]):
+                center = marker_corners[0].mean(axis=0)
+                size = np.linalg.norm(marker_corners[0, 0] - marker_corners[0, 2])
+                # same marker seen in two overlapping tiles
+                if any(other_id == marker_id and np.linalg.norm(center - other_center) < size / 2
+                       for other_id, other_center in zip(ids, centers)):
+                    continue
+                corners.append(marker_corners)
+                ids.append(marker_id)
+                centers.append(center)
+        if not corners:
+            return (), None
+        return tuple(corners), np.array(ids, dtype=np.int32).reshape((-1, 1))
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class PyramidDetector:
+    """
+    Coarse-to-fine detection: markers are found on a downscaled image, their corners are then
+    refined with cv2.cornerSubPix on the full resolution image.
+    Detection cost drops roughly with the square of the scale, markers must however stay
+    large enough to be decoded on the downscaled image.
+    """
+
+    def __init__(self, dictionary, parameters=None, scale=2, window=None, detector=None, marker_ids=None):
+        """
+        :param dictionary: ArUco dictionary
+        :param parameters: cv2.aruco.DetectorParameters or None for defaults
+        :param scale: downscale factor
+        :param window: half size of the corner refinement window, px at full resolution, scale + 1 by default
+        :param detector: detector with detect(gray) used on the downscaled image (e.g. TiledDetector),
+                         single cv2.aruco.detectMarkers call by default
+        :param marker_ids: ids of a restrict_dictionary() dictionary
+        """
+        self.dictionary = dictionary
+        self.parameters = parameters
+        self.marker_ids = marker_ids
+        self.scale = scale
+        self.window = window if window is not None else scale + 1
+        self.detector = detector
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.01)
+        self._small = None
+
+    def detect(self, gray):
+        """
+        :return: (corners, ids) in full resolution coordinates, as cv2.aruco.detectMarkers returns them
+        """
+        height, width = gray.shape[:2]
+        size = (max(1, width // self.scale), max(1, height // self.scale))
+        if self._small is None or self._small.shape != (size[1], size[0]):
+            self._small = np.empty((size[1], size[0]), dtype=np.uint8)
+        cv2.resize(gray, size, dst=self._small, interpolation=cv2.INTER_AREA)
+        if self.detector is not None:
+            corners, ids = self.detector.detect(self._small)
+        else:
+            corners, ids = detect_markers(self._small, self.dictionary, self.parameters, self.marker_ids)
+        if ids is None or not len(corners):
+            return (), None
+        # pixel centers of the downscaled image to full resolution
+        factor = np.float32([width / size[0], height / size[1]])
+        points = ((np.concatenate(corners).reshape((-1, 1, 2)) + 0.5) * factor - 0.5).astype(np.float32)
+        cv2.cornerSubPix(gray, points, (self.window, self.window), (-1, -1), self.criteria)
+        return tuple(points.reshape((-1, 1, 4, 2))), ids
+
+    def close(self):
+        if self.detector is not None:
+            self.detector.close()
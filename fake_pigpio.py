@@ -0,0 +1,136 @@
+import time
+
+import pigpio
+
+MAX_WAVES = 250
+MAX_PULSES = 12000
+MAX_CBS = 25016
+
+
+class FakePi:
+    """
+    In-process stand-in for pigpio.pi, for tests and benchmarks without the daemon.
+    Keeps GPIO levels, modes and waveforms, enforces the daemon wave limits and
+    counts the calls. call_latency emulates the socket round trip of every call.
+    """
+
+    def __init__(self, call_latency=0.):
+        self.call_latency = call_latency
+        self.connected = True
+        self.calls = {}
+        self.modes = {}
+        self.levels = {}
+        self.pwm_frequencies = {}
+        self.pwm_dutycycles = {}
+        self.waves = {}
+        self.wave_tx = None
+        self.wave_mode = None
+        self._new_wave = []
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def stop(self):
+        self._call('stop')
+        self.connected = False
+
+    def set_mode(self, gpio, mode):
+        self._call('set_mode')
+        self.modes[gpio] = mode
+        return 0
+
+    def get_mode(self, gpio):
+        self._call('get_mode')
+        return self.modes.get(gpio, pigpio.INPUT)
+
+    def write(self, gpio, level):
+        self._call('write')
+        self.levels[gpio] = int(bool(level))
+        return 0
+
+    def read(self, gpio):
+        self._call('read')
+        return self.levels.get(gpio, 0)
+
+    def set_PWM_frequency(self, user_gpio, frequency):
+        self._call('set_PWM_frequency')
+        self.pwm_frequencies[user_gpio] = frequency
+        return frequency
+
+    def set_PWM_dutycycle(self, user_gpio, dutycycle):
+        self._call('set_PWM_dutycycle')
+        if not 0 <= dutycycle <= 255:
+            raise pigpio.error('GPIO_BAD_DUTYCYCLE')
+        self.pwm_dutycycles[user_gpio] = dutycycle
+        return 0
+
+    def wave_clear(self):
+        self._call('wave_clear')
+        self.waves = {}
+        self._new_wave = []
+        self.wave_tx = None
+        return 0
+
+    def wave_add_new(self):
+        self._call('wave_add_new')
+        self._new_wave = []
+        return 0
+
+    def wave_add_generic(self, pulses):
+        self._call('wave_add_generic')
+        self._new_wave.extend(pulses)
+        return len(self._new_wave)
+
+    def wave_create(self):
+        self._call('wave_create')
+        if len(self.waves) >= MAX_WAVES:
+            raise pigpio.error("'no more waveform ids'")
+        if sum(len(pulses) for pulses in self.waves.values()) + len(self._new_wave) > MAX_PULSES:
+            raise pigpio.error("'too many pulses'")
+        wave_id = next(i for i in range(MAX_WAVES) if i not in self.waves)
+        self.waves[wave_id] = self._new_wave
+        self._new_wave = []
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        self._call('wave_delete')
+        if wave_id not in self.waves:
+            raise pigpio.error("'non existent wave id'")
+        del self.waves[wave_id]
+        if self.wave_tx == wave_id:
+            self.wave_tx = None
+        return 0
+
+    def wave_send_repeat(self, wave_id):
+        return self.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_REPEAT)
+
+    def wave_send_using_mode(self, wave_id, mode):
+        self._call('wave_send_using_mode')
+        if wave_id not in self.waves:
+            raise pigpio.error("'non existent wave id'")
+        self.wave_tx = wave_id
+        self.wave_mode = mode
+        return len(self.waves[wave_id])
+
+    def wave_tx_at(self):
+        self._call('wave_tx_at')
+        return 9999 if self.wave_tx is None else self.wave_tx
+
+    def wave_tx_busy(self):
+        self._call('wave_tx_busy')
+        return int(self.wave_tx is not None)
+
+    def wave_tx_stop(self):
+        self._call('wave_tx_stop')
+        self.wave_tx = None
+        return 0
+
+    def wave_get_max_pulses(self):
+        self._call('wave_get_max_pulses')
+        return MAX_PULSES
+
+    def wave_get_max_cbs(self):
+        self._call('wave_get_max_cbs')
+        return MAX_CBS
@@ -0,0 +1,139 @@
+import math
+
+import cv2
+import numpy as np
+
+
+class CornerFlow:
+    """
+    Follows the marker corners of the last detection from frame to frame with pyramidal Lucas-Kanade
+    optical flow. Corners keep the ids of their markers, so the pose is solved by Markers.get_location
+    without ArUco detection on most frames.
+    Every corner is tracked forward and back, a marker is kept only if all its corners return within
+    max_error. Detection is due again every redetect_every frames, when fewer than min_markers markers
+    are left, or when the pose residual exceeds max_residual.
+    Only the area around the corners is read from the frames, search_margin must exceed the motion per frame.
+    """
+
+    def __init__(self, marker_ids, redetect_every=10, window=15, levels=2, max_error=1., max_residual=1.5,
+                 min_markers=2, search_margin=32):
+        """
+        :param marker_ids: ids of the constellation, corners of other markers are not tracked
+        :param redetect_every: frames tracked at most between two detections
+        :param window: side of the Lucas-Kanade search window, px
+        :param levels: pyramid levels above the full resolution
+        :param max_error: largest forward-backward error of a corner, px
+        :param max_residual: largest RMS corner residual of the pose fit, px
+        :param min_markers: fewest markers tracked to solve the pose
+        :param search_margin: margin of the area read around the corners, px
+        """
+        self.marker_ids = set(marker_ids)
+        self.redetect_every = redetect_every
+        self.window = window
+        self.levels = levels
+        self.max_error = max_error
+        self.max_residual = max_residual
+        self.min_markers = min_markers
+        self.search_margin = search_margin
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+        self.tracked = 0
+        self.lost = 0
+        self.reset()
+
+    def reset(self):
+        self._points = None
+        self._ids = None
+        self._area = None
+        self._previous = None
+        self._age = 0
+
+    @property
+    def due(self):
+        """
+        True if the next frame has to be detected
+        """
+        return self._points is None or self._age >= self.redetect_every
+
+    def _inside(self):
+        """
+        True if the points keep half the search margin from the edges of the area
+        """
+        left, top, right, bottom = self._area
+        low = self._points.min(axis=(0, 1))
+        high = self._points.max(axis=(0, 1))
+        half = self.search_margin / 2
+        return low[0] - left >= half and low[1] - top >= half and right - high[0] >= half and bottom - high[1] >= half
+
+    def _read(self, gray_area, resolution):
+        """
+        Keeps the area around the points of the frame for the next track()
+        """
+        width, height = resolution
+        low = self._points.min(axis=(0, 1)) - self.search_margin
+        high = self._points.max(axis=(0, 1)) + self.search_margin
+        self._area = (max(0, int(low[0])), max(0, int(low[1])), min(width, int(math.ceil(high[0])) + 1),
+                      min(height, int(math.ceil(high[1])) + 1))
+        # copy, frame buffers are reused
+        self._previous = np.array(gray_area(*self._area))
+
+    def start(self, gray_area, resolution, corners, ids):
+        """
+        Starts tracking from detected markers
+        :param gray_area: function(left, top, right, bottom) returning the gray image of a frame area,
+                          e.g. Frame.gray_area
+        :param resolution: (width, height) of the frame
+        :param corners: detected corners in frame coordinates, as cv2.aruco.detectMarkers returns them
+        :param ids: detected ids
+        """
+        self.reset()
+        if ids is None:
+            return
+        keep = [i for i, marker_id in enumerate(np.asarray(ids).reshape(-1)) if marker_id in self.marker_ids]
+        if len(keep) < self.min_markers:
+            return
+        self._points = np.array([corners[i] for i in keep], dtype=np.float32).reshape((-1, 1, 2))
+        self._ids = np.asarray(ids).reshape((-1, 1))[keep]
+        self._read(gray_area, resolution)
+
+    def track(self, gray_area, resolution):
+        """
+        :param gray_area: function(left, top, right, bottom) returning the gray image of a frame area
+        :return: (corners, ids) of the markers followed into the frame, None if detection is needed
+        """
+        left, top, right, bottom = self._area
+        current = gray_area(left, top, right, bottom)
+        offset = np.float32([left, top])
+        points = self._points - offset
+        size = (self.window, self.window)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._previous, current, points, None, winSize=size,
+                                                    maxLevel=self.levels, criteria=self.criteria)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(current, self._previous, moved, None, winSize=size,
+                                                        maxLevel=self.levels, criteria=self.criteria)
+        error = np.linalg.norm((back - points).reshape((-1, 4, 2)), axis=2).max(axis=1)
+        keep = status.reshape((-1, 4)).all(axis=1) & back_status.reshape((-1, 4)).all(axis=1) & \
+            (error <= self.max_error)
+        if keep.sum() < self.min_markers:
+            self.lost += 1
+            self.reset()
+            return None
+        self._points = (moved + offset).reshape((-1, 4, 1, 2))[keep].reshape((-1, 1, 2))
+        self._ids = self._ids[keep]
+        self._age += 1
+        if self._inside():
+            # same area in the next frame
+            self._previous = np.array(current)
+        else:
+            self._read(gray_area, resolution)
+        return tuple(self._points.reshape((-1, 1, 4, 2)).copy()), self._ids
+
+    def accept(self, location):
+        """
+        Checks the pose solved from the tracked corners, tracking stops if its residual is too large
+        :return: True if the pose is good
+        """
+        if location is not None and math.sqrt(location.cost / len(self._points)) <= self.max_residual:
+            self.tracked += 1
+            return True
+        self.lost += 1
+        self.reset()
+        return False
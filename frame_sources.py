@@ -0,0 +1,294 @@
+import glob
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+FORMATS = ('bgr', 'yuv')
+
+
+def raw_resolution(resolution):
+    """
+    Resolution of the buffers produced by the camera: width is padded to 32, height to 16
+    """
+    width, height = resolution
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+
+def yuv420_to_array(buffer, resolution):
+    """
+    Wraps a YUV420 (I420) buffer without copying.
+    Camera buffers may be padded (see raw_resolution), unpadded ones are accepted too.
+    :return: array of shape (height * 3 / 2, width) as expected by cv2.COLOR_YUV2BGR_I420,
+             Y plane is its [:height, :width] part
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    width, height = raw_resolution(resolution)
+    if data.size != width * height * 3 // 2:
+        width, height = resolution
+        if data.size != width * height * 3 // 2:
+            raise ValueError('Wrong YUV420 buffer size {} for resolution {}'.format(data.size, resolution))
+    return data.reshape((height * 3 // 2, width))
+
+
+class FrameSource:
+    """
+    Delivers frames to a writable output (WigglerCV) the same way picamera does:
+    start_recording(output) makes the source call output.write(buffer) for every frame.
+    """
+    resolution = None
+    framerate = None
+    format = 'bgr'
+
+    @property
+    def finished(self):
+        return False
+
+    @property
+    def frame_timestamp(self):
+        """
+        Sensor (or recording) time of the frame being delivered, seconds, None if unknown
+        """
+        return None
+
+    @property
+    def frame_number(self):
+        """
+        Number of the frame being delivered in its recording, None to number the frames as they arrive
+        """
+        return None
+
+    def to_array(self, buffer):
+        """
+        Converts a buffer passed to output.write() into an array: BGR frame of shape (height, width, 3)
+        or, for yuv format, I420 planes as returned by yuv420_to_array
+        """
+        return buffer
+
+    def start_recording(self, output):
+        raise NotImplementedError
+
+    def wait_recording(self, timeout=0):
+        time.sleep(timeout)
+
+    def stop_recording(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PiCameraSource(FrameSource):
+    def __init__(self, resolution, framerate, format='bgr'):
+        """
+        :param format: 'bgr' or 'yuv', the latter lets detection work on the Y plane without conversion
+        """
+        import picamera
+        from picamera.array import bytes_to_rgb
+
+        if format not in FORMATS:
+            raise ValueError('Unknown capture format: {}. Must be one of {}'.format(format, FORMATS))
+        self.format = format
+        self._bytes_to_rgb = bytes_to_rgb
+        self._camera = picamera.PiCamera(resolution='{}x{}'.format(*resolution), framerate=framerate)
+
+    @property
+    def resolution(self):
+        return tuple(self._camera.resolution)
+
+    @property
+    def framerate(self):
+        return float(self._camera.framerate)
+
+    @property
+    def frame_timestamp(self):
+        timestamp = self._camera.frame.timestamp
+        return timestamp / 1e6 if timestamp is not None else None
+
+    def to_array(self, buffer):
+        if self.format == 'yuv':
+            return yuv420_to_array(buffer, self._camera.resolution)
+        return self._bytes_to_rgb(buffer, self._camera.resolution)
+
+    def start_recording(self, output):
+        self._camera.start_recording(output, format=self.format)
+
+    def wait_recording(self, timeout=0):
+        self._camera.wait_recording(timeout)
+
+    def stop_recording(self):
+        self._camera.stop_recording()
+
+    def close(self):
+        self._camera.close()
+
+
+class ReplaySource(FrameSource):
+    """
+    Base class for offline sources. Frames are pushed from a thread either paced to
+    the recorded frame rate (realtime=True) or as fast as the output consumes them.
+    With format='yuv' BGR frames are converted to I420 before being pushed, like the camera delivers them.
+    """
+
+    def __init__(self, framerate=25., realtime=True, loop=False, format='bgr'):
+        if format not in FORMATS:
+            raise ValueError('Unknown capture format: {}. Must be one of {}'.format(format, FORMATS))
+        self.format = format
+        self.framerate = float(framerate)
+        self.realtime = realtime
+        self.loop = loop
+        self.frame_count = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    @property
+    def frame_timestamp(self):
+        return self.frame_count / self.framerate
+
+    def frames(self):
+        """
+        Generator of frames (numpy arrays) in the source format, to be implemented by subclasses
+        """
+        raise NotImplementedError
+
+    def start_recording(self, output):
+        self._stop.clear()
+        self._done.clear()
+        self._thread = threading.Thread(target=self._run, args=(output,))
+        self._thread.start()
+
+    def _run(self, output):
+        try:
+            start_time = time.perf_counter()
+            while True:
+                for frame in self.frames():
+                    if self.format == 'yuv' and frame.ndim == 3:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+                    if self._stop.is_set():
+                        return
+                    if self.realtime:
+                        delay = start_time + self.frame_count / self.framerate - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    output.write(frame)
+                    self.frame_count += 1
+                if not self.loop or self._stop.is_set():
+                    return
+        finally:
+            self._done.set()
+
+    def wait_recording(self, timeout=0):
+        self._done.wait(timeout)
+
+    def stop_recording(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+
+class VideoFileSource(ReplaySource):
+    def __init__(self, path, realtime=True, loop=False, format='bgr'):
+        self.path = path
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError('Cannot open video file: {}'.format(path))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.
+        self.resolution = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        capture.release()
+        super().__init__(framerate=fps, realtime=realtime, loop=loop, format=format)
+
+    def frames(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+
+
+class ImageDirectorySource(ReplaySource):
+    def __init__(self, path, framerate=25., realtime=True, loop=False, format='bgr'):
+        self.files = sorted(f for f in glob.glob(os.path.join(path, '*'))
+                            if f.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.files:
+            raise ValueError('No images found in {}'.format(path))
+        first = cv2.imread(self.files[0], cv2.IMREAD_COLOR)
+        self.resolution = (first.shape[1], first.shape[0])
+        super().__init__(framerate=framerate, realtime=realtime, loop=loop, format=format)
+
+    def frames(self):
+        for f in self.files:
+            frame = cv2.imread(f, cv2.IMREAD_COLOR)
+            if frame is not None:
+                yield frame
+
+
+class RawDumpSource(ReplaySource):
+    """
+    Frames from a .npy array of shape (n, height, width, 3) or from a headerless
+    raw BGR or I420 (.yuv) dump, which needs the resolution to be given.
+    """
+
+    def __init__(self, path, resolution=None, framerate=25., realtime=True, loop=False, format='bgr'):
+        self._yuv_dump = path.endswith('.yuv')
+        if path.endswith('.npy'):
+            self._data = np.load(path, mmap_mode='r')
+        else:
+            if resolution is None:
+                raise ValueError('Resolution is required for raw dump {}'.format(path))
+            width, height = resolution
+            shape = (height * 3 // 2, width) if self._yuv_dump else (height, width, 3)
+            frame_size = int(np.prod(shape))
+            self._data = np.memmap(path, dtype=np.uint8, mode='r')
+            self._data = self._data[:self._data.size // frame_size * frame_size].reshape((-1,) + shape)
+        if self._yuv_dump:
+            format = 'yuv'
+            self.resolution = tuple(resolution)
+        else:
+            if self._data.ndim != 4 or self._data.shape[3] != 3:
+                raise ValueError(
+                    'Wrong frame dump dimension: {}. Must be (n,height,width,3)'.format(self._data.shape))
+            self.resolution = (self._data.shape[2], self._data.shape[1])
+        super().__init__(framerate=framerate, realtime=realtime, loop=loop, format=format)
+
+    def frames(self):
+        for frame in self._data:
+            if self._yuv_dump:
+                yield frame
+            else:
+                # the dump is mapped read-only, OSD draws into the frame
+                yield np.array(frame)
+
+
+def open_source(spec, resolution=None, framerate=25., realtime=True, loop=False, format='bgr'):
+    """
+    Creates frame source from a path: flight recorder recording, directory of images, video file, .npy,
+    raw BGR or I420 dump
+    :param spec: path
+    :param resolution: (width, height), required for raw dumps only
+    :param framerate: frame rate for sources not having it recorded
+    :param realtime: pace frames at framerate, otherwise push them as fast as possible
+    :param loop: restart from the beginning when exhausted
+    :param format: format of the frames pushed to the output, 'bgr' or 'yuv'
+    """
+    if os.path.isdir(spec) and os.path.exists(os.path.join(spec, 'recording.json')):
+        from recorder import RecordingSource
+        return RecordingSource(spec, realtime=realtime, loop=loop, format=format)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, framerate=framerate, realtime=realtime, loop=loop, format=format)
+    if spec.endswith(('.npy', '.raw', '.bgr', '.yuv')):
+        return RawDumpSource(spec, resolution=resolution, framerate=framerate, realtime=realtime, loop=loop,
+                             format=format)
+    return VideoFileSource(spec, realtime=realtime, loop=loop, format=format)
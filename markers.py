@@ -1,17 +1,37 @@
+import types
 from collections import namedtuple
 
 import numpy as np
-from scipy import optimize
 
 Location1 = namedtuple('Location', ['coordinates', 'rotation_rad', 'scale', 'cost'])
 Location2 = namedtuple('Location', ['coordinates', 'rotscale', 'cost'])
+# pose published by WigglerCV, defined here so that pose consumers need not import the vision stack.
+# coordinates and rotscale in (undistorted) pixels, floor (x, y) in mm if the calibration has a floor mapping
+RobotLocation = namedtuple('RobotLocation', ['robot', 'coordinates', 'rotscale', 'cost', 'frame', 'timestamp',
+                                             'latency', 'floor'], defaults=(None,))
+location_dtype = np.dtype([('coordinates', np.float64, (2,)), ('rotscale', np.float64, (2,)), ('cost', np.float64)])
 
 
-class Markers:
-    marker_size = 15.
-    marker_distance = 35.
-    marker_ids = [42, 18, 12]
+def reference_blocks(markers):
+    """
+    Reference corners indexed by marker ID
+    :param markers: dict {marker ID: homogeneous corners (3,4)}
+    :return: (array (max ID + 1, 4, 2) of corners, boolean array (max ID + 1) of known IDs)
+    """
+    blocks = np.zeros((max(markers.keys()) + 1, 4, 2))
+    known = np.zeros(blocks.shape[0], dtype=bool)
+    for marker_id, marker in markers.items():
+        blocks[marker_id] = marker[:2].T
+        known[marker_id] = True
+    return blocks, known
 
+
+def constellation_markers(marker_ids, marker_size, marker_distance, angle):
+    """
+    Corners of the constellation markers: k-th marker is marker_distance away from the center,
+    rotated by k * angle
+    :return: dict {marker ID: homogeneous corners (3,4)}
+    """
     marker_corners = np.array([
         [marker_size / 2, -marker_size / 2, 1],
         [marker_size / 2, marker_size / 2, 1],
@@ -19,21 +39,87 @@ class Markers:
         [-marker_size / 2, -marker_size / 2, 1],
     ]).transpose()
 
-    angle = 120. / 180. * np.pi
     translation = np.array([
         [1, 0, marker_distance],
         [0, 1, 0],
         [0, 0, 1]
     ])
-    rotation = np.array([
-        [np.cos(angle), -np.sin(angle), 0],
-        [np.sin(angle), np.cos(angle), 0],
-        [0, 0, 1]
-    ])
-    markers = dict(zip(marker_ids, [np.dot(translation, marker_corners),
-                                    np.dot(np.dot(rotation, translation), marker_corners),
-                                    np.dot(np.dot(np.dot(rotation, rotation), translation), marker_corners)
-                                    ]))
+    markers = {}
+    for k, marker_id in enumerate(marker_ids):
+        rotation = np.array([
+            [np.cos(k * angle), -np.sin(k * angle), 0],
+            [np.sin(k * angle), np.cos(k * angle), 0],
+            [0, 0, 1]
+        ])
+        markers[marker_id] = np.dot(np.dot(rotation, translation), marker_corners)
+    return markers
+
+
+class constellationmethod:
+    """
+    Method of a constellation. Called on a Markers instance it uses that constellation,
+    called on the Markers class itself it uses the default one defined by the class attributes.
+    """
+
+    def __init__(self, function):
+        self.__func__ = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        return types.MethodType(self.__func__, owner if instance is None else instance)
+
+
+class Markers:
+    """
+    Constellation of ArUco markers on a robot.
+    Class attributes describe the default constellation, instances describe other ones:
+    Markers(marker_ids=[7, 8, 9], marker_size=20.)
+    """
+    marker_size = 15.
+    marker_distance = 35.
+    marker_ids = [42, 18, 12]
+    angle = 120. / 180. * np.pi
+    name = None
+
+    markers = constellation_markers(marker_ids, marker_size, marker_distance, angle)
+    marker_blocks, known_ids = reference_blocks(markers)
+    radius = marker_distance + marker_size / np.sqrt(2)
+
+    def __init__(self, marker_ids=None, marker_size=None, marker_distance=None, angle=None, name=None):
+        """
+        :param marker_ids: IDs of the markers, k-th one is rotated by k * angle around the center
+        :param marker_size: marker side, mm
+        :param marker_distance: distance of the marker centers from the constellation center, mm
+        :param angle: angle between neighbour markers, radians
+        :param name: name of the robot carrying the constellation
+        """
+        if marker_ids is not None:
+            self.marker_ids = list(marker_ids)
+        if marker_size is not None:
+            self.marker_size = float(marker_size)
+        if marker_distance is not None:
+            self.marker_distance = float(marker_distance)
+        if angle is not None:
+            self.angle = float(angle)
+        self.name = name
+        self.markers = constellation_markers(self.marker_ids, self.marker_size, self.marker_distance, self.angle)
+        self.marker_blocks, self.known_ids = reference_blocks(self.markers)
+        self.radius = self.marker_distance + self.marker_size / np.sqrt(2)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: dict with optional name, marker_ids, marker_size, marker_distance and angle_deg keys
+        """
+        angle_deg = config.get('angle_deg')
+        return cls(marker_ids=config.get('marker_ids'),
+                   marker_size=config.get('marker_size'),
+                   marker_distance=config.get('marker_distance'),
+                   angle=angle_deg / 180. * np.pi if angle_deg is not None else None,
+                   name=config.get('name'))
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(name={!r}, marker_ids={!r})'.format(self.name, self.marker_ids)
 
     @classmethod
     def error_function(cls, position, reference_corners, input_corners):
@@ -48,13 +134,104 @@ class Markers:
         r_diffs = np.square(diffs[0, :]) + np.square(diffs[1, :])
         return r_diffs
 
-    @classmethod
-    def get_location(cls, corners, ids):
+    @constellationmethod
+    def get_location(self, corners, ids):
+        """
+        Finds position of the constellation as a least squares fit of a 2D similarity transform
+        (rotation, scale and translation) of the reference corners onto the detected ones.
+        Closed form solution: the transform is estimated on centered point sets (Procrustes).
+        :param corners: detected corners as returned by cv2.aruco.detectMarkers, (n,1,4,2)
+        :param ids: detected IDs, (n,1)
+        :return: Location2 or None if no marker of the constellation is detected
+        """
+        c = np.asarray(corners, dtype=np.float64)
+        if c.ndim != 4 or c.shape[1:] != (1, 4, 2):
+            raise ValueError('Wrong corners dimension: {}. Must be (n,1,4,2)'.format(c.shape))
+        i = np.asarray(ids).reshape(-1)
+        count = min(c.shape[0], i.shape[0])
+        c = c[:count, 0]
+        i = i[:count]
+        valid = (i >= 0) & (i < self.known_ids.shape[0]) & self.known_ids.take(i, mode='clip')
+        if not valid.all():
+            if not valid.any():
+                return None
+            c = c[valid]
+            i = i[valid]
+
+        # rows of (reference x, reference y, detected x, detected y), the fit on centered point sets
+        # only needs their sums and the sums of their pairwise products
+        points = np.concatenate((self.marker_blocks[i], c), axis=2).reshape((-1, 4))
+        rsx, rsy, dsx, dsy = points.sum(axis=0).tolist()
+        products = np.dot(points.T, points).tolist()
+        x, y, scale_cos, scale_sin, cost = self.similarity_fit(points.shape[0], rsx, rsy, dsx, dsy, products)
+        return Location2(coordinates=[x, y],
+                         rotscale=[scale_cos, scale_sin],
+                         cost=max(0., cost))
+
+    @staticmethod
+    def similarity_fit(n, rsx, rsy, dsx, dsy, products):
+        """
+        Least squares similarity transform from the sums of n (reference x, reference y, detected x, detected y)
+        rows and the 4x4 sums of their pairwise products. Works on scalars and element-wise on arrays.
+        :return: x, y, scale * cos(angle), scale * sin(angle), sum of squared residuals
+        """
+        rr = products[0][0] + products[1][1] - (rsx * rsx + rsy * rsy) / n
+        dd = products[2][2] + products[3][3] - (dsx * dsx + dsy * dsy) / n
+        scale_cos = (products[0][2] + products[1][3] - (rsx * dsx + rsy * dsy) / n) / rr
+        scale_sin = (products[0][3] - products[1][2] - (rsx * dsy - rsy * dsx) / n) / rr
+        x = (dsx - scale_cos * rsx + scale_sin * rsy) / n
+        y = (dsy - scale_sin * rsx - scale_cos * rsy) / n
+        return x, y, scale_cos, scale_sin, dd - (scale_cos * scale_cos + scale_sin * scale_sin) * rr
+
+    @constellationmethod
+    def get_locations_batch(self, corners_list, ids_list):
+        """
+        Batched get_location for many frames, e.g. a recorded run.
+        Each frame may see a different subset of the constellation markers.
+        :param corners_list: corners per frame as returned by cv2.aruco.detectMarkers
+        :param ids_list: IDs per frame as returned by cv2.aruco.detectMarkers (None if nothing detected)
+        :return: structured array of location_dtype, one row per frame, NaN for frames without constellation markers
+        """
+        frame_count = len(corners_list)
+        result = np.full(frame_count, np.nan, dtype=location_dtype)
+        counts = [0 if ids is None else min(len(corners), len(ids)) for corners, ids in zip(corners_list, ids_list)]
+        if not any(counts):
+            return result
+        c = np.array([marker for corners, count in zip(corners_list, counts) if count for marker in corners[:count]],
+                     dtype=np.float64).reshape((-1, 4, 2))
+        i = np.array([marker_id for ids, count in zip(ids_list, counts) if count for marker_id in ids[:count]],
+                     dtype=np.int64).reshape(-1)
+        frames = np.repeat(np.arange(frame_count), counts)
+        valid = (i >= 0) & (i < self.known_ids.shape[0]) & self.known_ids.take(i, mode='clip')
+        if not valid.any():
+            return result
+        c, i, frames = c[valid], i[valid], frames[valid]
+
+        # per marker sums of the (reference x, reference y, detected x, detected y) rows and of their products,
+        # then per frame sums: markers of a frame are contiguous
+        points = np.concatenate((self.marker_blocks[i], c), axis=2)
+        sums = points.sum(axis=1)
+        products = np.einsum('mki,mkj->mij', points, points)
+        located, starts, markers = np.unique(frames, return_index=True, return_counts=True)
+        sums = np.add.reduceat(sums, starts, axis=0)
+        products = np.add.reduceat(products, starts, axis=0).transpose((1, 2, 0))
+        x, y, scale_cos, scale_sin, cost = self.similarity_fit(markers * 4, sums[:, 0], sums[:, 1], sums[:, 2],
+                                                              sums[:, 3], products)
+        result['coordinates'][located] = np.column_stack((x, y))
+        result['rotscale'][located] = np.column_stack((scale_cos, scale_sin))
+        result['cost'][located] = np.maximum(0., cost)
+        return result
+
+    @constellationmethod
+    def get_location_lstsq(self, corners, ids):
+        """
+        Reference implementation of get_location solving the overdetermined linear system with np.linalg.lstsq
+        """
         aligned_markers = []
         for i in ids:
             i = i[0]
-            if i in cls.markers:
-                aligned_markers.append(cls.markers[i])
+            if i in self.markers:
+                aligned_markers.append(self.markers[i])
         a = np.array(aligned_markers)
         if a.shape == (0,):
             return None
@@ -68,28 +245,18 @@ class Markers:
         d = c.reshape((b.shape[0] * b.shape[1], 2))
         input_corners = np.vstack((d.T, np.ones(d.shape[0])))
 
-        position_guess = np.array([0., 0., 0., 1.])
-        if False:
-            opt_result = optimize.least_squares(cls.error_function, position_guess,
-                                                args=(reference_corners, input_corners))
-            # noinspection PyUnresolvedReferences
-            position = Location1(coordinates=[opt_result.x[0], opt_result.x[1]],
-                                 rotation_rad=opt_result.x[2],
-                                 scale=opt_result.x[3],
-                                 cost=opt_result.cost)
-        else:
-            A_matrix = []
-            b_vector = []
-            for col in range(input_corners.shape[1]):
-                ic = input_corners[:, col]
-                rc = reference_corners[:, col]
-                A_matrix.append([1., 0., rc[0], -rc[1]])
-                b_vector.append(ic[0])
-                A_matrix.append([0., 1., rc[1], rc[0]])
-                b_vector.append(ic[1])
-            x, residuals, rank, s = np.linalg.lstsq(A_matrix, b_vector)
-            position = Location2(coordinates=[x[0], x[1]],
-                                 rotscale=[x[2], x[3]],
-                                 cost=residuals[0])
+        A_matrix = []
+        b_vector = []
+        for col in range(input_corners.shape[1]):
+            ic = input_corners[:, col]
+            rc = reference_corners[:, col]
+            A_matrix.append([1., 0., rc[0], -rc[1]])
+            b_vector.append(ic[0])
+            A_matrix.append([0., 1., rc[1], rc[0]])
+            b_vector.append(ic[1])
+        x, residuals, rank, s = np.linalg.lstsq(A_matrix, b_vector)
+        position = Location2(coordinates=[x[0], x[1]],
+                             rotscale=[x[2], x[3]],
+                             cost=residuals[0])
 
         return position
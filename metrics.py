@@ -0,0 +1,240 @@
+import json
+import threading
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Rolling window of the last samples, percentiles are computed on demand.
+    count and total cover all samples ever added.
+    """
+
+    def __init__(self, window=1000):
+        self._samples = np.zeros(window)
+        self._next = 0
+        self._size = 0
+        self.count = 0
+        self.total = 0.
+
+    def add(self, value):
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % len(self._samples)
+        self._size = min(self._size + 1, len(self._samples))
+        self.count += 1
+        self.total += value
+
+    @property
+    def samples(self):
+        """
+        Samples in the window, oldest first
+        """
+        if self._size < len(self._samples):
+            return self._samples[:self._size].copy()
+        return np.roll(self._samples, -self._next)
+
+    def resize(self, window):
+        """
+        Changes the window, the newest samples are kept
+        """
+        samples = self.samples[-window:]
+        self._samples = np.zeros(window)
+        self._samples[:len(samples)] = samples
+        self._size = len(samples)
+        self._next = self._size % window
+
+    def summary(self):
+        """
+        :return: dict of count, sum, mean, p50, p95, p99 and max over the window
+        """
+        samples = self.samples
+        result = {'count': self.count, 'sum': self.total}
+        if len(samples):
+            result['mean'] = float(samples.mean())
+            result['max'] = float(samples.max())
+            for quantile, value in zip(QUANTILES, np.percentile(samples, [q * 100 for q in QUANTILES])):
+                result['p{:g}'.format(quantile * 100)] = float(value)
+        return result
+
+
+class Metrics:
+    """
+    Thread safe collection of histograms (durations in seconds), counters and gauges.
+    Collectors are called before every snapshot to refresh gauges of state owned elsewhere.
+    """
+
+    def __init__(self, window=1000, prefix='wiggler'):
+        """
+        :param window: histogram window in samples
+        :param prefix: prefix of the Prometheus metric names
+        """
+        self._window = window
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._labeled_gauges = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @property
+    def window(self):
+        return self._window
+
+    @window.setter
+    def window(self, window):
+        """
+        Resizes the existing histograms too
+        """
+        with self._lock:
+            self._window = window
+            for histogram in self._histograms.values():
+                histogram.resize(window)
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self._window)
+            histogram.add(value)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        :param labels: label values of one series of the gauge, e.g. robot='wigglebot', so that names
+                       chosen by the user stay out of the metric name
+        """
+        with self._lock:
+            if labels:
+                self._labeled_gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+            else:
+                self._gauges[name] = value
+
+    def add_collector(self, collector):
+        """
+        :param collector: function taking this Metrics instance, called before each snapshot
+        """
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._labeled_gauges.clear()
+
+    def _collect(self):
+        """
+        :return: (histogram summaries, counters, gauges, {name: {labels: value}} of the labeled gauges)
+        """
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                print(e)
+        with self._lock:
+            return ({name: histogram.summary() for name, histogram in self._histograms.items()},
+                    dict(self._counters), dict(self._gauges),
+                    {name: dict(series) for name, series in self._labeled_gauges.items()})
+
+    def snapshot(self):
+        """
+        :return: {'histograms': {name: summary}, 'counters': {name: value}, 'gauges': {name: value}},
+                 the value of a labeled gauge is {label values joined by ',': value}
+        """
+        histograms, counters, gauges, labeled_gauges = self._collect()
+        for name, series in labeled_gauges.items():
+            gauges[name] = {','.join(str(value) for _, value in labels): value for labels, value in series.items()}
+        return {'histograms': histograms, 'counters': counters, 'gauges': gauges}
+
+    def prometheus(self):
+        """
+        :return: snapshot in the Prometheus text exposition format, histograms as summaries
+        """
+        histograms, counters, gauges, labeled_gauges = self._collect()
+        lines = []
+        for name, summary in sorted(histograms.items()):
+            metric = '{}_{}_seconds'.format(self.prefix, name)
+            lines.append('# TYPE {} summary'.format(metric))
+            for quantile in QUANTILES:
+                value = summary.get('p{:g}'.format(quantile * 100))
+                if value is not None:
+                    lines.append('{}{{quantile="{:g}"}} {!r}'.format(metric, quantile, value))
+            lines.append('{}_sum {!r}'.format(metric, summary['sum']))
+            lines.append('{}_count {}'.format(metric, summary['count']))
+        for name, value in sorted(counters.items()):
+            metric = '{}_{}_total'.format(self.prefix, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+        for name in sorted(set(gauges) | set(labeled_gauges)):
+            metric = '{}_{}'.format(self.prefix, name)
+            lines.append('# TYPE {} gauge'.format(metric))
+            if name in gauges:
+                lines.append('{} {}'.format(metric, gauges[name]))
+            for labels, value in sorted(labeled_gauges.get(name, {}).items()):
+                lines.append('{}{{{}}} {}'.format(metric, ','.join('{}="{}"'.format(key, _escape(label))
+                                                                   for key, label in labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(label):
+    """
+    Label value escaped for the Prometheus text format
+    """
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint: /metrics in the Prometheus text format, /stats as JSON
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        """
+        :param port: 0 picks a free port, see address
+        """
+        # imported when serving only, it adds to the start-up time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+        server_metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = server_metrics.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif path == '/stats':
+                    body = json.dumps(server_metrics.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
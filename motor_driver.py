@@ -0,0 +1,115 @@
+import threading
+import time
+
+
+class MotorDriver:
+    """
+    Decouples motor commands from the motors: set() only stores the latest speeds, a dedicated thread
+    applies them at a fixed rate. Commands arriving between two flushes are coalesced into the last one
+    and unchanged speeds are not written again.
+    Works with vibromotors.Motors and sonicmotors.Motors, or anything with set(speeds) and off().
+    """
+
+    def __init__(self, motors, rate=50., start=True):
+        """
+        :param motors: motors to drive
+        :param rate: flushes per second
+        :param start: start the flushing thread, otherwise call flush() explicitly
+        """
+        self.motors = motors
+        self.rate = rate
+        self.commands = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.errors = 0
+        # time from set() to the write of the command, seconds, of the last write
+        self.command_latency = 0.
+        self._pending = None
+        self._pending_time = None
+        self._applied = None
+        self._lock = threading.Lock()
+        self._motors_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='motor-driver', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        period = 1. / self.rate
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            self.flush()
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                # flush took longer than the period, do not try to catch up
+                next_time = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def set(self, speeds):
+        """
+        Commands the speeds, applied by the next flush. Never blocks on the motors.
+        """
+        speeds = tuple(speeds)
+        with self._lock:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = speeds
+            self._pending_time = time.perf_counter()
+            self.commands += 1
+
+    def flush(self):
+        """
+        Applies the latest command if it differs from the applied one
+        :return: True if the motors were written
+        """
+        with self._lock:
+            speeds = self._pending
+            set_time = self._pending_time
+            self._pending = None
+        if speeds is None or speeds == self._applied:
+            return False
+        with self._motors_lock:
+            try:
+                self.motors.set(speeds)
+            except Exception as e:
+                self.errors += 1
+                print(e)
+                return False
+            self._applied = speeds
+            self.writes += 1
+            self.command_latency = time.perf_counter() - set_time
+        return True
+
+    def off(self):
+        """
+        Stops the motors right away, discarding the pending command
+        """
+        with self._lock:
+            self._pending = None
+        with self._motors_lock:
+            self.motors.off()
+            self._applied = None
+
+    def close(self):
+        """
+        Applies the pending command and stops the thread
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
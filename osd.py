@@ -0,0 +1,141 @@
+import collections
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+OsdText = namedtuple('OsdText', ['x', 'y', 'text'])
+OsdDot = namedtuple('OsdDot', ['x', 'y'])
+OsdVector = namedtuple('OsdVector', ['x1', 'y1', 'x2', 'y2'])
+
+TEXT_COLOR = (255, 255, 255)
+DOT_COLOR = (0, 0, 255)
+VECTOR_COLOR = (0, 255, 0)
+
+
+class Sprite:
+    """
+    Rendered OSD item, blended into frames as frame * (255 - alpha) / 255 + color * alpha / 255
+    """
+
+    def __init__(self, left, top, mask, color):
+        """
+        :param left, top: position of the mask in the frame
+        :param mask: uint8 coverage of the item, 255 fully covered
+        :param color: BGR color
+        """
+        self.left = left
+        self.top = top
+        alpha = mask[:, :, None].astype(np.uint16)
+        self.premultiplied = ((alpha * np.array(color, dtype=np.uint16) + 127) // 255).astype(np.uint8)
+        self.inverse = np.repeat(255 - mask[:, :, None], 3, axis=2)
+        self._scratch = np.empty_like(self.inverse)
+
+    def draw(self, image):
+        height, width = self.inverse.shape[:2]
+        left = max(0, self.left)
+        top = max(0, self.top)
+        right = min(image.shape[1], self.left + width)
+        bottom = min(image.shape[0], self.top + height)
+        if right <= left or bottom <= top:
+            return
+        area = image[top:bottom, left:right]
+        rows = slice(top - self.top, bottom - self.top)
+        columns = slice(left - self.left, right - self.left)
+        scratch = self._scratch[rows, columns]
+        cv2.multiply(area, self.inverse[rows, columns], dst=scratch, scale=1 / 255.)
+        cv2.add(scratch, self.premultiplied[rows, columns], dst=area)
+
+
+class TextCache:
+    """
+    LRU cache of anti-aliased text masks, thread safe: layers updated from different threads share it
+    """
+
+    def __init__(self, font=cv2.FONT_HERSHEY_SIMPLEX, font_scale=0.5, thickness=1, size=256):
+        """
+        :param size: number of strings kept
+        """
+        self.font = font
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.size = size
+        self.padding = thickness + 1
+        self.misses = 0
+        self._masks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def text(self, text):
+        """
+        :return: (mask, (x, y)) mask of the string and the putText origin within it
+        """
+        with self._lock:
+            entry = self._masks.get(text)
+            if entry is not None:
+                self._masks.move_to_end(text)
+                return entry
+            self.misses += 1
+            (width, height), baseline = cv2.getTextSize(text, self.font, self.font_scale, self.thickness)
+            origin = (self.padding, self.padding + height)
+            mask = np.zeros((height + baseline + 2 * self.padding, width + 2 * self.padding), dtype=np.uint8)
+            cv2.putText(mask, text, origin, self.font, self.font_scale, 255, self.thickness, cv2.LINE_AA)
+            entry = self._masks[text] = (mask, origin)
+            if len(self._masks) > self.size:
+                self._masks.popitem(last=False)
+            return entry
+
+
+class OsdLayer:
+    """
+    Cached OSD overlay. Every item is rendered once into a sprite, items unchanged since the last update
+    keep their sprite, so drawing a static OSD only blends the bounding boxes of the items into the frame.
+    """
+
+    def __init__(self, texts=None):
+        """
+        :param texts: TextCache, may be shared by several layers
+        """
+        self.texts = texts if texts is not None else TextCache()
+        self.rendered = 0
+        self._sprites = collections.OrderedDict()
+
+    def update(self, items):
+        """
+        Sets the items of the layer, renders only the new ones
+        """
+        sprites = collections.OrderedDict()
+        for item in items:
+            if item in sprites:
+                continue
+            sprite = self._sprites.get(item)
+            if sprite is None:
+                sprite = self._render(item)
+                self.rendered += 1
+            sprites[item] = sprite
+        self._sprites = sprites
+
+    def draw(self, image):
+        for sprite in self._sprites.values():
+            sprite.draw(image)
+
+    def _render(self, item):
+        if isinstance(item, OsdText):
+            mask, (x, y) = self.texts.text(item.text)
+            return Sprite(int(item.x) - x, int(item.y) - y, mask, TEXT_COLOR)
+        elif isinstance(item, OsdDot):
+            # circle of radius 2 drawn with thickness 3
+            left, top = int(item.x) - 4, int(item.y) - 4
+            mask = np.zeros((9, 9), dtype=np.uint8)
+            cv2.circle(mask, (4, 4), radius=2, color=255, thickness=3)
+            return Sprite(left, top, mask, DOT_COLOR)
+        elif isinstance(item, OsdVector):
+            x1, y1, x2, y2 = int(item.x1), int(item.y1), int(item.x2), int(item.y2)
+            # arrow tip is 10% of the length, line thickness 2
+            padding = 4 + int(0.1 * np.hypot(x2 - x1, y2 - y1))
+            left, top = min(x1, x2) - padding, min(y1, y2) - padding
+            mask = np.zeros((abs(y2 - y1) + 2 * padding + 1, abs(x2 - x1) + 2 * padding + 1), dtype=np.uint8)
+            cv2.arrowedLine(mask, (x1 - left, y1 - top), (x2 - left, y2 - top), color=255, thickness=2,
+                            line_type=cv2.LINE_AA)
+            return Sprite(left, top, mask, VECTOR_COLOR)
+        raise ValueError('Unknown OSD item: {!r}'.format(item))
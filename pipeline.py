@@ -0,0 +1,144 @@
+import collections
+import threading
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class StageQueue:
+    """
+    Bounded queue in front of a pipeline stage.
+    When full, put() applies the drop policy:
+    drop_oldest discards the queued item nobody has looked at yet, so the stage always gets the freshest one,
+    drop_newest discards the item being put,
+    block waits for the stage to take an item (back-pressure).
+    """
+
+    def __init__(self, maxsize=1, drop_policy=DROP_OLDEST):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError('Unknown drop policy: {}. Must be one of {}'.format(drop_policy, DROP_POLICIES))
+        self.maxsize = max(1, int(maxsize))
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._items = collections.deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        :return: False if an item was dropped
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.drop_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.drop_policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    self._items.append(item)
+                    self._cond.notify_all()
+                    return False
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self):
+        """
+        :return: next item, None once the queue is closed and the items queued before are taken
+        """
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """
+        Wakes up a blocked put(), items already queued are still handed out by get()
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Pipeline:
+    """
+    Chain of stages, each running on its own thread and fed through a StageQueue.
+    A stage is a function taking an item and returning it (or None to stop it there).
+    """
+
+    def __init__(self, stages, queue_size=1, drop_policy=None):
+        """
+        :param stages: list of (name, function)
+        :param queue_size: size of each stage queue
+        :param drop_policy: policy name or dict {stage name: policy}, drop_oldest by default
+        """
+        if not isinstance(drop_policy, dict):
+            drop_policy = {name: drop_policy or DROP_OLDEST for name, _ in stages}
+        self.stages = stages
+        self.queues = collections.OrderedDict(
+            (name, StageQueue(queue_size, drop_policy.get(name, DROP_OLDEST))) for name, _ in stages)
+        self._threads = []
+
+    def start(self):
+        names = list(self.queues.keys())
+        for i, (name, function) in enumerate(self.stages):
+            next_queue = self.queues[names[i + 1]] if i + 1 < len(names) else None
+            thread = threading.Thread(target=self._run_stage, args=(self.queues[name], function, next_queue),
+                                      name='stage-' + name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _run_stage(stage_queue, function, next_queue):
+        while True:
+            item = stage_queue.get()
+            if item is None:
+                break
+            try:
+                item = function(item)
+            except Exception as e:
+                print(e)
+                continue
+            if item is not None and next_queue is not None:
+                next_queue.put(item)
+
+    def put(self, item):
+        """
+        Feeds the first stage
+        :return: False if an item was dropped
+        """
+        return next(iter(self.queues.values())).put(item)
+
+    def stop(self):
+        """
+        Stops the stages in order, each one finishes the items queued in front of it and hands them over
+        to the next one before that is closed
+        """
+        for q, thread in zip(self.queues.values(), self._threads):
+            q.close()
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+
+    @property
+    def dropped(self):
+        return {name: q.dropped for name, q in self.queues.items()}
+
+    @property
+    def depth(self):
+        return {name: len(q) for name, q in self.queues.items()}
@@ -0,0 +1,248 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from frame_sources import ReplaySource
+
+FORMATS = ('gray', 'yuv', 'bgr')
+META_FILE = 'recording.json'
+FRAMES_FILE = 'frames.ring'
+INDEX_FILE = 'index.bin'
+POSES_FILE = 'poses.bin'
+# frame is -1 while the slot is written
+INDEX_DTYPE = np.dtype([('frame', '<i8'), ('timestamp', '<f8'), ('capture_time', '<f8')])
+POSE_DTYPE = np.dtype([('frame', '<i8'), ('timestamp', '<f8'), ('robot', 'S32'), ('x', '<f8'), ('y', '<f8'),
+                       ('rotscale_x', '<f8'), ('rotscale_y', '<f8'), ('cost', '<f8'), ('latency', '<f8')])
+
+
+def frame_shape(resolution, format):
+    width, height = resolution
+    if format == 'gray':
+        return height, width
+    if format == 'yuv':
+        return height * 3 // 2, width
+    return height, width, 3
+
+
+def i420_planes(yuv, resolution):
+    """
+    Y, U and V planes of an I420 array as returned by frame_sources.yuv420_to_array, padded or not
+    """
+    width, height = resolution
+    padded_height = yuv.shape[0] * 2 // 3
+    padded_width = yuv.shape[1]
+    chroma = yuv.reshape(-1)[padded_width * padded_height:].reshape((2, padded_height // 2, padded_width // 2))
+    return (yuv[:height, :width], chroma[0, :height // 2, :width // 2], chroma[1, :height // 2, :width // 2])
+
+
+class FlightRecorder:
+    """
+    Records frames into a preallocated memory-mapped ring file, the last slots frames are kept.
+    Every slot has an index entry with the frame number and timestamps, poses are appended
+    to a binary log. Recording a frame is a copy into the mapped file (a conversion for BGR frames
+    recorded as gray or yuv), the operating system writes the pages out in the background.
+    """
+
+    def __init__(self, path, resolution, slots=750, format='gray', framerate=25.):
+        """
+        :param path: directory of the recording, an existing recording is overwritten
+        :param resolution: (width, height), both even
+        :param slots: frames kept
+        :param format: 'gray' for the Y plane only, 'yuv' for I420 or 'bgr'
+        """
+        if format not in FORMATS:
+            raise ValueError('Unknown recording format: {}. Must be one of {}'.format(format, FORMATS))
+        self.path = path
+        self.resolution = tuple(resolution)
+        self.slots = slots
+        self.format = format
+        self.recorded = 0
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump({'resolution': list(self.resolution), 'slots': slots, 'format': format,
+                       'framerate': framerate}, f)
+        self._frames = np.memmap(os.path.join(path, FRAMES_FILE), dtype=np.uint8, mode='w+',
+                                 shape=(slots,) + frame_shape(self.resolution, format))
+        self._index = np.memmap(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE, mode='w+', shape=(slots,))
+        self._index['frame'] = -1
+        self._poses = open(os.path.join(path, POSES_FILE), 'wb')
+        self._pose = np.zeros(1, dtype=POSE_DTYPE)
+
+    def write(self, frame):
+        """
+        :param frame: wiggler_cv.Frame
+        """
+        slot = self.recorded % self.slots
+        entry = self._index[slot:slot + 1]
+        entry['frame'] = -1
+        data = self._frames[slot]
+        if self.format == 'gray':
+            if frame.gray is not None:
+                np.copyto(data, frame.gray)
+            else:
+                cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY, dst=data)
+        elif self.format == 'yuv':
+            if frame.yuv is not None:
+                y, u, v = i420_planes(data, self.resolution)
+                for plane, source in zip((y, u, v), i420_planes(frame.yuv, self.resolution)):
+                    np.copyto(plane, source)
+            else:
+                cv2.cvtColor(frame.image, cv2.COLOR_BGR2YUV_I420, dst=data)
+        else:
+            np.copyto(data, frame.image)
+        entry['timestamp'] = frame.timestamp
+        entry['capture_time'] = frame.capture_time
+        entry['frame'] = frame.index
+        self.recorded += 1
+
+    def add_pose(self, location):
+        """
+        :param location: wiggler_cv.RobotLocation
+        """
+        pose = self._pose[0]
+        pose['frame'] = location.frame
+        pose['timestamp'] = location.timestamp
+        pose['robot'] = location.robot.encode()
+        pose['x'], pose['y'] = location.coordinates
+        pose['rotscale_x'], pose['rotscale_y'] = location.rotscale
+        pose['cost'] = location.cost
+        pose['latency'] = location.latency
+        self._poses.write(self._pose.tobytes())
+
+    def flush(self):
+        self._frames.flush()
+        self._index.flush()
+        self._poses.flush()
+
+    def close(self):
+        self.flush()
+        self._poses.close()
+        del self._frames
+        del self._index
+
+
+class FlightRecording:
+    """
+    Reads a recording of FlightRecorder, also while it is being recorded
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.resolution = tuple(meta['resolution'])
+        self.slots = meta['slots']
+        self.format = meta['format']
+        self.framerate = meta['framerate']
+        self._frames = np.memmap(os.path.join(path, FRAMES_FILE), dtype=np.uint8, mode='r',
+                                 shape=(self.slots,) + frame_shape(self.resolution, self.format))
+        self._index = np.memmap(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE, mode='r', shape=(self.slots,))
+        self.reload()
+
+    def reload(self):
+        """
+        Rereads the index and the pose log
+        """
+        index = np.array(self._index)
+        slots = np.flatnonzero(index['frame'] >= 0)
+        order = np.argsort(index['frame'][slots])
+        self._slots = slots[order]
+        self.frames = index['frame'][self._slots]
+        self.timestamps = index['timestamp'][self._slots]
+        path = os.path.join(self.path, POSES_FILE)
+        # a pose being appended may be incomplete
+        count = os.path.getsize(path) // POSE_DTYPE.itemsize if os.path.exists(path) else 0
+        self.poses = np.fromfile(path, dtype=POSE_DTYPE, count=count) if count else np.zeros(0, dtype=POSE_DTYPE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _position(self, number):
+        position = np.searchsorted(self.frames, number)
+        if position == len(self.frames) or self.frames[position] != number:
+            raise KeyError('Frame {} is not in the recording'.format(number))
+        return position
+
+    def frame(self, number):
+        """
+        :return: data of the frame in the recording format, a read-only view of the mapped file
+        :raises KeyError: if the frame is not recorded or was overwritten already
+        """
+        return self._frames[self._slots[self._position(number)]]
+
+    def timestamp(self, number):
+        return float(self.timestamps[self._position(number)])
+
+    def find(self, timestamp):
+        """
+        :return: number of the last frame recorded at or before timestamp, the first frame if there is none
+        """
+        if not len(self.frames):
+            raise KeyError('Empty recording')
+        position = max(0, np.searchsorted(self.timestamps, timestamp, side='right') - 1)
+        return int(self.frames[position])
+
+    def frame_poses(self, number):
+        """
+        :return: records of POSE_DTYPE published for the frame
+        """
+        return self.poses[self.poses['frame'] == number]
+
+    def source(self, start=None, stop=None, realtime=False, loop=False, format=None):
+        """
+        :return: RecordingSource replaying the frames from start up to stop (frame numbers, excluded)
+        """
+        return RecordingSource(self, start=start, stop=stop, realtime=realtime, loop=loop, format=format)
+
+
+class RecordingSource(ReplaySource):
+    """
+    Feeds a FlightRecording back through WigglerCV with the recorded frame numbers and timestamps.
+    Gray recordings are delivered as I420 with neutral chroma.
+    """
+
+    def __init__(self, recording, start=None, stop=None, realtime=False, loop=False, format=None):
+        """
+        :param format: 'bgr' or 'yuv', yuv by default for gray and yuv recordings
+        """
+        if isinstance(recording, str):
+            recording = FlightRecording(recording)
+        self.recording = recording
+        self.resolution = recording.resolution
+        first = 0 if start is None else np.searchsorted(recording.frames, start)
+        last = len(recording.frames) if stop is None else np.searchsorted(recording.frames, stop)
+        self.numbers = recording.frames[first:last]
+        self._timestamps = recording.timestamps[first:last]
+        if format is None:
+            format = 'bgr' if recording.format == 'bgr' else 'yuv'
+        super().__init__(framerate=recording.framerate, realtime=realtime, loop=loop, format=format)
+
+    @property
+    def frame_timestamp(self):
+        if not len(self._timestamps):
+            return None
+        return float(self._timestamps[self.frame_count % len(self._timestamps)])
+
+    @property
+    def frame_number(self):
+        if not len(self.numbers):
+            return None
+        return int(self.numbers[self.frame_count % len(self.numbers)])
+
+    def frames(self):
+        width, height = self.resolution
+        for number in self.numbers:
+            data = self.recording.frame(number)
+            if self.recording.format == 'gray':
+                frame = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+                frame[:height] = data
+                if self.format == 'bgr':
+                    frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+            elif self.recording.format == 'yuv' and self.format == 'bgr':
+                frame = cv2.cvtColor(data, cv2.COLOR_YUV2BGR_I420)
+            else:
+                # the file is mapped read-only, OSD draws into the frame
+                frame = np.array(data)
+            yield frame
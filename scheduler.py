@@ -0,0 +1,60 @@
+import time
+
+DRAWING = 'drawing'
+OSD = 'osd'
+STREAMING = 'streaming'
+FALLBACK = 'fallback'
+
+
+class FrameScheduler:
+    """
+    Per-frame deadline scheduler. Every frame has budget seconds from its capture, optional work runs
+    only when its smoothed measured cost still fits before the deadline. WigglerCV sheds, in this order:
+    debug level 2 drawing, the streaming write (with the OSD drawn for it), and the full-frame fallback
+    search, which then runs on every fallback_every-th frame only. Detection in the ROI is never shed.
+    """
+
+    def __init__(self, budget, fallback_every=5, smoothing=0.8):
+        """
+        :param budget: seconds per frame, 1 / fps
+        :param fallback_every: a deferred fallback search runs at least on every this many frames
+        :param smoothing: weight of the previous cost estimate
+        """
+        self.budget = budget
+        self.fallback_every = fallback_every
+        self.smoothing = smoothing
+        self.costs = {}
+        self._deferred = 0
+
+    def observe(self, name, seconds):
+        """
+        Measured cost of an optional step
+        """
+        cost = self.costs.get(name)
+        self.costs[name] = seconds if cost is None else self.smoothing * cost + (1 - self.smoothing) * seconds
+
+    def deadline(self, frame):
+        return frame.capture_time + self.budget
+
+    def fits(self, frame, *names):
+        """
+        :return: True if the steps are expected to finish before the deadline of the frame,
+                 steps never measured are expected to fit
+        """
+        return time.perf_counter() + sum(self.costs.get(name, 0.) for name in names) <= self.deadline(frame)
+
+    def fallback(self, frame):
+        """
+        :return: True if the full-frame search is to run for the frame
+        """
+        if self.fits(frame, FALLBACK) or self._deferred + 1 >= self.fallback_every:
+            self._deferred = 0
+            return True
+        self._deferred += 1
+        return False
+
+    def missed(self, frame):
+        """
+        :return: True if the frame is done after its deadline
+        """
+        return time.perf_counter() > self.deadline(frame)
@@ -1,9 +1,12 @@
+import collections
 from collections import namedtuple
 
 import pigpio
 
 Transition = namedtuple('Transition', ['time_us', 'pin', 'level'])
 
+MAX_WAVES = 250
+
 
 class WavePoint:
     def __init__(self, up_mask, down_mask, delay_us):
@@ -22,36 +25,59 @@ class WavePoint:
 
 
 class Motors:
-    def __init__(self, pi, freq=3000):
+    """
+    Phase shifted square waves on the motor pins, generated by pigpio waveforms.
+    Created waves are kept in an LRU cache keyed by the quantized phases, switching to a cached
+    wave costs a single wave_send_using_mode call and happens at the end of the current cycle
+    (WAVE_MODE_REPEAT_SYNC), so the signal has no glitch.
+    """
+
+    def __init__(self, pi, freq=3000, phase_steps=64, cache_size=64):
+        """
+        :param freq: wave frequency, Hz
+        :param phase_steps: phases are quantized to 1/phase_steps of the period
+        :param cache_size: waves kept, bounded by the pigpio wave and pulse limits too
+        """
         self.pi = pi
         self.freq = freq
+        self.phase_steps = phase_steps
         self.pins = (19, 20, 21, 22)
         self.count = len(self.pins)
         for pin in self.pins:
             self.pi.set_mode(pin, pigpio.OUTPUT)
-
-    def set(self, speeds):
+        # every pin goes up and down once per period
+        pulses_per_wave = 2 * self.count
+        self.cache_size = max(2, min(cache_size, MAX_WAVES - 1, self.pi.wave_get_max_pulses() // pulses_per_wave))
+        self.hits = 0
+        self.misses = 0
+        self._waves = collections.OrderedDict()
+        self._key = None
+
+    def key(self, speeds):
+        """
+        :return: cache key of the speeds: frequency and phases in steps
         """
+        return (self.freq,) + tuple(int(round(phase * self.phase_steps)) % self.phase_steps
+                                    for phase in speeds[:self.count - 1])
 
-        :param speeds: max speed is 1
-        :return:
+    def wave_points(self, key):
+        """
+        :return: list of pigpio.pulse for one period of the wave
         """
-        self.period_us = 1e6 // self.freq
-        self.phases = tuple(speeds)
+        period_us = 1e6 // key[0]
         transitions = []
         transitions.append(Transition(time_us=0, pin=self.pins[0], level=1))
-        transitions.append(Transition(time_us=int(self.period_us / 2), pin=self.pins[0], level=0))
-        for i in range(self.count - 1):
+        transitions.append(Transition(time_us=int(period_us / 2), pin=self.pins[0], level=0))
+        for i, step in enumerate(key[1:]):
             pin = self.pins[i + 1]
-            delay_us = int(self.phases[i] * self.period_us)
+            delay_us = int(step * period_us / self.phase_steps)
             transitions.append(Transition(time_us=delay_us, pin=pin, level=1))
-            transitions.append(
-                Transition(time_us=int((delay_us + self.period_us / 2) % self.period_us), pin=pin, level=0))
+            transitions.append(Transition(time_us=int((delay_us + period_us / 2) % period_us), pin=pin, level=0))
 
         transitions = sorted(transitions)
 
         prev_time = 0
-        up_mask = down_mask = delay_us = None
+        up_mask = down_mask = None
         wave_points = []
         for tr in transitions:
             if up_mask is not None and prev_time == tr.time_us:
@@ -61,39 +87,63 @@ class Motors:
                     down_mask |= (1 << tr.pin)
             else:
                 if up_mask is not None:
-                    delay_us = tr.time_us - prev_time
-                    print('emit (up_mask={:032b}, down_mask={:032b}, delay_us={})'.format(up_mask, down_mask, delay_us))
-                    wave_points.append(pigpio.pulse(up_mask, down_mask, delay_us))
-
+                    wave_points.append(pigpio.pulse(up_mask, down_mask, tr.time_us - prev_time))
                 up_mask = 0
                 down_mask = 0
                 if tr.level:
                     up_mask = 1 << tr.pin
                 else:
                     down_mask = 1 << tr.pin
-                # delay_us = tr.time_us - prev_time
                 prev_time = tr.time_us
 
         if up_mask is not None:
-            delay_us = int(self.period_us - prev_time)
-            print('emit (up_mask={:032b}, down_mask={:032b}, delay_us={})'.format(up_mask, down_mask, delay_us))
-            wave_points.append(pigpio.pulse(up_mask, down_mask, delay_us))
-
-        # if prev_time < self.period_us:
-        #     print('emit (up_mask={:032b}, down_mask={:032b}, delay_us={})'.format(0, 0, int(self.period_us - prev_time)))
-        #     wave_points.append(pigpio.pulse(0, 0, int(self.period_us - prev_time)))
-
+            wave_points.append(pigpio.pulse(up_mask, down_mask, int(period_us - prev_time)))
+        return wave_points
+
+    def _create_wave(self, key):
+        if len(self._waves) >= self.cache_size:
+            _, wave_id = self._waves.popitem(last=False)
+            self.pi.wave_delete(wave_id)
+        self.pi.wave_add_generic(self.wave_points(key))
+        try:
+            return self.pi.wave_create()
+        except pigpio.error:
+            # deleted waves release their resources only in some cases (see wave_delete),
+            # start over with the new wave alone, at the cost of a single glitch
+            self.pi.wave_clear()
+            self._waves.clear()
+            self.pi.wave_add_generic(self.wave_points(key))
+            return self.pi.wave_create()
 
-        self.pi.wave_clear()
-
-        # wave_points = [
-        #     pigpio.pulse((1 << self.pins[0]) | (1 << self.pins[1]) | (1 << self.pins[2]) | (1 << self.pins[3]), 0, 166),
-        #     pigpio.pulse(0, (1 << self.pins[0]) | (1 << self.pins[1]) | (1 << self.pins[2]) | (1 << self.pins[3]), 166)
-        # ]
-        self.pi.wave_add_generic(wave_points)
-        wave_id = self.pi.wave_create()
+    def set(self, speeds):
+        """
 
-        self.pi.wave_send_repeat(wave_id)
+        :param speeds: phases of pins 2..4 relative to pin 1, in periods
+        :return:
+        """
+        key = self.key(speeds)
+        if key == self._key:
+            self.hits += 1
+            return
+        wave_id = self._waves.get(key)
+        if wave_id is None:
+            self.misses += 1
+            wave_id = self._create_wave(key)
+            self._waves[key] = wave_id
+        else:
+            self.hits += 1
+            self._waves.move_to_end(key)
+        self.pi.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_REPEAT_SYNC)
+        self._key = key
 
     def off(self):
         self.pi.wave_tx_stop()
+        self._key = None
+
+    def close(self):
+        """
+        Stops and deletes all waves
+        """
+        self.off()
+        self.pi.wave_clear()
+        self._waves.clear()
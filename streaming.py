@@ -0,0 +1,370 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+from subprocess import Popen, PIPE
+
+import cv2
+import numpy as np
+
+# header: latest sequence number, then the sequence number of the frame in each slot (-1 while written)
+HEADER_ITEMS = 1
+
+
+class FrameRing:
+    """
+    Ring of I420 frames in shared memory, single writer and single reader.
+    The writer never waits: it converts or copies the frame straight into the next slot.
+    The reader takes the latest frame only, frames it did not get to are skipped.
+    A slot is marked while written, so the reader detects frames overwritten while it read them.
+    """
+
+    def __init__(self, resolution, slots=4, name=None):
+        """
+        :param resolution: (width, height), both even
+        :param slots: frames in the ring
+        :param name: shared memory to attach to, a new one is created if None
+        """
+        self.resolution = tuple(resolution)
+        self.slots = slots
+        width, height = resolution
+        self.frame_shape = (height * 3 // 2, width)
+        header_size = (HEADER_ITEMS + slots) * 8
+        size = header_size + slots * self.frame_shape[0] * self.frame_shape[1]
+        self.owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.name = self._shm.name
+        self._header = np.ndarray((HEADER_ITEMS + slots,), dtype=np.int64, buffer=self._shm.buf)
+        self._frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf,
+                                  offset=header_size)
+        if self.owner:
+            self._header[:] = -1
+        self._sequence = int(self._header[0])
+
+    def write(self, image=None, yuv=None):
+        """
+        :param image: BGR frame, converted to I420 into the slot
+        :param yuv: I420 frame of the ring resolution, copied into the slot
+        :return: sequence number of the frame
+        """
+        self._sequence += 1
+        slot = self._sequence % self.slots
+        self._header[HEADER_ITEMS + slot] = -1
+        if yuv is not None:
+            np.copyto(self._frames[slot], yuv)
+        else:
+            cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420, dst=self._frames[slot])
+        self._header[HEADER_ITEMS + slot] = self._sequence
+        self._header[0] = self._sequence
+        return self._sequence
+
+    @property
+    def latest(self):
+        """
+        Sequence number of the latest complete frame, -1 before the first one
+        """
+        return int(self._header[0])
+
+    def frame(self, sequence):
+        """
+        :return: I420 view of the frame in shared memory, None if it was overwritten already
+        """
+        slot = sequence % self.slots
+        if self._header[HEADER_ITEMS + slot] != sequence:
+            return None
+        return self._frames[slot]
+
+    def valid(self, sequence):
+        """
+        :return: frame is still in the ring, check after using a view returned by frame()
+        """
+        return self._header[HEADER_ITEMS + sequence % self.slots] == sequence
+
+    def close(self):
+        del self._header
+        del self._frames
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+def _encoder_main(ring_name, resolution, slots, fps, stream_cmd, gstreamer_pipe, ready, frame_ready, stop,
+                  counters):
+    """
+    Encoder process: streams the latest frame of the ring to the sinks, skips frames when behind.
+    The latest frame is streamed before stopping.
+    counters: streamed, skipped, torn
+    """
+    ring = FrameRing(resolution, slots=slots, name=ring_name)
+    stream_proc = None
+    gstreamer = None
+    bgr = None
+    try:
+        if stream_cmd:
+            stream_proc = Popen(stream_cmd, stdin=PIPE)
+        if gstreamer_pipe:
+            # noinspection PyArgumentList
+            gstreamer = cv2.VideoWriter(gstreamer_pipe, cv2.CAP_GSTREAMER, fps, tuple(resolution))
+            bgr = np.empty((resolution[1], resolution[0], 3), dtype=np.uint8)
+        ready.set()
+        last = -1
+        while True:
+            stopping = stop.is_set()
+            if not stopping and not frame_ready.wait(0.1):
+                continue
+            frame_ready.clear()
+            sequence = ring.latest
+            if sequence > last:
+                counters[1] += sequence - last - 1
+                last = sequence
+                frame = ring.frame(sequence)
+                if frame is None:
+                    counters[2] += 1
+                else:
+                    try:
+                        if stream_proc is not None:
+                            stream_proc.stdin.write(frame.data)
+                        if gstreamer is not None:
+                            cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420, dst=bgr)
+                            gstreamer.write(bgr)
+                    except Exception as e:
+                        print(e)
+                    if ring.valid(sequence):
+                        counters[0] += 1
+                    else:
+                        # writer lapped the ring while the frame was sent
+                        counters[2] += 1
+            if stopping:
+                break
+    finally:
+        if stream_proc is not None:
+            try:
+                stream_proc.stdin.close()
+                stream_proc.wait(1)
+            except Exception as e:
+                print(e)
+        if gstreamer is not None:
+            gstreamer.release()
+        ring.close()
+
+
+class StreamSink:
+    """
+    Streaming sink in a separate process fed through a FrameRing.
+    write() converts the frame into shared memory and returns, encoding never blocks the caller.
+    """
+
+    def __init__(self, resolution, fps, stream_cmd=None, gstreamer_pipe=None, slots=4, start_timeout=10.):
+        """
+        :param stream_cmd: command reading raw I420 frames from stdin, list of arguments
+        :param gstreamer_pipe: cv2.VideoWriter GStreamer pipeline reading BGR frames
+        :param start_timeout: seconds to wait for the encoder process to open the sinks
+        """
+        self.resolution = tuple(resolution)
+        self.ring = FrameRing(resolution, slots=slots)
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        self._frame_ready = context.Event()
+        self._stop = context.Event()
+        self._counters = context.Array('q', 3, lock=False)
+        self._process = context.Process(target=_encoder_main, name='stream-encoder',
+                                        args=(self.ring.name, self.resolution, slots, fps, stream_cmd,
+                                              gstreamer_pipe, ready, self._frame_ready, self._stop, self._counters),
+                                        daemon=True)
+        self._process.start()
+        self.written = 0
+        if not ready.wait(start_timeout):
+            print('stream encoder did not start')
+
+    def write(self, image=None, yuv=None):
+        """
+        :param image: BGR frame
+        :param yuv: I420 frame of the sink resolution, used instead of image
+        """
+        self.ring.write(image=image, yuv=yuv)
+        self.written += 1
+        self._frame_ready.set()
+
+    @property
+    def streamed(self):
+        return self._counters[0]
+
+    @property
+    def skipped(self):
+        """
+        Frames the encoder did not get to, and frames overwritten while it streamed them
+        """
+        return self._counters[1] + self._counters[2]
+
+    def close(self, timeout=5.):
+        self._stop.set()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self.ring.close()
+
+    def wait_streamed(self, count, timeout=5.):
+        """
+        Waits until count frames were streamed or skipped, for tests and benchmarks
+        :return: True if they were
+        """
+        deadline = time.perf_counter() + timeout
+        while self.streamed + self.skipped < count:
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+
+class StreamRate:
+    """
+    Picks the frames sent to the debug stream: decimates the input frames to fps by their timestamps.
+    In adaptive mode the rate is lowered while the frames take longer to process than the frame budget,
+    the rate is chosen so that the average processing time per input frame stays within the budget,
+    from the smoothed processing time of all frames and the additional time of the streamed ones.
+    """
+
+    def __init__(self, fps, input_fps, adaptive=False, min_fps=1., budget=None, headroom=0.9, smoothing=0.9):
+        """
+        :param fps: stream frame rate, at most input_fps
+        :param adaptive: adapt the rate to the budget
+        :param min_fps: lowest adaptive rate
+        :param budget: processing time available per input frame, 1 / input_fps by default
+        :param headroom: share of the budget to use
+        :param smoothing: weight of the previous processing time estimates
+        """
+        self.max_fps = min(fps, input_fps)
+        self.fps = self.max_fps
+        self.input_fps = input_fps
+        self.adaptive = adaptive
+        self.min_fps = min(min_fps, self.max_fps)
+        self.budget = budget if budget else 1. / input_fps
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.frame_time = None
+        self.stream_time = None
+        self._next = None
+
+    def take(self, timestamp):
+        """
+        :param timestamp: frame timestamp, seconds
+        :return: True if the frame is to be streamed
+        """
+        period = 1. / self.fps
+        if self._next is not None and timestamp < self._next - 0.25 / self.input_fps:
+            return False
+        if self._next is None or timestamp - self._next >= period:
+            # first frame or fell behind, restart from this frame
+            self._next = timestamp + period
+        else:
+            self._next += period
+        return True
+
+    def update(self, frame_time, stream_time=None):
+        """
+        Processing time of a frame, adapts the rate in adaptive mode
+        :param frame_time: time spent on the frame without streaming, seconds
+        :param stream_time: additional time spent on streaming it, None if it was not streamed
+        """
+        k = self.smoothing
+        self.frame_time = frame_time if self.frame_time is None else k * self.frame_time + (1 - k) * frame_time
+        if stream_time is not None:
+            self.stream_time = stream_time if self.stream_time is None \
+                else k * self.stream_time + (1 - k) * stream_time
+        if not self.adaptive or not self.stream_time:
+            return
+        # frame_time + stream_time * fps / input_fps <= budget
+        fps = (self.budget * self.headroom - self.frame_time) / self.stream_time * self.input_fps
+        self.fps = min(self.max_fps, max(self.min_fps, fps))
+
+
+class DebugStream:
+    """
+    Debug stream of WigglerCV: its sinks, the frame rate picking the streamed frames and
+    the preallocated buffers. Streamed frames are downscaled once into the buffer.
+    A closed stream ignores the frames still written to it.
+    """
+
+    def __init__(self, resolution, fps, input_fps, stream_cmd=None, gstreamer_pipe=None, process=False, slots=4,
+                 adaptive=False, min_fps=1., budget=None):
+        """
+        :param resolution: (width, height) of the stream
+        :param fps: stream frame rate, at most input_fps
+        :param stream_cmd: command reading raw I420 frames from stdin, list of arguments
+        :param gstreamer_pipe: cv2.VideoWriter GStreamer pipeline reading BGR frames
+        :param process: encode in a separate process, see StreamSink
+        :param adaptive, min_fps, budget: see StreamRate
+        """
+        self.resolution = tuple(resolution)
+        self.fps = fps
+        self.rate = StreamRate(fps, input_fps, adaptive=adaptive, min_fps=min_fps, budget=budget)
+        self.sink = None
+        self.proc = None
+        self.gstreamer = None
+        self._buffer = None
+        self._yuv = None
+        self._lock = threading.Lock()
+        self._closed = False
+        if process:
+            self.sink = StreamSink(self.resolution, fps, stream_cmd=stream_cmd, gstreamer_pipe=gstreamer_pipe,
+                                   slots=slots)
+        else:
+            if stream_cmd:
+                self.proc = Popen(stream_cmd, stdin=PIPE)
+            if gstreamer_pipe:
+                # noinspection PyArgumentList
+                self.gstreamer = cv2.VideoWriter(gstreamer_pipe, cv2.CAP_GSTREAMER, fps, self.resolution)
+
+    def write(self, frame):
+        """
+        :param frame: wiggler_cv.Frame
+        """
+        with self._lock:
+            if self._closed:
+                return
+            width, height = self.resolution
+            image = None
+            yuv = None
+            if self.resolution != frame.resolution:
+                if self._buffer is None:
+                    self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+                image = cv2.resize(frame.image, self.resolution, dst=self._buffer, interpolation=cv2.INTER_AREA)
+            elif not frame.has_color and frame.yuv.shape == (height * 3 // 2, width):
+                # nothing was drawn, the unpadded camera buffer is already I420
+                yuv = frame.yuv
+            else:
+                image = frame.image
+            if self.sink is not None:
+                try:
+                    self.sink.write(image=image, yuv=yuv)
+                except Exception as e:
+                    print(e)
+            if self.proc is not None:
+                try:
+                    if yuv is None:
+                        if self._yuv is None:
+                            self._yuv = np.empty((height * 3 // 2, width), dtype=np.uint8)
+                        yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420, dst=self._yuv)
+                    self.proc.stdin.write(yuv.data)
+                except Exception as e:
+                    print(e)
+            if self.gstreamer is not None:
+                try:
+                    self.gstreamer.write(frame.image if image is None else image)
+                except Exception as e:
+                    print(e)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        if self.sink is not None:
+            self.sink.close()
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(1)
+            except Exception as e:
+                print(e)
+        if self.gstreamer is not None:
+            self.gstreamer.release()
@@ -0,0 +1,221 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from markers import Markers
+
+
+def marker_corners(markers, coordinates, rotscale):
+    """
+    Image corners of the constellation markers at the pose, in cv2.aruco.detectMarkers format
+    :return: (corners (n,1,4,2), ids (n,1))
+    """
+    transform = np.array([
+        [rotscale[0], -rotscale[1], coordinates[0]],
+        [rotscale[1], rotscale[0], coordinates[1]],
+    ])
+    corners = np.array([np.dot(transform, markers.markers[i]).T[None, :, :] for i in markers.marker_ids])
+    return corners.astype(np.float32), np.array(markers.marker_ids, dtype=np.int32).reshape((-1, 1))
+
+
+def render_constellation(image, coordinates, rotscale, markers=Markers, dictionary=None, bitmap_size=60):
+    """
+    Draws the constellation markers at the pose into the image (in place)
+    :param image: gray or BGR image
+    :param coordinates: (x, y) of the constellation center, px
+    :param rotscale: (scale * cos(angle), scale * sin(angle)), scale in px/mm
+    :param markers: Markers constellation
+    :param dictionary: ArUco dictionary, DICT_4X4_100 by default
+    :param bitmap_size: resolution of the marker bitmaps before warping
+    :return: (corners, ids) of the drawn markers, as cv2.aruco.detectMarkers returns them
+    """
+    if dictionary is None:
+        dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+    corners, ids = marker_corners(markers, coordinates, rotscale)
+    height, width = image.shape[:2]
+    # outer edges of the bitmap pixels, matching the corners cv2.aruco reports
+    source = np.float32([[-0.5, -0.5], [bitmap_size - 0.5, -0.5], [bitmap_size - 0.5, bitmap_size - 0.5]])
+    for marker_corners_, marker_id in zip(corners, ids[:, 0]):
+        # warp into the bounding box of the marker only
+        left, top = np.maximum(np.floor(marker_corners_[0].min(axis=0)).astype(int) - 1, 0)
+        right, bottom = np.minimum(np.ceil(marker_corners_[0].max(axis=0)).astype(int) + 2, (width, height))
+        if right <= left or bottom <= top:
+            continue
+        bitmap = cv2.aruco.drawMarker(dictionary, int(marker_id), bitmap_size)
+        transform = cv2.getAffineTransform(source, marker_corners_[0, :3] - np.float32([left, top]))
+        size = (right - left, bottom - top)
+        warped = cv2.warpAffine(bitmap, transform, size, flags=cv2.INTER_AREA, borderValue=0)
+        alpha = cv2.warpAffine(np.full(bitmap.shape, 1., np.float32), transform, size, flags=cv2.INTER_AREA,
+                               borderValue=0)
+        area = image[top:bottom, left:right]
+        if image.ndim == 3:
+            warped = warped[:, :, None]
+            alpha = alpha[:, :, None]
+        area[...] = (area * (1 - alpha) + warped * alpha + 0.5).astype(image.dtype)
+    return corners, ids
+
+
+def random_poses(rng, count, resolution=(640, 480), scale=(1.5, 3.), markers=Markers):
+    """
+    Independent random poses with the constellation fully inside the frame
+    :return: poses (count, 4) of x, y and rotscale
+    """
+    width, height = resolution
+    poses = np.zeros((count, 4))
+    for pose in poses:
+        s = rng.uniform(*scale)
+        margin = s * markers.radius + 2
+        angle = rng.uniform(-np.pi, np.pi)
+        pose[:] = (rng.uniform(margin, width - margin), rng.uniform(margin, height - margin),
+                   s * np.cos(angle), s * np.sin(angle))
+    return poses
+
+
+def walk_poses(rng, count, resolution=(640, 480), scale=(1.5, 3.), markers=Markers, speed=4., turn=0.05):
+    """
+    Smooth random walk of the robot, bouncing off the frame edges, as a camera stream sees it
+    :param speed: mean distance moved per frame, px
+    :param turn: standard deviation of the heading change per frame, radians
+    :return: poses (count, 4) of x, y and rotscale
+    """
+    width, height = resolution
+    poses = np.zeros((count, 4))
+    s = rng.uniform(*scale)
+    margin = scale[1] * markers.radius + 2
+    position = np.array([rng.uniform(margin, width - margin), rng.uniform(margin, height - margin)])
+    angle = rng.uniform(-np.pi, np.pi)
+    heading = rng.uniform(-np.pi, np.pi)
+    for pose in poses:
+        heading += rng.normal(0, turn)
+        angle += rng.normal(0, turn)
+        s = np.clip(s * np.exp(rng.normal(0, 0.005)), *scale)
+        position += rng.uniform(0.5, 1.5) * speed * np.array([np.cos(heading), np.sin(heading)])
+        for axis, size in enumerate(resolution):
+            if not margin <= position[axis] <= size - margin:
+                position[axis] = np.clip(position[axis], margin, size - margin)
+                heading = np.pi - heading if axis == 0 else -heading
+        pose[:] = (position[0], position[1], s * np.cos(angle), s * np.sin(angle))
+    return poses
+
+
+def degrade(image, rng, blur=0., noise=0., lighting=0.):
+    """
+    Camera effects, in place
+    :param blur: largest Gaussian blur sigma, px, drawn per frame
+    :param noise: standard deviation of the sensor noise, gray levels
+    :param lighting: largest relative brightness change: random gain and a linear gradient across the frame
+    """
+    if blur > 0:
+        sigma = rng.uniform(0, blur)
+        if sigma > 0.3:
+            cv2.GaussianBlur(image, (0, 0), sigma, dst=image)
+    if lighting > 0 or noise > 0:
+        height, width = image.shape[:2]
+        shape = (height, width, 1) if image.ndim == 3 else (height, width)
+        result = image.astype(np.float32)
+        if lighting > 0:
+            direction = rng.uniform(-np.pi, np.pi)
+            x = np.linspace(-0.5, 0.5, width, dtype=np.float32)[None, :]
+            y = np.linspace(-0.5, 0.5, height, dtype=np.float32)[:, None]
+            gain = rng.uniform(1 - lighting, 1 + lighting) + \
+                rng.uniform(0, lighting) * (np.cos(direction) * x + np.sin(direction) * y)
+            result *= gain.reshape(shape)
+        if noise > 0:
+            result += rng.normal(0, noise, result.shape).astype(np.float32)
+        np.clip(result, 0, 255, out=result)
+        image[...] = result
+    return image
+
+
+def synthetic_stream(count, resolution=(640, 480), scale=(1.5, 3.), motion='walk', blur=0., noise=0., lighting=0.,
+                     seed=0, background=200, markers=Markers):
+    """
+    Generates BGR frames with the constellation rendered from the real DICT_4X4_100 bitmaps, one at a time
+    so that streams of any length fit into memory
+    :param motion: 'walk' for a smoothly moving robot, 'random' for independent poses
+    :param blur, noise, lighting: camera effects, see degrade()
+    :return: iterator of (frame (height, width, 3), ground truth pose of x, y and rotscale)
+    """
+    rng = np.random.default_rng(seed)
+    if motion == 'walk':
+        poses = walk_poses(rng, count, resolution, scale, markers)
+    elif motion == 'random':
+        poses = random_poses(rng, count, resolution, scale, markers)
+    else:
+        raise ValueError('Unknown motion {!r}'.format(motion))
+    width, height = resolution
+    for pose in poses:
+        frame = np.full((height, width, 3), background, np.uint8)
+        render_constellation(frame, pose[:2], pose[2:], markers=markers)
+        yield degrade(frame, rng, blur=blur, noise=noise, lighting=lighting), pose
+
+
+def random_frames(count, resolution=(640, 480), scale=(1.5, 3.), seed=0, background=200, markers=Markers):
+    """
+    BGR frames with the constellation at random poses fully inside the frame
+    :return: (frames (count, height, width, 3), poses (count, 4) of x, y and rotscale)
+    """
+    width, height = resolution
+    frames = np.empty((count, height, width, 3), np.uint8)
+    poses = np.zeros((count, 4))
+    for i, (frame, pose) in enumerate(synthetic_stream(count, resolution, scale, motion='random', seed=seed,
+                                                       background=background, markers=markers)):
+        frames[i] = frame
+        poses[i] = pose
+    return frames, poses
+
+
+def poses_path(path):
+    """
+    :return: path of the ground truth poses stored along the frames of a dataset
+    """
+    return os.path.splitext(path)[0] + '.poses.npy'
+
+
+def write_dataset(path, count, **kwargs):
+    """
+    Writes a synthetic_stream to a .npy file replayable with frame_sources.open_source, frame by frame,
+    and its ground truth poses to poses_path(path)
+    :param kwargs: synthetic_stream arguments
+    :return: poses (count, 4)
+    """
+    width, height = kwargs.get('resolution', (640, 480))
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(count, height, width, 3))
+    poses = np.zeros((count, 4))
+    for i, (frame, pose) in enumerate(synthetic_stream(count, **kwargs)):
+        frames[i] = frame
+        poses[i] = pose
+    frames.flush()
+    del frames
+    np.save(poses_path(path), poses)
+    return poses
+
+
+def load_poses(path):
+    """
+    :return: ground truth poses (count, 4) of the dataset written by write_dataset()
+    """
+    return np.load(poses_path(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes a synthetic dataset with ground truth poses')
+    parser.add_argument('path', help='.npy frames, poses are written next to them')
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--resolution', default='640x480')
+    parser.add_argument('--scale', default='1.5,3', help='range of px/mm')
+    parser.add_argument('--motion', default='walk', choices=('walk', 'random'))
+    parser.add_argument('--blur', type=float, default=0., help='largest Gaussian blur sigma, px')
+    parser.add_argument('--noise', type=float, default=0., help='sensor noise, gray levels')
+    parser.add_argument('--lighting', type=float, default=0., help='largest relative brightness change')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_dataset(args.path, args.count, resolution=tuple(int(v) for v in args.resolution.split('x')),
+                  scale=tuple(float(v) for v in args.scale.split(',')), motion=args.motion, blur=args.blur,
+                  noise=args.noise, lighting=args.lighting, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
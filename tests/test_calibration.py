@@ -0,0 +1,100 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from calibration import Calibration, board_points, calibrate, find_board, floor_homography
+from frame_sources import open_source
+from synthetic import write_dataset
+from tests.test_frame_sources import replay, setup_wiggler_cv
+
+CAMERA_MATRIX = np.array([[600., 0., 320.], [0., 600., 240.], [0., 0., 1.]])
+DIST_COEFFS = np.array([-0.3, 0.1, 0.001, -0.001, 0.])
+
+
+def project(points, rvec, tvec):
+    return cv2.projectPoints(points, np.float64(rvec), np.float64(tvec), CAMERA_MATRIX, DIST_COEFFS)[0] \
+        .astype(np.float32)
+
+
+class TestCalibration(TestCase):
+    def test_find_board(self):
+        image = np.full((480, 640), 255, np.uint8)
+        for row in range(7):
+            for column in range(10):
+                if (row + column) % 2 == 0:
+                    image[100 + row * 30:130 + row * 30, 150 + column * 30:180 + column * 30] = 0
+        corners = find_board(image, (9, 6))
+        self.assertEqual(corners.shape, (54, 1, 2))
+        np.testing.assert_allclose(np.sort(corners[:, 0, 0])[[0, -1]], (179.5, 419.5), atol=0.5)
+
+    def test_calibrate(self):
+        points = board_points((9, 6), 25.)
+        poses = [((0.1, -0.2, 0.), (-100., -60., 400.)), ((-0.3, 0.1, 0.1), (-80., -70., 450.)),
+                 ((0.2, 0.3, -0.1), (-120., -50., 380.)), ((0., 0.4, 0.2), (-60., -90., 500.)),
+                 ((0.4, 0., 0.), (-20., -20., 350.)), ((-0.2, -0.3, 0.3), (-150., -80., 420.))]
+        image_points = [project(points, rvec, tvec) for rvec, tvec in poses]
+        camera_matrix, dist_coeffs, rms = calibrate(image_points, (9, 6), 25., (640, 480))
+        self.assertLess(rms, 0.01)
+        np.testing.assert_allclose(camera_matrix, CAMERA_MATRIX, rtol=0.01, atol=1.)
+        np.testing.assert_allclose(dist_coeffs[:2], DIST_COEFFS[:2], atol=0.02)
+
+    def test_undistort(self):
+        calibration = Calibration(CAMERA_MATRIX, DIST_COEFFS, (640, 480))
+        points = np.random.default_rng(0).uniform((0, 0), (640, 480), (200, 2))
+        expected = cv2.undistortPoints(points.reshape((-1, 1, 2)), CAMERA_MATRIX, DIST_COEFFS, P=CAMERA_MATRIX)
+        np.testing.assert_allclose(calibration.undistort(points), expected.reshape((-1, 2)), atol=0.05)
+        corners = (np.float32([[[100, 100], [120, 100], [120, 120], [100, 120]]]),)
+        self.assertEqual(calibration.undistort_corners(corners).shape, (1, 1, 4, 2))
+        self.assertEqual(len(calibration.undistort_corners(())), 0)
+        # back to raw pixels, including the corners of the frame
+        raw = np.float32([[0, 0], [639, 479], [320, 240]] + points.tolist())
+        np.testing.assert_allclose(calibration.distort(calibration.undistort(raw)), raw, atol=0.1)
+
+        # same lens at twice the resolution
+        scaled = Calibration.from_config(calibration.to_config(), (1280, 960))
+        np.testing.assert_allclose(scaled.undistort(points * 2), calibration.undistort(points) * 2, atol=0.1)
+
+    def test_floor(self):
+        calibration = Calibration(CAMERA_MATRIX, DIST_COEFFS, (640, 480))
+        points = board_points((9, 6), 25.)
+        image_points = project(points, (0.5, 0.1, 0.05), (-100., -60., 500.))
+        calibration.floor_homography = floor_homography(calibration, image_points, (9, 6), 25.)
+        # another point on the floor
+        pixel = project(np.float32([[40., 30., 0.]]), (0.5, 0.1, 0.05), (-100., -60., 500.))[0, 0]
+        np.testing.assert_allclose(calibration.to_floor(calibration.undistort(pixel)), (40., 30.), atol=0.2)
+        values = Calibration.from_config(calibration.to_config()).to_config()
+        np.testing.assert_allclose(values['floor_homography'], calibration.floor_homography)
+        self.assertIsNone(Calibration(CAMERA_MATRIX, DIST_COEFFS, (640, 480)).to_floor((1., 2.)))
+
+    def run_wiggler_cv(self, calibration, count=5):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            poses = write_dataset(path, count, seed=6)
+            wcv = setup_wiggler_cv(open_source(path, realtime=False), calibration=calibration)
+            locations = replay(wcv)
+        return wcv, poses, locations
+
+    def test_wiggler_cv(self):
+        # distortion free lens, 2 px per mm on the floor
+        _, _, locations = self.run_wiggler_cv({'resolution': [640, 480], 'camera_matrix': CAMERA_MATRIX.tolist(),
+                                               'dist_coeffs': [0., 0., 0., 0., 0.],
+                                               'floor_homography': [[0.5, 0., 0.], [0., 0.5, 0.], [0., 0., 1.]]})
+        self.assertEqual(len(locations), 5)
+        for location in locations:
+            np.testing.assert_allclose(location.floor, np.array(location.coordinates) / 2, atol=0.05)
+
+    def test_wiggler_cv_distorted(self):
+        calibration = Calibration(CAMERA_MATRIX, DIST_COEFFS, (640, 480))
+        wcv, poses, locations = self.run_wiggler_cv(calibration.to_config(), count=10)
+        self.assertEqual(len(locations), 10)
+        for location in locations:
+            self.assertIsNone(location.floor)
+            # published undistorted
+            np.testing.assert_allclose(location.coordinates, calibration.undistort(poses[location.frame, :2]),
+                                       atol=1.5)
+        # ROIs stay in raw pixels, the robot is found in its ROI after the first frame
+        self.assertEqual(wcv.stats()['counters']['roi_hits'], 9)
+        np.testing.assert_allclose(wcv.robots[0].position.coordinates, poses[9, :2], atol=1.5)
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from channel import EVERY, LATEST, Channel
+from frame_sources import open_source
+from tests.test_frame_sources import make_frames, setup_wiggler_cv
+
+
+class TestChannel(TestCase):
+    def test_every(self):
+        channel = Channel()
+        subscription = channel.subscribe(EVERY)
+        for i in range(5):
+            channel.publish(i)
+        channel.close()
+        self.assertEqual(list(subscription), [0, 1, 2, 3, 4])
+
+    def test_every_bounded(self):
+        channel = Channel()
+        subscription = channel.subscribe(EVERY, maxsize=2)
+        for i in range(5):
+            channel.publish(i)
+        channel.close()
+        self.assertEqual(list(subscription), [3, 4])
+        self.assertEqual(subscription.dropped, 3)
+
+    def test_latest(self):
+        channel = Channel()
+        subscription = channel.subscribe(LATEST)
+        channel.publish(1)
+        channel.publish(2)
+        self.assertEqual(subscription.get(), 2)
+        with self.assertRaises(TimeoutError):
+            subscription.get(timeout=0.01)
+        channel.publish(3)
+        self.assertEqual(subscription.get(), 3)
+        self.assertEqual(channel.latest, 3)
+
+    def test_broadcast(self):
+        channel = Channel()
+        first = channel.subscribe(EVERY)
+        second = channel.subscribe(EVERY)
+        odd = channel.subscribe(EVERY, predicate=lambda item: item % 2)
+        for i in range(4):
+            channel.publish(i)
+        channel.close()
+        self.assertEqual(list(first), [0, 1, 2, 3])
+        self.assertEqual(list(second), [0, 1, 2, 3])
+        self.assertEqual(list(odd), [1, 3])
+
+    def test_unsubscribe(self):
+        channel = Channel()
+        with channel.subscribe() as subscription:
+            channel.publish(1)
+        channel.publish(2)
+        self.assertEqual(channel.subscribers, 0)
+        self.assertEqual(list(subscription), [1])
+
+    def test_subscribe_closed(self):
+        channel = Channel()
+        channel.close()
+        self.assertEqual(list(channel.subscribe()), [])
+
+    def test_async(self):
+        channel = Channel()
+        subscription = channel.subscribe(EVERY)
+
+        def publish():
+            for i in range(20):
+                channel.publish(i)
+            channel.close()
+
+        async def consume():
+            thread = threading.Thread(target=publish)
+            thread.start()
+            items = [item async for item in subscription]
+            thread.join()
+            return items
+
+        self.assertEqual(asyncio.run(consume()), list(range(20)))
+
+
+class TestWigglerCVPoses(TestCase):
+    def test_subscribers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            np.save(path, make_frames(10))
+            wcv = setup_wiggler_cv(open_source(path, framerate=50., realtime=False))
+            every = wcv.subscribe(EVERY)
+            latest = wcv.subscribe(LATEST, robot='wigglebot')
+            wcv.run()
+            poses = list(every)
+            wcv.terminate()
+        self.assertEqual([pose.frame for pose in poses], list(range(10)))
+        np.testing.assert_allclose([pose.timestamp for pose in poses], np.arange(10) / 50.)
+        self.assertTrue(all(pose.latency > 0 for pose in poses))
+        self.assertEqual(list(latest)[-1], poses[-1])
+        # iterating WigglerCV buffers the poses not read yet too
+        self.assertEqual(list(wcv), poses)
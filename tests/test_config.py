@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from config import RESTART, RUNTIME, STREAM, ConfigWatcher, changes, load, validate
+from frame_sources import open_source
+from tests.test_frame_sources import STREAMING_KEYS, make_frames
+from tests.test_streaming import reader_cmd
+from wiggler_cv import WigglerCV
+
+
+class TestConfig(TestCase):
+    def test_validate(self):
+        validate({'debug_level': 1, 'roi_margin': 1, 'stream_res': None, '-stream_cmd': 5,
+                  'detector_parameters': {'adaptiveThreshWinSizeMax': 7}})
+        with self.assertRaises(ValueError) as context:
+            validate({'debug_level': '2', 'pipeline': 1, 'fast_area_size': True, 'roi_mode': 'magic',
+                      'stream_res': [640], 'input_fps': None, 'detector_parameters': {'threshold': 7}})
+        message = str(context.exception)
+        for name in ('debug_level', 'pipeline', 'fast_area_size', 'roi_mode', 'stream_res', 'input_fps',
+                     'detector_parameters'):
+            self.assertIn(name, message)
+
+    def test_load(self):
+        values = load('wiggler_cv.json')
+        self.assertEqual(values['input_res_h'], 640)
+
+    def test_changes(self):
+        old = {'debug_level': 1, 'input_fps': 25, 'stream_cmd': ['a'], 'comment': 1}
+        new = {'debug_level': 2, 'input_fps': 25, 'stream_fps': 5, 'comment': 2}
+        self.assertEqual(changes(old, new), {RUNTIME: {'debug_level'}, STREAM: {'stream_cmd', 'stream_fps'}})
+        self.assertEqual(changes(old, dict(old, input_fps=30)), {RESTART: {'input_fps'}})
+
+    def test_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as f:
+                f.write('{}')
+            changed = threading.Event()
+            watcher = ConfigWatcher(path, changed.set, interval=0.01)
+            try:
+                time.sleep(0.05)
+                self.assertFalse(changed.is_set())
+                with open(path, 'w') as f:
+                    f.write('{"debug_level": 1}')
+                os.utime(path, ns=(0, 10 ** 9))
+                self.assertTrue(changed.wait(2))
+            finally:
+                watcher.close()
+
+
+class TestWigglerCVReload(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'wiggler_cv.json')
+        with open('wiggler_cv.json', 'r') as f:
+            self.values = json.load(f)
+        for k in STREAMING_KEYS:
+            self.values.pop(k, None)
+        self.write_config()
+        frames_path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(frames_path, make_frames(10))
+        self.wcv = WigglerCV(None, source=open_source(frames_path, framerate=100., loop=True))
+        self.wcv.setup(cfg_file=self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_config(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.values, f)
+
+    def wait_frames(self, count):
+        frames = self.wcv.stats()['counters'].get('frames', 0)
+        deadline = time.perf_counter() + 5
+        while self.wcv.stats()['counters'].get('frames', 0) < frames + count and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+    def test_reload_twice(self):
+        wcv = self.wcv
+        # as if running, reloads wait for the detection stage
+        wcv._thread = threading.current_thread()
+        self.values.update(debug_level=1)
+        self.write_config()
+        self.assertEqual(wcv.reload(), {RUNTIME: {'debug_level'}})
+
+        class ReloadOnRelease:
+            """
+            Config lock reloading once right after a release, while the first reload is being applied
+            """
+
+            def __init__(self, lock, reload):
+                self.lock = lock
+                self.reload = reload
+
+            def __enter__(self):
+                self.lock.__enter__()
+
+            def __exit__(self, *args):
+                self.lock.__exit__(*args)
+                reload, self.reload = self.reload, None
+                if reload is not None:
+                    reload()
+
+        def second_reload():
+            self.values.update(roi_margin=2.)
+            self.write_config()
+            self.assertEqual(wcv.reload(), {RUNTIME: {'roi_margin'}})
+
+        wcv._config_lock = ReloadOnRelease(wcv._config_lock, second_reload)
+        wcv._apply_config()
+        wcv._apply_config()
+        self.assertEqual(wcv.config.debug_level, 1)
+        self.assertEqual(wcv.config.roi_margin, 2.)
+        self.assertEqual(wcv.robots[0].tracker.margin, 2.)
+
+    def test_reload(self):
+        wcv = self.wcv
+        wcv.run()
+        try:
+            poses = wcv.subscribe()
+            poses.get(timeout=5)
+            robot = wcv.robots[0]
+            self.values.update(debug_level=1, roi_margin=2., input_res_h=1280,
+                               detector_parameters={'adaptiveThreshWinSizeMax': 7}, metrics_window=5,
+                               stream_cmd=reader_cmd(os.path.join(self.dir.name, 'stream_{host}_{port}.yuv')),
+                               stream_fps=10, streaming_port=5001)
+            self.write_config()
+            changed = wcv.reload()
+            self.assertEqual(changed, {RUNTIME: {'debug_level', 'roi_margin', 'detector_parameters', 'metrics_window'},
+                                       RESTART: {'input_res_h'},
+                                       STREAM: {'stream_cmd', 'stream_fps', 'streaming_port'}})
+            self.wait_frames(5)
+            deadline = time.perf_counter() + 5
+            while wcv.stats()['histograms'].get('streaming') is None and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            # applied between frames, tracking went on with the same robot
+            self.assertEqual(wcv.config.debug_level, 1)
+            self.assertEqual(wcv.robots[0], robot)
+            self.assertEqual(robot.tracker.margin, 2.)
+            self.assertEqual(wcv._detector_parameters.adaptiveThreshWinSizeMax, 7)
+            self.assertEqual(wcv.config.input_res_h, 320)
+            self.assertIn('streaming', wcv.stats()['histograms'])
+            self.assertEqual(wcv.stats()['gauges']['stream_fps'], 10)
+            # the stream command got the reloaded port, the histograms the reloaded window
+            self.assertTrue(os.path.exists(os.path.join(self.dir.name, 'stream_brix.local_5001.yuv')))
+            self.assertEqual(len(wcv.metrics._histograms['aruco'].samples), 5)
+            poses.get(timeout=5)
+
+            self.values['debug_level'] = 'verbose'
+            self.write_config()
+            self.assertIsNone(wcv.reload())
+            self.assertEqual(wcv.stats()['counters']['config_errors'], 1)
+        finally:
+            wcv.terminate()
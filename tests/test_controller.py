@@ -0,0 +1,92 @@
+import math
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from channel import EVERY
+from controller import Controller, DirectionMixer, SimulatedPlant
+from markers import RobotLocation
+from motor_driver import MotorDriver
+
+
+def pose(x, y, timestamp, heading=0., latency=0.):
+    return RobotLocation('wigglebot', (x, y), (2 * math.cos(heading), 2 * math.sin(heading)), 0., frame=0,
+                         timestamp=timestamp, latency=latency)
+
+
+class TestDirectionMixer(TestCase):
+    def test_force(self):
+        mixer = DirectionMixer()
+        for force in ((0.5, 0.), (0., -0.3), (0.2, 0.2)):
+            speeds = mixer.speeds(force)
+            self.assertGreaterEqual(min(speeds), 0.)
+            np.testing.assert_allclose(mixer.force(speeds), force, atol=1e-9)
+
+    def test_limited(self):
+        speeds = DirectionMixer().speeds((10., 0.))
+        self.assertAlmostEqual(max(speeds), 1.)
+        force = DirectionMixer().force(speeds)
+        self.assertAlmostEqual(force[1], 0.)
+
+
+class TestController(TestCase):
+    def test_latency_compensation(self):
+        controller = Controller(None, compensate=True)
+        controller.update(pose(100., 100., 0.), receive_time=10.)
+        controller.update(pose(110., 100., 0.1, latency=0.05), receive_time=10.15)
+        (x, y), heading, age = controller.predict(10.2)
+        self.assertAlmostEqual(age, 0.1)
+        # velocity estimate 100px/s half smoothed
+        self.assertAlmostEqual(x, 110. + 50. * 0.1)
+        controller.compensate = False
+        self.assertAlmostEqual(controller.predict(10.2)[0][0], 110.)
+
+    def test_command(self):
+        mixer = DirectionMixer()
+        controller = Controller(None, mixer=mixer, gain=0.01, tolerance=5., stale_timeout=0.5)
+        self.assertIsNone(controller.command(0.))
+        controller.set_target((200., 100.))
+        controller.update(pose(100., 100., 0., heading=math.pi / 2), receive_time=0.)
+        # robot turned by 90 degrees, world +x is robot -y
+        force = mixer.force(controller.command(0.01))
+        np.testing.assert_allclose(force / np.hypot(*force), (0., -1.), atol=1e-9)
+        self.assertIsNone(controller.command(1.))
+        self.assertEqual(controller.stale, 1)
+        controller.set_target((103., 100.))
+        self.assertIsNone(controller.command(0.01))
+
+    def test_closed_loop(self):
+        # simulated time, 1 ms steps
+        clock = [0.]
+        plant = SimulatedPlant(position=(320., 240.), heading=0.5, fps=25., latency=0.05, clock=lambda: clock[0])
+        controller = Controller(plant, rate=50., tolerance=3.)
+        subscription = plant.poses.subscribe(EVERY)
+        controller.set_target((380., 200.))
+        for step in range(1500):
+            clock[0] = now = step / 1000
+            plant.advance(now)
+            while len(subscription):
+                controller.update(subscription.get(), receive_time=now)
+            if step % 20 == 0:
+                controller.tick(now)
+        plant.close()
+        self.assertLess(np.hypot(*(plant.position - (380., 200.))), 10.)
+        stats = controller.stats()
+        self.assertEqual(stats['ticks'], 75)
+        self.assertGreater(stats['commands'], 0)
+        # pose age plus the measured actuation latency
+        self.assertGreater(stats['actuation'], 0.)
+        self.assertGreaterEqual(stats['latency']['p50'], 0.05)
+
+    def test_measured_actuation(self):
+        driver = MotorDriver(SimulatedPlant(), start=False)
+        controller = Controller(driver, tolerance=1.)
+        controller.set_target((400., 240.))
+        controller.update(pose(320., 240., 0.), receive_time=0.)
+        controller.tick(0.01)
+        time.sleep(0.02)
+        driver.flush()
+        controller.tick(0.01)
+        # the command waited for the flush of the driver
+        self.assertGreaterEqual(controller.actuation, 0.02 * (1 - controller.latency_smoothing))
@@ -0,0 +1,154 @@
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from detection import (PyramidDetector, TiledDetector, copy_parameters, detect_markers, parameters_from_dict,
+                       parameters_to_dict, restrict_dictionary, scale_parameters)
+from markers import Markers
+from synthetic import marker_corners, random_frames, render_constellation
+from tune_detector import evaluate, settings, tune
+
+
+def sorted_markers(corners, ids):
+    order = np.argsort(ids[:, 0])
+    return np.array(corners)[order], ids[order]
+
+
+class TestTiledDetector(TestCase):
+    def setUp(self):
+        self.dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+
+    def test_tiles(self):
+        detector = TiledDetector(self.dictionary, grid=(2, 2), overlap=80)
+        tiles = detector.tiles((480, 640))
+        self.assertEqual(tiles, [(0, 0, 360, 280), (280, 0, 640, 280), (0, 200, 360, 480), (280, 200, 640, 480)])
+        detector.close()
+
+    def test_same_as_full_frame(self):
+        frames, _ = random_frames(10, seed=1)
+        detector = TiledDetector(self.dictionary, grid=(2, 2), overlap=120)
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            corners, ids = detect_markers(gray, self.dictionary)
+            tiled_corners, tiled_ids = detector.detect(gray)
+            corners, ids = sorted_markers(corners, ids)
+            tiled_corners, tiled_ids = sorted_markers(tiled_corners, tiled_ids)
+            np.testing.assert_array_equal(tiled_ids, ids)
+            # unrefined corners, thresholding near tile edges may move them by a pixel or two
+            np.testing.assert_allclose(tiled_corners, corners, atol=2)
+        detector.close()
+
+    def test_marker_in_overlap(self):
+        image = np.full((480, 640), 200, np.uint8)
+        # centered on the tile border, found in all four tiles
+        expected_corners, expected_ids = render_constellation(image, (320, 240), (2., 0.))
+        detector = TiledDetector(self.dictionary, grid=(2, 2), overlap=240)
+        corners, ids = sorted_markers(*detector.detect(image))
+        expected_corners, expected_ids = sorted_markers(expected_corners, expected_ids)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(corners, expected_corners, atol=2)
+        detector.close()
+
+    def test_nothing(self):
+        detector = TiledDetector(self.dictionary)
+        corners, ids = detector.detect(np.full((480, 640), 200, np.uint8))
+        self.assertEqual(len(corners), 0)
+        self.assertIsNone(ids)
+        detector.close()
+
+    def test_copy_parameters(self):
+        parameters = cv2.aruco.DetectorParameters_create()
+        parameters.minMarkerPerimeterRate = 0.1
+        copy = copy_parameters(parameters)
+        self.assertEqual(copy.minMarkerPerimeterRate, 0.1)
+        copy.minMarkerPerimeterRate = 0.2
+        self.assertEqual(parameters.minMarkerPerimeterRate, 0.1)
+
+
+class TestPyramidDetector(TestCase):
+    def setUp(self):
+        self.dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+
+    def test_refined_corners(self):
+        frames, poses = random_frames(10, resolution=(1280, 720), scale=(3., 6.), seed=2)
+        detector = PyramidDetector(self.dictionary, scale=2)
+        for frame, pose in zip(frames, poses):
+            corners, ids = detector.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            true_corners, true_ids = sorted_markers(*marker_corners(Markers, pose[:2], pose[2:]))
+            corners, ids = sorted_markers(corners, ids)
+            np.testing.assert_array_equal(ids, true_ids)
+            np.testing.assert_allclose(corners, true_corners, atol=1)
+            location = Markers.get_location(corners, ids)
+            np.testing.assert_allclose(location.coordinates, pose[:2], atol=0.3)
+
+    def test_with_tiles(self):
+        image = np.full((720, 1280), 200, np.uint8)
+        true_corners, true_ids = sorted_markers(*render_constellation(image, (640, 360), (4., 0.)))
+        detector = PyramidDetector(self.dictionary, scale=2,
+                                   detector=TiledDetector(self.dictionary, grid=(2, 2), overlap=160))
+        corners, ids = sorted_markers(*detector.detect(image))
+        detector.close()
+        np.testing.assert_array_equal(ids, true_ids)
+        np.testing.assert_allclose(corners, true_corners, atol=1)
+
+    def test_nothing(self):
+        corners, ids = PyramidDetector(self.dictionary, scale=4).detect(np.full((480, 640), 200, np.uint8))
+        self.assertEqual(len(corners), 0)
+        self.assertIsNone(ids)
+
+
+class TestDetectorParameters(TestCase):
+    def setUp(self):
+        self.dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+
+    def test_from_dict(self):
+        parameters = parameters_from_dict({'adaptiveThreshWinSizeMax': 7, 'minMarkerPerimeterRate': 0.05})
+        self.assertEqual(parameters.adaptiveThreshWinSizeMax, 7)
+        values = parameters_to_dict(parameters)
+        self.assertAlmostEqual(values['minMarkerPerimeterRate'], 0.05)
+        self.assertEqual(values['adaptiveThreshWinSizeMin'], 3)
+        scaled = scale_parameters(parameters, 2.)
+        self.assertAlmostEqual(scaled.minMarkerPerimeterRate, 0.1)
+        self.assertAlmostEqual(parameters.minMarkerPerimeterRate, 0.05)
+        with self.assertRaises(ValueError):
+            parameters_from_dict({'adaptiveThreshWinSize': 7})
+
+    def test_restricted_dictionary(self):
+        image = np.full((480, 640), 200, np.uint8)
+        render_constellation(image, (200, 240), (2., 0.))
+        # markers of another constellation in the same frame
+        render_constellation(image, (460, 240), (2., 0.), markers=Markers(marker_ids=[1, 2, 3]))
+        marker_ids = [12, 18, 42]
+        dictionary = restrict_dictionary(self.dictionary, marker_ids)
+        corners, ids = detect_markers(image, dictionary, marker_ids=marker_ids)
+        self.assertEqual(sorted(ids[:, 0]), marker_ids)
+        all_corners, all_ids = detect_markers(image, self.dictionary)
+        self.assertEqual(len(all_ids), 6)
+        expected = {marker_id: c for c, marker_id in zip(all_corners, all_ids[:, 0])}
+        for c, marker_id in zip(corners, ids[:, 0]):
+            np.testing.assert_array_equal(c, expected[marker_id])
+
+        detector = PyramidDetector(dictionary, scale=2, marker_ids=marker_ids,
+                                   detector=TiledDetector(dictionary, grid=(2, 1), overlap=160, marker_ids=marker_ids))
+        _, ids = detector.detect(image)
+        detector.close()
+        self.assertEqual(sorted(ids[:, 0]), marker_ids)
+
+    def test_tune(self):
+        frames, poses = random_frames(5, seed=3)
+        grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+        truths = [marker_corners(Markers, pose[:2], pose[2:]) for pose in poses]
+        grid = {'adaptiveThreshWinSizeMin': [3, 9], 'adaptiveThreshWinSizeMax': [7, 23],
+                'minMarkerPerimeterRate': [0.03, 0.9]}
+        # windows from min to max only
+        self.assertEqual(len(settings(grid)), 6)
+        _, recall = evaluate(grays, truths, self.dictionary, None, parameters_from_dict({}), repeat=1)
+        self.assertEqual(recall, 1.)
+        setting, seconds, recall = tune(grays, truths, self.dictionary, None, grid=grid, recall=1., repeat=1)
+        self.assertEqual(recall, 1.)
+        # markers are smaller than 0.9 of the frame
+        self.assertEqual(setting['minMarkerPerimeterRate'], 0.03)
+        setting, _, recall = tune(grays, truths, self.dictionary, None, grid={'minMarkerPerimeterRate': [0.9]},
+                                  repeat=1)
+        self.assertEqual(recall, 0.)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from detection import detect_markers
+from flow import CornerFlow
+from frame_sources import open_source
+from markers import Location2, Markers
+from synthetic import marker_corners, synthetic_stream, write_dataset
+from tests.test_frame_sources import replay, setup_wiggler_cv
+
+
+def area_of(gray):
+    return lambda left, top, right, bottom: gray[top:bottom, left:right]
+
+
+class TestCornerFlow(TestCase):
+    def setUp(self):
+        self.dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+        self.stream = [(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), pose)
+                       for frame, pose in synthetic_stream(10, noise=2., seed=4)]
+
+    def test_track(self):
+        flow = CornerFlow(Markers.marker_ids, redetect_every=5)
+        self.assertTrue(flow.due)
+        gray, _ = self.stream[0]
+        flow.start(area_of(gray), (640, 480), *detect_markers(gray, self.dictionary))
+        self.assertFalse(flow.due)
+        for gray, pose in self.stream[1:6]:
+            corners, ids = flow.track(area_of(gray), (640, 480))
+            true_corners, true_ids = marker_corners(Markers, pose[:2], pose[2:])
+            true_index = {marker_id: i for i, marker_id in enumerate(true_ids[:, 0])}
+            self.assertEqual(sorted(ids[:, 0]), sorted(Markers.marker_ids))
+            for c, marker_id in zip(corners, ids[:, 0]):
+                np.testing.assert_allclose(c, true_corners[true_index[marker_id]], atol=1.5)
+            self.assertTrue(flow.accept(Markers.get_location(corners, ids)))
+        # detection is due again
+        self.assertTrue(flow.due)
+        self.assertEqual(flow.tracked, 5)
+
+    def test_lost(self):
+        flow = CornerFlow(Markers.marker_ids)
+        gray, _ = self.stream[0]
+        flow.start(area_of(gray), (640, 480), *detect_markers(gray, self.dictionary))
+        self.assertIsNone(flow.track(area_of(np.full_like(gray, 200)), (640, 480)))
+        self.assertTrue(flow.due)
+        self.assertEqual(flow.lost, 1)
+
+        flow.start(area_of(gray), (640, 480), *detect_markers(gray, self.dictionary))
+        self.assertIsNotNone(flow.track(area_of(self.stream[1][0]), (640, 480)))
+        # RMS residual of 4 px over the 12 corners
+        self.assertFalse(flow.accept(Location2([0., 0.], [1., 0.], 12 * 4. ** 2)))
+        self.assertTrue(flow.due)
+
+    def test_other_markers(self):
+        gray, _ = self.stream[0]
+        corners, ids = detect_markers(gray, self.dictionary)
+        flow = CornerFlow([7, 8, 9])
+        flow.start(area_of(gray), (640, 480), corners, ids)
+        self.assertTrue(flow.due)
+        flow = CornerFlow(Markers.marker_ids, min_markers=1)
+        flow.start(area_of(gray), (640, 480), corners[:1], ids[:1])
+        _, tracked_ids = flow.track(area_of(self.stream[1][0]), (640, 480))
+        np.testing.assert_array_equal(tracked_ids, ids[:1])
+
+    def test_wiggler_cv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            poses = write_dataset(path, 30, seed=5)
+            wcv = setup_wiggler_cv(open_source(path, realtime=False), flow_tracking=True, flow_redetect_every=10)
+            locations = replay(wcv)
+        self.assertEqual([location.frame for location in locations], list(range(30)))
+        for location in locations:
+            np.testing.assert_allclose(location.coordinates, poses[location.frame, :2], atol=1.)
+        counters = wcv.stats()['counters']
+        self.assertGreaterEqual(counters['flow_tracked'], 20)
+        self.assertLessEqual(counters['roi_hits'] + counters.get('roi_fallbacks', 0), 10)
@@ -0,0 +1,176 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from channel import EVERY
+from frame_sources import RawDumpSource, ImageDirectorySource, open_source, yuv420_to_array
+from wiggler_cv import WigglerCV
+
+
+def make_frames(count=10, resolution=(320, 240), constellations=(([42, 18, 12], (0, 0)),)):
+    """
+    Default size constellations at 2px/mm, rotated by 90 degrees, moving 1px right per frame.
+    First one is centred at (160, 120) in the first frame, the others are shifted by the given offset.
+    """
+    dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+    frames = np.full((count, resolution[1], resolution[0], 3), 200, np.uint8)
+    for i, frame in enumerate(frames):
+        for marker_ids, (dx, dy) in constellations:
+            for marker_id, (x, y) in zip(marker_ids, [(145, 175), (84, 70), (206, 70)]):
+                frame[y + dy:y + dy + 30, x + dx + i:x + dx + i + 30] = \
+                    cv2.aruco.drawMarker(dictionary, marker_id, 30)[:, :, None]
+    return frames
+
+
+STREAMING_KEYS = ('stream_cmd', 'gstreamer_pipe')
+
+
+def setup_wiggler_cv(source, cfg_file='wiggler_cv.json', **config):
+    """
+    WigglerCV set up on the source without streaming, the keyword arguments override the config
+    """
+    wcv = WigglerCV(None, source=source)
+    wcv.setup(cfg_file=cfg_file)
+    for k in STREAMING_KEYS:
+        if hasattr(wcv.config, k):
+            delattr(wcv.config, k)
+    for k, v in config.items():
+        setattr(wcv.config, k, v)
+    return wcv
+
+
+def replay(wcv):
+    """
+    Runs wcv to the end of its source
+    :return: every pose published, iterating wcv may drop some
+    """
+    subscription = wcv.subscribe(EVERY, maxsize=1000)
+    wcv.run()
+    poses = list(subscription)
+    wcv.terminate()
+    return poses
+
+
+class Collector:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, buffer):
+        self.frames.append(buffer)
+
+
+class TestFrameSources(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.frames = make_frames()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def replay(self, source):
+        collector = Collector()
+        source.start_recording(collector)
+        source.wait_recording(10)
+        self.assertTrue(source.finished)
+        source.stop_recording()
+        return collector.frames
+
+    def test_npy(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        source = open_source(path, realtime=False)
+        self.assertIsInstance(source, RawDumpSource)
+        self.assertEqual(source.resolution, (320, 240))
+        frames = self.replay(source)
+        self.assertEqual(len(frames), len(self.frames))
+        np.testing.assert_array_equal(frames[3], self.frames[3])
+        self.assertTrue(frames[3].flags.writeable)
+
+    def test_raw(self):
+        path = os.path.join(self.dir.name, 'frames.bgr')
+        self.frames.tofile(path)
+        with self.assertRaises(ValueError):
+            open_source(path)
+        frames = self.replay(open_source(path, resolution=(320, 240), realtime=False))
+        self.assertEqual(len(frames), len(self.frames))
+        np.testing.assert_array_equal(frames[-1], self.frames[-1])
+
+    def test_yuv(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        frames = self.replay(open_source(path, realtime=False, format='yuv'))
+        self.assertEqual(frames[0].shape, (240 * 3 // 2, 320))
+        np.testing.assert_array_equal(frames[0], cv2.cvtColor(self.frames[0], cv2.COLOR_BGR2YUV_I420))
+
+    def test_yuv420_to_array(self):
+        # 100x50 is padded to 128x64 by the camera
+        padded = bytes(128 * 64 * 3 // 2)
+        self.assertEqual(yuv420_to_array(padded, (100, 50)).shape, (96, 128))
+        self.assertEqual(yuv420_to_array(bytes(128 * 64 * 3 // 2), (128, 64)).shape, (96, 128))
+        with self.assertRaises(ValueError):
+            yuv420_to_array(bytes(100), (100, 50))
+
+    def test_image_directory(self):
+        for i, frame in enumerate(self.frames):
+            cv2.imwrite(os.path.join(self.dir.name, '{:04d}.png'.format(i)), frame)
+        source = open_source(self.dir.name, framerate=100.)
+        self.assertIsInstance(source, ImageDirectorySource)
+        frames = self.replay(source)
+        self.assertEqual(len(frames), len(self.frames))
+        np.testing.assert_array_equal(frames[0], self.frames[0])
+
+    def test_replay_wiggler_cv(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        wcv = setup_wiggler_cv(open_source(path, realtime=False))
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        self.assertEqual(wcv.config.input_res_h, 320)
+        self.assertGreater(len(positions), 0)
+        self.assertAlmostEqual(positions[-1].coordinates[0], 160 + 9, delta=2)
+        self.assertAlmostEqual(positions[-1].coordinates[1], 120, delta=2)
+
+    def test_replay_wiggler_cv_pipeline(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        wcv = setup_wiggler_cv(open_source(path, framerate=50.), pipeline=True)
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        self.assertGreater(len(positions), 0)
+        self.assertEqual(set(wcv.dropped_frames.keys()), {'detect', 'annotate', 'stream'})
+
+    def test_replay_wiggler_cv_pipeline_drained(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        wcv = setup_wiggler_cv(open_source(path, realtime=False), pipeline=True, pipeline_drop_policy='block')
+        positions = replay(wcv)
+        # frames still queued when the source ends are detected too
+        self.assertEqual([position.frame for position in positions], list(range(len(self.frames))))
+        self.assertEqual(wcv.dropped_frames, {'detect': 0, 'annotate': 0, 'stream': 0})
+
+    def test_replay_wiggler_cv_pyramid(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        wcv = setup_wiggler_cv(open_source(path, realtime=False), fallback_scale=2, roi_max_size=0)
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        self.assertGreater(len(positions), 0)
+        self.assertAlmostEqual(positions[-1].coordinates[0], 160 + 9, delta=2)
+        self.assertAlmostEqual(positions[-1].coordinates[1], 120, delta=2)
+
+    def test_replay_wiggler_cv_yuv(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+        wcv = setup_wiggler_cv(open_source(path, realtime=False, format='yuv'), debug_level=0)
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        self.assertGreater(len(positions), 0)
+        self.assertAlmostEqual(positions[-1].coordinates[0], 160 + 9, delta=2)
+        self.assertAlmostEqual(positions[-1].coordinates[1], 120, delta=2)
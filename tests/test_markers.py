@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+import numpy as np
+
 from markers import Markers, Location1
 
 
@@ -56,3 +58,108 @@ class TestMarkers(TestCase):
             self.assertAlmostEqual(position.rotscale[1], 0, places=2)
             self.assertAlmostEqual(position.rotscale[0], 2 / Markers.marker_size, places=2)
             self.assertAlmostEqual(position.cost, 0.32, places=2)
+
+
+def project(location_xy, angle, scale, ids, noise=0., rng=None):
+    """
+    Corners of the markers as seen by the camera, in cv2.aruco.detectMarkers format
+    """
+    transform = np.array([
+        [scale * np.cos(angle), -scale * np.sin(angle), location_xy[0]],
+        [scale * np.sin(angle), scale * np.cos(angle), location_xy[1]],
+    ])
+    corners = [np.dot(transform, Markers.markers[i]).T[None, :, :].astype(np.float32) for i in ids]
+    if noise:
+        corners = [c + rng.normal(0, noise, c.shape).astype(np.float32) for c in corners]
+    return corners, np.array([[i] for i in ids])
+
+
+class TestMarkersClosedForm(TestCase):
+    def test_equivalence_lstsq(self):
+        rng = np.random.default_rng(1)
+        for _ in range(50):
+            ids = list(rng.permutation(Markers.marker_ids)[:rng.integers(1, 4)])
+            corners, ids = project(rng.uniform(0, 640, 2), rng.uniform(-np.pi, np.pi), rng.uniform(1, 5), ids,
+                                   noise=1., rng=rng)
+            expected = Markers.get_location_lstsq(corners, ids)
+            position = Markers.get_location(corners, ids)
+            np.testing.assert_allclose(position.coordinates, expected.coordinates, atol=1e-6)
+            np.testing.assert_allclose(position.rotscale, expected.rotscale, atol=1e-9)
+            self.assertAlmostEqual(position.cost, expected.cost, places=6)
+
+    def test_exact_pose(self):
+        corners, ids = project((320, 240), np.pi / 6, 2., Markers.marker_ids)
+        position = Markers.get_location(corners, ids)
+        np.testing.assert_allclose(position.coordinates, (320, 240), atol=1e-3)
+        np.testing.assert_allclose(position.rotscale, (2 * np.cos(np.pi / 6), 2 * np.sin(np.pi / 6)), atol=1e-5)
+        self.assertAlmostEqual(position.cost, 0, places=6)
+
+    def test_unknown_ids(self):
+        corners, ids = project((320, 240), 0., 2., Markers.marker_ids)
+        other_corners, _ = project((100, 100), 1., 3., Markers.marker_ids[:1])
+        position = Markers.get_location(corners + other_corners, np.vstack((ids, [[7]])))
+        np.testing.assert_allclose(position.coordinates, (320, 240), atol=1e-3)
+        self.assertIsNone(Markers.get_location(other_corners, [[7]]))
+        with self.assertRaises(ValueError):
+            Markers.get_location([[[1, 2, 3]]], [[42]])
+
+    def test_batch(self):
+        rng = np.random.default_rng(2)
+        corners_list = []
+        ids_list = []
+        for _ in range(20):
+            ids = list(rng.permutation(Markers.marker_ids)[:rng.integers(1, 4)])
+            corners, ids = project(rng.uniform(0, 640, 2), rng.uniform(-np.pi, np.pi), rng.uniform(1, 5), ids,
+                                   noise=1., rng=rng)
+            corners_list.append(corners)
+            ids_list.append(ids)
+        # nothing detected, only unknown markers, known and unknown markers
+        corners_list[3], ids_list[3] = (), None
+        corners_list[4], ids_list[4] = corners_list[5][:1], [[7]]
+        corners_list[6], ids_list[6] = corners_list[6] + corners_list[7][:1], np.vstack((ids_list[6], [[99]]))
+
+        locations = Markers.get_locations_batch(corners_list, ids_list)
+        self.assertEqual(locations.shape, (20,))
+        for corners, ids, location in zip(corners_list, ids_list, locations):
+            expected = Markers.get_location(corners, ids) if ids is not None else None
+            if expected is None:
+                self.assertTrue(np.isnan(location['coordinates']).all())
+                self.assertTrue(np.isnan(location['cost']))
+            else:
+                np.testing.assert_allclose(location['coordinates'], expected.coordinates, atol=1e-6)
+                np.testing.assert_allclose(location['rotscale'], expected.rotscale, atol=1e-9)
+                self.assertAlmostEqual(location['cost'], expected.cost, places=6)
+
+    def test_batch_empty(self):
+        self.assertEqual(Markers.get_locations_batch([], []).shape, (0,))
+        self.assertTrue(np.isnan(Markers.get_locations_batch([()], [None])['cost']).all())
+
+
+class TestConstellation(TestCase):
+    def test_default(self):
+        markers = Markers()
+        self.assertEqual(markers.marker_ids, Markers.marker_ids)
+        for marker_id in Markers.marker_ids:
+            np.testing.assert_allclose(markers.markers[marker_id], Markers.markers[marker_id])
+
+    def test_instance(self):
+        markers = Markers(marker_ids=[7, 8, 9, 10], marker_size=20., marker_distance=50., angle=np.pi / 2,
+                          name='other')
+        np.testing.assert_allclose(markers.markers[8][:2].mean(axis=1), (0, 50), atol=1e-9)
+        self.assertAlmostEqual(markers.radius, 50 + 10 * np.sqrt(2))
+        corners = [np.dot(np.array([[2., 0., 300.], [0., 2., 200.]]), markers.markers[i]).T[None, :, :]
+                   for i in (7, 8, 9, 10)]
+        ids = [[7], [8], [9], [10]]
+        position = markers.get_location(corners, ids)
+        np.testing.assert_allclose(position.coordinates, (300, 200), atol=1e-6)
+        np.testing.assert_allclose(position.rotscale, (2, 0), atol=1e-9)
+        # default constellation does not know these markers
+        self.assertIsNone(Markers.get_location(corners, ids))
+        locations = markers.get_locations_batch([corners], [ids])
+        np.testing.assert_allclose(locations['coordinates'][0], (300, 200), atol=1e-6)
+
+    def test_from_config(self):
+        markers = Markers.from_config({'name': 'bot', 'marker_ids': [1, 2, 3], 'angle_deg': 90})
+        self.assertEqual(markers.name, 'bot')
+        self.assertAlmostEqual(markers.angle, np.pi / 2)
+        self.assertEqual(markers.marker_size, Markers.marker_size)
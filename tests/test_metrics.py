@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import urllib.request
+from unittest import TestCase
+
+import numpy as np
+
+from frame_sources import open_source
+from metrics import Histogram, Metrics, MetricsServer
+from tests.test_frame_sources import make_frames, replay, setup_wiggler_cv
+
+
+class TestHistogram(TestCase):
+    def test_percentiles(self):
+        histogram = Histogram(window=1000)
+        for value in range(1, 101):
+            histogram.add(value / 1000)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['p50'], 0.0505)
+        self.assertAlmostEqual(summary['p99'], 0.09901)
+        self.assertAlmostEqual(summary['max'], 0.1)
+        self.assertAlmostEqual(summary['sum'], 5.05)
+
+    def test_rolling_window(self):
+        histogram = Histogram(window=10)
+        for value in range(25):
+            histogram.add(value)
+        np.testing.assert_array_equal(histogram.samples, np.arange(15, 25))
+        self.assertEqual(histogram.summary()['count'], 25)
+        self.assertEqual(histogram.summary()['max'], 24)
+
+    def test_resize(self):
+        histogram = Histogram(window=10)
+        for value in range(25):
+            histogram.add(value)
+        histogram.resize(4)
+        np.testing.assert_array_equal(histogram.samples, np.arange(21, 25))
+        histogram.add(25)
+        np.testing.assert_array_equal(histogram.samples, np.arange(22, 26))
+        histogram.resize(8)
+        histogram.add(26)
+        np.testing.assert_array_equal(histogram.samples, np.arange(22, 27))
+        self.assertEqual(histogram.count, 27)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().summary(), {'count': 0, 'sum': 0.})
+
+
+class TestMetrics(TestCase):
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.observe('aruco', 0.002)
+        metrics.increment('frames')
+        metrics.increment('frames', 2)
+        metrics.add_collector(lambda m: m.set_gauge('depth', 3))
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'frames': 3})
+        self.assertEqual(snapshot['gauges'], {'depth': 3})
+        self.assertAlmostEqual(snapshot['histograms']['aruco']['p95'], 0.002)
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.observe('aruco', 0.5)
+        metrics.increment('roi_hits')
+        metrics.set_gauge('queue_depth', 1, stage='detect')
+        metrics.set_gauge('tracked', 1, robot='bot "1"\\')
+        text = metrics.prometheus()
+        self.assertIn('# TYPE wiggler_aruco_seconds summary\n', text)
+        self.assertIn('wiggler_aruco_seconds{quantile="0.95"} 0.5\n', text)
+        self.assertIn('wiggler_aruco_seconds_count 1\n', text)
+        self.assertIn('wiggler_roi_hits_total 1\n', text)
+        self.assertIn('# TYPE wiggler_queue_depth gauge\nwiggler_queue_depth{stage="detect"} 1\n', text)
+        self.assertIn('wiggler_tracked{robot="bot \\"1\\"\\\\"} 1\n', text)
+        self.assertEqual(metrics.snapshot()['gauges']['queue_depth'], {'detect': 1})
+
+    def test_server(self):
+        metrics = Metrics()
+        metrics.increment('frames')
+        server = MetricsServer(metrics, port=0)
+        try:
+            url = 'http://{}:{}'.format(*server.address)
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertIn('wiggler_frames_total 1', response.read().decode())
+            with urllib.request.urlopen(url + '/stats') as response:
+                self.assertEqual(json.loads(response.read().decode())['counters'], {'frames': 1})
+        finally:
+            server.close()
+
+
+class TestWigglerCVStats(TestCase):
+    def test_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            np.save(path, make_frames(10))
+            wcv = setup_wiggler_cv(open_source(path, realtime=False), warmup=True)
+            replay(wcv)
+        stats = wcv.stats()
+        self.assertEqual(stats['counters']['frames'], 10)
+        self.assertEqual(stats['counters']['roi_hits'] + stats['counters']['roi_fallbacks'], 10)
+        for name in ('aruco', 'capture_to_pose'):
+            self.assertEqual(stats['histograms'][name]['count'], 10)
+        # nothing annotated nor streamed without a streaming sink
+        for name in ('osd', 'streaming', 'capture_to_stream'):
+            self.assertNotIn(name, stats['histograms'])
+        self.assertGreaterEqual(stats['histograms']['capture_to_pose']['p50'], stats['histograms']['aruco']['p50'])
+        self.assertIn('roi_hit_rate', stats['gauges'])
+        self.assertEqual(stats['gauges']['tracked'], {'wigglebot': 1})
+        # detectors warmed up before the first frame
+        self.assertEqual(stats['histograms']['warmup']['count'], 1)
+        self.assertGreaterEqual(stats['gauges']['time_to_first_pose'], stats['histograms']['warmup']['max'])
@@ -0,0 +1,66 @@
+import time
+from unittest import TestCase
+
+from fake_pigpio import FakePi
+from motor_driver import MotorDriver
+from sonicmotors import Motors as SonicMotors
+from vibromotors import Motors
+
+
+class TestVibroMotors(TestCase):
+    def test_changed_pins_only(self):
+        pi = FakePi()
+        motors = Motors(pi)
+        motors.set((0.5, 0.5, 0.5))
+        motors.set((0.5, 1., 0.5))
+        self.assertEqual(pi.calls['set_PWM_dutycycle'], 4)
+        self.assertEqual(pi.pwm_dutycycles, {23: 127, 24: 255, 25: 127})
+
+
+class TestMotorDriver(TestCase):
+    def test_coalesce(self):
+        pi = FakePi()
+        driver = MotorDriver(Motors(pi), start=False)
+        for speed in (0.1, 0.2, 0.3):
+            driver.set((speed, 0., 0.))
+        self.assertNotIn('set_PWM_dutycycle', pi.calls)
+        time.sleep(0.01)
+        self.assertTrue(driver.flush())
+        self.assertEqual(pi.pwm_dutycycles[23], int(255 * 0.3))
+        # from the last set() to the write
+        self.assertGreaterEqual(driver.command_latency, 0.01)
+        self.assertEqual((driver.commands, driver.coalesced, driver.writes), (3, 2, 1))
+        driver.set((0.3, 0., 0.))
+        self.assertFalse(driver.flush())
+        self.assertFalse(driver.flush())
+        self.assertEqual(driver.writes, 1)
+
+    def test_thread(self):
+        pi = FakePi()
+        with MotorDriver(Motors(pi), rate=200.) as driver:
+            driver.set((1., 0., 0.))
+            time.sleep(0.05)
+            self.assertEqual(pi.pwm_dutycycles[23], 255)
+            driver.set((0., 1., 0.))
+        # pending command applied on close
+        self.assertEqual(pi.pwm_dutycycles, {23: 0, 24: 255, 25: 0})
+        self.assertEqual(driver.writes, 2)
+
+    def test_off(self):
+        pi = FakePi()
+        driver = MotorDriver(Motors(pi), start=False)
+        driver.set((1., 1., 1.))
+        driver.flush()
+        driver.set((0.5, 0.5, 0.5))
+        driver.off()
+        self.assertFalse(driver.flush())
+        self.assertEqual(set(pi.pwm_dutycycles.values()), {0})
+
+    def test_sonic_motors(self):
+        pi = FakePi()
+        driver = MotorDriver(SonicMotors(pi), start=False)
+        driver.set((0.1, 0.2, 0.3))
+        driver.set((0.2, 0.2, 0.3))
+        driver.flush()
+        self.assertEqual(pi.calls['wave_create'], 1)
+        self.assertIsNotNone(pi.wave_tx)
@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+import numpy as np
+
+from osd import OsdDot, OsdLayer, OsdText, OsdVector, TextCache
+from wiggler_cv import WigglerCV
+
+ITEMS = [OsdText(x=5, y=20, text='x  320px'), OsdText(x=5, y=40, text='scale 2.0px/mm'),
+         OsdVector(x1=320, y1=200, x2=360, y2=220), OsdDot(x=100, y=100)]
+
+
+def background():
+    image = np.full((240, 400, 3), 90, dtype=np.uint8)
+    image[::7] = 200
+    return image
+
+
+class TestOsdLayer(TestCase):
+    def test_same_as_direct_drawing(self):
+        expected = background()
+        WigglerCV(None).draw_osd_list(expected, ITEMS)
+        layer = OsdLayer()
+        layer.update(ITEMS)
+        image = background()
+        layer.draw(image)
+        # blending rounds differently from the cv2 anti-aliasing
+        self.assertLessEqual(np.abs(image.astype(int) - expected).max(), 3)
+
+    def test_renders_changed_items_only(self):
+        layer = OsdLayer()
+        layer.update(ITEMS)
+        layer.update(ITEMS)
+        self.assertEqual(layer.rendered, len(ITEMS))
+        layer.update(ITEMS[:-1] + [OsdDot(x=101, y=100)])
+        self.assertEqual(layer.rendered, len(ITEMS) + 1)
+
+    def test_clipped(self):
+        layer = OsdLayer()
+        layer.update([OsdText(x=380, y=5, text='OUTSIDE'), OsdDot(x=-20, y=-20)])
+        image = background()
+        layer.draw(image)
+        self.assertTrue((image[:5, 380:] != background()[:5, 380:]).any())
+
+    def test_text_cache(self):
+        texts = TextCache(size=2)
+        first, _ = texts.text('a')
+        texts.text('b')
+        self.assertIs(texts.text('a')[0], first)
+        texts.text('c')
+        self.assertIs(texts.text('a')[0], first)
+        texts.text('b')
+        self.assertEqual(texts.misses, 4)
@@ -0,0 +1,87 @@
+import threading
+from unittest import TestCase
+
+from pipeline import StageQueue, Pipeline, DROP_OLDEST, DROP_NEWEST, BLOCK
+
+
+class TestStageQueue(TestCase):
+    def test_drop_oldest(self):
+        q = StageQueue(2, DROP_OLDEST)
+        for i in range(5):
+            q.put(i)
+        self.assertEqual(q.dropped, 3)
+        self.assertEqual([q.get(), q.get()], [3, 4])
+
+    def test_drop_newest(self):
+        q = StageQueue(2, DROP_NEWEST)
+        self.assertEqual([q.put(i) for i in range(4)], [True, True, False, False])
+        self.assertEqual(q.dropped, 2)
+        self.assertEqual([q.get(), q.get()], [0, 1])
+
+    def test_block(self):
+        q = StageQueue(1, BLOCK)
+        q.put(0)
+        thread = threading.Thread(target=q.put, args=(1,))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(q.get(), 0)
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(q.get(), 1)
+        self.assertEqual(q.dropped, 0)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            StageQueue(1, 'drop_random')
+
+    def test_close(self):
+        q = StageQueue(1)
+        q.put(0)
+        q.close()
+        self.assertEqual(q.get(), 0)
+        self.assertIsNone(q.get())
+
+
+class TestPipeline(TestCase):
+    def test_stages(self):
+        results = []
+        done = threading.Event()
+
+        def last(item):
+            results.append(item)
+            if len(results) == 10:
+                done.set()
+
+        pipeline = Pipeline([('add', lambda x: x + 1), ('double', lambda x: x * 2), ('collect', last)],
+                            queue_size=10, drop_policy=BLOCK)
+        pipeline.start()
+        for i in range(10):
+            pipeline.put(i)
+        self.assertTrue(done.wait(5))
+        pipeline.stop()
+        self.assertEqual(results, [(i + 1) * 2 for i in range(10)])
+        self.assertEqual(pipeline.dropped, {'add': 0, 'double': 0, 'collect': 0})
+
+    def test_stop_drains(self):
+        results = []
+        pipeline = Pipeline([('add', lambda x: x + 1), ('double', lambda x: x * 2), ('collect', results.append)],
+                            queue_size=10, drop_policy=BLOCK)
+        pipeline.start()
+        for i in range(10):
+            pipeline.put(i)
+        # stopped right away, the queued items still go through every stage
+        pipeline.stop()
+        self.assertEqual(results, [(i + 1) * 2 for i in range(10)])
+
+    def test_drop_counters(self):
+        release = threading.Event()
+        pipeline = Pipeline([('slow', lambda x: release.wait(5) and x), ('sink', lambda x: None)],
+                            drop_policy={'slow': DROP_OLDEST})
+        pipeline.start()
+        for i in range(5):
+            pipeline.put(i)
+        release.set()
+        pipeline.stop()
+        self.assertGreaterEqual(pipeline.dropped['slow'], 3)
+        self.assertEqual(pipeline.dropped['sink'], 0)
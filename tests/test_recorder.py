@@ -0,0 +1,94 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from frame_sources import open_source
+from recorder import FlightRecorder, FlightRecording, RecordingSource
+from tests.test_frame_sources import Collector, make_frames, replay, setup_wiggler_cv
+from wiggler_cv import Frame, RobotLocation
+
+
+class TestFlightRecorder(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'recording')
+        self.frames = make_frames(10)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def record(self, format, yuv=False, slots=4):
+        recorder = FlightRecorder(self.path, (320, 240), slots=slots, format=format)
+        for i, image in enumerate(self.frames):
+            if yuv:
+                # padded like the camera buffers
+                data = np.zeros((256 * 3 // 2, 320), dtype=np.uint8)
+                i420 = cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420)
+                data[:240] = i420[:240]
+                chroma = data.reshape(-1)[320 * 256:].reshape((2, 128, 160))
+                chroma[:, :120] = i420[240:].reshape((2, 120, 160))
+                frame = Frame(i, i * 0.04, i * 0.04, yuv=data, resolution=(320, 240))
+            else:
+                frame = Frame(i, i * 0.04, i * 0.04, image=image)
+            recorder.write(frame)
+            recorder.add_pose(RobotLocation('wigglebot', (i, 2. * i), (2., 0.), 0.5, frame=i, timestamp=i * 0.04,
+                                            latency=0.01))
+        recorder.close()
+        return FlightRecording(self.path)
+
+    def test_ring(self):
+        recording = self.record('gray')
+        np.testing.assert_array_equal(recording.frames, [6, 7, 8, 9])
+        np.testing.assert_array_equal(recording.frame(7), cv2.cvtColor(self.frames[7], cv2.COLOR_BGR2GRAY))
+        self.assertAlmostEqual(recording.timestamp(8), 0.32)
+        self.assertEqual(recording.find(0.33), 8)
+        self.assertEqual(recording.find(0.), 6)
+        with self.assertRaises(KeyError):
+            recording.frame(5)
+
+    def test_poses(self):
+        recording = self.record('bgr')
+        np.testing.assert_array_equal(recording.frame(9), self.frames[9])
+        self.assertEqual(len(recording.poses), 10)
+        pose, = recording.frame_poses(7)
+        self.assertEqual(pose['robot'], b'wigglebot')
+        self.assertEqual((pose['x'], pose['y'], pose['cost']), (7., 14., 0.5))
+
+    def test_yuv_source(self):
+        recording = self.record('yuv', yuv=True)
+        np.testing.assert_array_equal(recording.frame(6), cv2.cvtColor(self.frames[6], cv2.COLOR_BGR2YUV_I420))
+        source = RecordingSource(recording, start=7, format='bgr')
+        collector = Collector()
+        source.start_recording(collector)
+        source.wait_recording(5)
+        source.stop_recording()
+        self.assertEqual(len(collector.frames), 3)
+        np.testing.assert_allclose(collector.frames[0], self.frames[7], atol=4)
+
+    def test_replay_wiggler_cv(self):
+        path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(path, self.frames)
+
+        def run(source, **config):
+            return replay(setup_wiggler_cv(source, **config))
+
+        positions = run(open_source(path, realtime=False), record_path=self.path, record_slots=20)
+        recording = FlightRecording(self.path)
+        self.assertEqual(len(recording), 10)
+        self.assertEqual(len(recording.poses), len(positions))
+        replayed = run(open_source(self.path, realtime=False, format='yuv'))
+        # same frames and timestamps, same poses
+        self.assertEqual([p.frame for p in replayed], [p.frame for p in positions])
+        for original, position in zip(positions, replayed):
+            self.assertEqual(position.timestamp, original.timestamp)
+            np.testing.assert_allclose(position.coordinates, original.coordinates)
+        # replayed from the middle, frame numbers and timestamps still match the recording and its pose log
+        partial = run(recording.source(start=4))
+        self.assertEqual([p.frame for p in partial], [p.frame for p in positions if p.frame >= 4])
+        for position in partial:
+            pose, = recording.frame_poses(position.frame)
+            self.assertEqual(position.timestamp, recording.timestamp(position.frame))
+            np.testing.assert_allclose(position.coordinates, (pose['x'], pose['y']))
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+from collections import namedtuple
+from unittest import TestCase
+
+import numpy as np
+
+from frame_sources import open_source
+from scheduler import DRAWING, FALLBACK, STREAMING, FrameScheduler
+from tests.test_frame_sources import make_frames
+from tests.test_streaming import reader_cmd
+from wiggler_cv import WigglerCV
+
+Frame = namedtuple('Frame', ['capture_time'])
+
+
+class TestFrameScheduler(TestCase):
+    def test_fits(self):
+        scheduler = FrameScheduler(0.04)
+        frame = Frame(time.perf_counter())
+        # never measured
+        self.assertTrue(scheduler.fits(frame, DRAWING))
+        scheduler.observe(DRAWING, 0.02)
+        scheduler.observe(STREAMING, 0.03)
+        self.assertTrue(scheduler.fits(frame, DRAWING))
+        self.assertFalse(scheduler.fits(frame, DRAWING, STREAMING))
+        scheduler.observe(DRAWING, 0.)
+        self.assertAlmostEqual(scheduler.costs[DRAWING], 0.016)
+        self.assertFalse(scheduler.missed(frame))
+        self.assertTrue(scheduler.missed(Frame(time.perf_counter() - 0.05)))
+
+    def test_fallback_deferred(self):
+        scheduler = FrameScheduler(0.04, fallback_every=3)
+        scheduler.observe(FALLBACK, 0.1)
+        late = [scheduler.fallback(Frame(time.perf_counter())) for _ in range(7)]
+        self.assertEqual(late, [False, False, True, False, False, True, False])
+        scheduler.observe(FALLBACK, 0.)
+        scheduler.costs[FALLBACK] = 0.
+        self.assertTrue(scheduler.fallback(Frame(time.perf_counter())))
+
+
+class TestWigglerCVDeadline(TestCase):
+    def test_degradation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            np.save(path, make_frames(10))
+            wcv = WigglerCV(None, source=open_source(path, realtime=False))
+            wcv.setup(cfg_file='wiggler_cv.json')
+            if hasattr(wcv.config, 'gstreamer_pipe'):
+                delattr(wcv.config, 'gstreamer_pipe')
+            wcv.config.stream_cmd = reader_cmd(os.path.join(directory, 'stream.yuv'))
+            wcv.config.stream_process = True
+            wcv.config.frame_scheduler = True
+            # every frame is late
+            wcv.config.frame_budget = 1e-9
+            wcv.config.fallback_defer_every = 5
+            wcv.run()
+            positions = list(wcv)
+            wcv.terminate()
+        counters = wcv.stats()['counters']
+        # full-frame search on every fifth frame only, then found in the ROI
+        self.assertEqual(counters['fallback_deferred'], 4)
+        self.assertEqual(counters['full_frame_searches'], 1)
+        self.assertEqual(counters['roi_hits'], 5)
+        self.assertEqual(positions[-1].frame, 9)
+        self.assertEqual(counters['shed_streaming'], 10)
+        self.assertEqual(counters['deadline_misses'], 10)
+        self.assertNotIn('streaming', wcv.stats()['histograms'])
@@ -0,0 +1,70 @@
+import contextlib
+import io
+from unittest import TestCase
+
+import pigpio
+
+from fake_pigpio import FakePi
+from sonicmotors import Motors
+
+
+class TestCachedMotors(TestCase):
+    def test_wave(self):
+        motors = Motors(FakePi(), freq=2500, phase_steps=4)
+        pulses = motors.wave_points(motors.key((0.25, 0., 0.5)))
+        self.assertEqual(sum(pulse.delay for pulse in pulses), 400)
+        pin = {p: 1 << p for p in motors.pins}
+        self.assertEqual([(pulse.gpio_on, pulse.gpio_off, pulse.delay) for pulse in pulses], [
+            (pin[19] | pin[21], pin[22], 100),
+            (pin[20], 0, 100),
+            (pin[22], pin[19] | pin[21], 100),
+            (0, pin[20], 100),
+        ])
+
+    def test_cached(self):
+        pi = FakePi()
+        motors = Motors(pi, phase_steps=64)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            motors.set((0.1, 0.2, 0.3))
+            motors.set((0.5, 0.2, 0.3))
+            motors.set((0.1, 0.2, 0.3))
+            # same quantized phases
+            motors.set((0.1001, 0.2, 0.3))
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(pi.calls['wave_create'], 2)
+        self.assertEqual(pi.calls['wave_send_using_mode'], 3)
+        self.assertNotIn('wave_clear', pi.calls)
+        self.assertEqual(pi.wave_mode, pigpio.WAVE_MODE_REPEAT_SYNC)
+        self.assertEqual(pi.wave_tx, motors._waves[motors.key((0.1, 0.2, 0.3))])
+        self.assertEqual((motors.hits, motors.misses), (2, 2))
+
+    def test_lru(self):
+        pi = FakePi()
+        motors = Motors(pi, phase_steps=64, cache_size=2)
+        motors.set((0.1, 0., 0.))
+        motors.set((0.2, 0., 0.))
+        motors.set((0.1, 0., 0.))
+        motors.set((0.3, 0., 0.))
+        self.assertEqual(pi.calls['wave_delete'], 1)
+        self.assertEqual(len(pi.waves), 2)
+        self.assertEqual(set(motors._waves), {motors.key((0.1, 0., 0.)), motors.key((0.3, 0., 0.))})
+
+    def test_out_of_resources(self):
+        pi = FakePi()
+        motors = Motors(pi)
+        # waves created by somebody else use up all ids
+        for _ in range(250 - len(pi.waves)):
+            pi.wave_create()
+        motors.set((0.1, 0.2, 0.3))
+        self.assertEqual(len(pi.waves), 1)
+        self.assertEqual(pi.wave_tx, list(pi.waves)[0])
+
+    def test_off(self):
+        pi = FakePi()
+        motors = Motors(pi)
+        motors.set((0.1, 0.2, 0.3))
+        motors.off()
+        self.assertIsNone(pi.wave_tx)
+        motors.set((0.1, 0.2, 0.3))
+        self.assertEqual(pi.calls['wave_create'], 1)
+        self.assertIsNotNone(pi.wave_tx)
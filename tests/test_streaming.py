@@ -0,0 +1,153 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from frame_sources import open_source
+from streaming import FrameRing, StreamRate, StreamSink
+from tests.test_frame_sources import make_frames
+from wiggler_cv import WigglerCV
+
+
+def reader_cmd(path, delay=0.):
+    """
+    Command reading the stream from stdin into path, delay seconds per 64kB
+    """
+    script = ('import sys, time\n'
+              'with open(sys.argv[1], "wb") as f:\n'
+              '    while True:\n'
+              '        data = sys.stdin.buffer.read(65536)\n'
+              '        if not data:\n'
+              '            break\n'
+              '        f.write(data)\n'
+              '        time.sleep(float(sys.argv[2]))\n')
+    return [sys.executable, '-c', script, path, str(delay)]
+
+
+class TestFrameRing(TestCase):
+    def test_write_read(self):
+        writer = FrameRing((64, 48), slots=3)
+        reader = FrameRing((64, 48), slots=3, name=writer.name)
+        try:
+            self.assertEqual(reader.latest, -1)
+            image = np.random.default_rng(0).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+            sequence = writer.write(image=image)
+            self.assertEqual(reader.latest, sequence)
+            np.testing.assert_array_equal(reader.frame(sequence), cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420))
+            yuv = np.full((72, 64), 7, dtype=np.uint8)
+            for _ in range(3):
+                writer.write(yuv=yuv)
+            # overwritten by the writer
+            self.assertIsNone(reader.frame(sequence))
+            self.assertFalse(reader.valid(sequence))
+            self.assertEqual(reader.frame(reader.latest)[0, 0], 7)
+        finally:
+            reader.close()
+            writer.close()
+
+
+class TestStreamRate(TestCase):
+    def test_decimation(self):
+        rate = StreamRate(10, 25)
+        streamed = [i for i in range(50) if rate.take(i / 25.)]
+        self.assertEqual(len(streamed), 20)
+        self.assertEqual(streamed[:4], [0, 3, 5, 8])
+        rate = StreamRate(30, 25)
+        self.assertEqual(sum(rate.take(i / 25.) for i in range(50)), 50)
+
+    def test_adaptive(self):
+        rate = StreamRate(25, 25, adaptive=True, min_fps=2, budget=0.04, headroom=1.)
+        for i in range(100):
+            streamed = rate.take(i / 25.)
+            rate.update(0.02, 0.04 if streamed else None)
+        # 0.02 + 0.04 * fps / 25 <= 0.04
+        self.assertAlmostEqual(rate.fps, 12.5)
+        for i in range(100, 200):
+            streamed = rate.take(i / 25.)
+            rate.update(0.05, 0.04 if streamed else None)
+        self.assertEqual(rate.fps, 2)
+        for i in range(200, 400):
+            streamed = rate.take(i / 25.)
+            rate.update(0.001, 0.001 if streamed else None)
+        self.assertEqual(rate.fps, 25)
+
+
+class TestStreamSink(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'stream.yuv')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_stream(self):
+        sink = StreamSink((64, 48), 25, stream_cmd=reader_cmd(self.path))
+        yuv = np.full((72, 64), 1, dtype=np.uint8)
+        for i in range(5):
+            yuv[:] = i
+            sink.write(yuv=yuv)
+            self.assertTrue(sink.wait_streamed(i + 1))
+        sink.close()
+        data = np.fromfile(self.path, dtype=np.uint8).reshape((-1, 72, 64))
+        self.assertEqual(sink.streamed, 5)
+        np.testing.assert_array_equal(data[:, 0, 0], np.arange(5))
+
+    def test_skips_when_behind(self):
+        # about 60kB per frame, the reader takes 50ms per 64kB
+        sink = StreamSink((200, 200), 25, stream_cmd=reader_cmd(self.path, delay=0.05))
+        image = np.zeros((200, 200, 3), dtype=np.uint8)
+        start_time = time.perf_counter()
+        for _ in range(50):
+            sink.write(image=image)
+            time.sleep(0.002)
+        write_time = time.perf_counter() - start_time
+        self.assertTrue(sink.wait_streamed(50, timeout=10.))
+        sink.close()
+        self.assertLess(write_time, 1.)
+        self.assertGreater(sink.skipped, 0)
+        self.assertEqual(sink.streamed + sink.skipped, 50)
+
+    def test_wiggler_cv(self):
+        source_path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(source_path, make_frames(10))
+        wcv = WigglerCV(None, source=open_source(source_path, realtime=False))
+        wcv.setup(cfg_file='wiggler_cv.json')
+        if hasattr(wcv.config, 'gstreamer_pipe'):
+            delattr(wcv.config, 'gstreamer_pipe')
+        wcv.config.stream_cmd = reader_cmd(self.path)
+        wcv.config.stream_process = True
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        self.assertGreater(len(positions), 0)
+        self.assertEqual(os.path.getsize(self.path) % (320 * 240 * 3 // 2), 0)
+        self.assertGreater(os.path.getsize(self.path), 0)
+
+    def test_wiggler_cv_decimated(self):
+        source_path = os.path.join(self.dir.name, 'frames.npy')
+        np.save(source_path, make_frames(10))
+        wcv = WigglerCV(None, source=open_source(source_path, framerate=25., realtime=False))
+        wcv.setup(cfg_file='wiggler_cv.json')
+        if hasattr(wcv.config, 'gstreamer_pipe'):
+            delattr(wcv.config, 'gstreamer_pipe')
+        wcv.config.stream_cmd = reader_cmd(self.path)
+        wcv.config.stream_process = True
+        wcv.config.stream_res = [160, 120]
+        wcv.config.stream_fps = 5
+        wcv.run()
+        positions = list(wcv)
+        wcv.terminate()
+        stats = wcv.stats()
+        # analysis at the full rate, every fifth frame annotated and streamed
+        self.assertEqual(stats['counters']['frames'], 10)
+        self.assertEqual(stats['histograms']['aruco']['count'], 10)
+        self.assertEqual(stats['histograms']['osd']['count'], 2)
+        self.assertEqual(stats['histograms']['streaming']['count'], 2)
+        self.assertEqual(stats['gauges']['stream_fps'], 5)
+        self.assertGreater(len(positions), 0)
+        self.assertGreater(os.path.getsize(self.path), 0)
+        self.assertEqual(os.path.getsize(self.path) % (160 * 120 * 3 // 2), 0)
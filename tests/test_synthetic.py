@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from detection import detect_markers
+from frame_sources import open_source
+from markers import Markers
+from synthetic import degrade, load_poses, random_frames, synthetic_stream, walk_poses, write_dataset
+from tests.test_frame_sources import Collector
+
+
+class TestSynthetic(TestCase):
+    def test_walk(self):
+        poses = walk_poses(np.random.default_rng(0), 500, speed=4.)
+        margin = 3. * Markers.radius
+        self.assertTrue(np.all(poses[:, 0] >= margin) and np.all(poses[:, 0] <= 640 - margin))
+        self.assertTrue(np.all(poses[:, 1] >= margin) and np.all(poses[:, 1] <= 480 - margin))
+        steps = np.linalg.norm(np.diff(poses[:, :2], axis=0), axis=1)
+        self.assertLessEqual(steps.max(), 6. + 1e-9)
+        scales = np.linalg.norm(poses[:, 2:], axis=1)
+        self.assertTrue(np.all(scales >= 1.5) and np.all(scales <= 3.))
+
+    def test_degrade(self):
+        image = np.full((48, 64, 3), 100, np.uint8)
+        image[10:30, 10:30] = 0
+        self.assertTrue(np.array_equal(degrade(image.copy(), np.random.default_rng(0)), image))
+        degraded = degrade(image.copy(), np.random.default_rng(0), blur=2., noise=5., lighting=0.3)
+        np.testing.assert_array_equal(degraded, degrade(image.copy(), np.random.default_rng(0), blur=2., noise=5.,
+                                                        lighting=0.3))
+        self.assertGreater(np.abs(degraded.astype(int) - image).mean(), 1)
+
+    def test_ground_truth(self):
+        for frame, pose in synthetic_stream(10, motion='random', blur=1., noise=3., lighting=0.2, seed=1):
+            corners, ids = detect_markers(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+                                          cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100))
+            location = Markers.get_location(corners, ids)
+            np.testing.assert_allclose(location.coordinates, pose[:2], atol=1.)
+            np.testing.assert_allclose(location.rotscale, pose[2:], atol=0.05)
+
+    def test_random_frames(self):
+        frames, poses = random_frames(3, seed=2)
+        for frame, pose, (expected, expected_pose) in zip(frames, poses, synthetic_stream(3, motion='random', seed=2)):
+            np.testing.assert_array_equal(frame, expected)
+            np.testing.assert_array_equal(pose, expected_pose)
+
+    def test_dataset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            poses = write_dataset(path, 5, resolution=(320, 240), scale=(1., 1.5), noise=2.)
+            np.testing.assert_array_equal(load_poses(path), poses)
+            source = open_source(path, realtime=False)
+            collector = Collector()
+            source.start_recording(collector)
+            source.wait_recording(5)
+            source.stop_recording()
+            self.assertEqual(len(collector.frames), 5)
+            self.assertEqual(collector.frames[0].shape, (240, 320, 3))
@@ -0,0 +1,106 @@
+import math
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from frame_sources import open_source
+from markers import Location2
+from tests.test_frame_sources import make_frames, setup_wiggler_cv
+from tracker import RoiTracker
+
+
+def location(x, y, scale=2.):
+    return Location2(coordinates=[x, y], rotscale=[scale, 0.], cost=0.)
+
+
+class TestRoiTracker(TestCase):
+    def test_no_position(self):
+        tracker = RoiTracker()
+        self.assertIsNone(tracker.roi(0., (640, 480)))
+        self.assertIsNone(tracker.predict(0.))
+
+    def test_fixed(self):
+        tracker = RoiTracker(predictive=False, fixed_size=100)
+        tracker.update(0., location(300, 200))
+        tracker.update(0.04, location(320, 200))
+        self.assertEqual(tracker.roi(0.08, (640, 480)), (270, 150, 371, 251))
+        self.assertEqual(tracker.roi(0.08, (340, 480))[2], 340)
+
+    def test_constant_velocity(self):
+        tracker = RoiTracker()
+        for i in range(20):
+            tracker.update(i * 0.04, location(100 + 10 * i, 300 - 5 * i))
+        x, y = tracker.predict(20 * 0.04)
+        self.assertAlmostEqual(x, 300, delta=0.5)
+        self.assertAlmostEqual(y, 200, delta=0.5)
+        left, top, right, bottom = tracker.roi(20 * 0.04, (640, 480))
+        self.assertAlmostEqual((left + right) / 2, 300, delta=1)
+        self.assertAlmostEqual((top + bottom) / 2, 200, delta=1)
+
+    def test_size(self):
+        tracker = RoiTracker(margin=1., sigma=3., min_size=10)
+        for i in range(20):
+            tracker.update(i * 0.04, location(300, 200, scale=2.))
+        left, _, right, _ = tracker.roi(20 * 0.04, (640, 480))
+        # constellation extent plus a few pixels of position uncertainty
+        self.assertGreater(right - left, 2 * 2 * tracker.radius)
+        self.assertLess(right - left, 2 * 2 * tracker.radius + 20)
+        # uncertainty grows while the marker is not seen
+        left_late, _, right_late, _ = tracker.roi(2., (640, 480))
+        self.assertGreater(right_late - left_late, right - left)
+
+    def test_max_size(self):
+        tracker = RoiTracker(max_size=100)
+        tracker.update(0., location(300, 200, scale=5.))
+        self.assertIsNone(tracker.roi(0.04, (640, 480)))
+
+    def test_hit_rate(self):
+        tracker = RoiTracker()
+        self.assertEqual(tracker.hit_rate, 0.)
+        for hit in (True, True, True, False):
+            tracker.searched(hit, True)
+        tracker.searched(False, False)
+        self.assertTrue(math.isclose(tracker.hit_rate, 0.6))
+        self.assertEqual(tracker.losses, 1)
+
+
+class TestMultiRobot(TestCase):
+    def test_two_robots(self):
+        frames = make_frames(count=20, resolution=(640, 240), constellations=(([42, 18, 12], (0, 0)),
+                                                                              ([7, 8, 9], (300, 0))))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.npy')
+            np.save(path, frames)
+            wcv = setup_wiggler_cv(open_source(path, realtime=False),
+                                   robots=[{'name': 'first', 'marker_ids': [42, 18, 12]},
+                                           {'name': 'second', 'marker_ids': [7, 8, 9]},
+                                           {'name': 'absent', 'marker_ids': [1, 2, 3]}])
+            frame_ids = []
+            processed = wcv._processed
+            wcv._processed = lambda frame: (frame_ids.append(sorted(frame.ids[:, 0])), processed(frame))
+            detect_frame = wcv._detect_frame
+
+            def coarse_detect_frame(gray):
+                # full-frame searches after the first frame find a single marker, as a coarse fallback may
+                corners, ids = detect_frame(gray)
+                return (corners[:1], ids[:1]) if frame_ids else (corners, ids)
+
+            wcv._detect_frame = coarse_detect_frame
+            wcv.run()
+            positions = {}
+            for position in wcv:
+                positions[position.robot] = position
+            wcv.terminate()
+
+        self.assertEqual(set(positions.keys()), {'first', 'second'})
+        self.assertAlmostEqual(positions['first'].coordinates[0], 160 + 19, delta=2)
+        self.assertAlmostEqual(positions['second'].coordinates[0], 460 + 19, delta=2)
+        trackers = {robot.name: robot.tracker for robot in wcv.robots}
+        # found in their own ROI after the first frame, the absent one causes a full-frame search every frame
+        self.assertEqual(trackers['first'].fallbacks, 1)
+        self.assertEqual(trackers['second'].fallbacks, 1)
+        self.assertEqual(trackers['absent'].losses, 20)
+        # markers found in the ROIs are kept on the frames despite the full-frame searches, each once
+        self.assertEqual(frame_ids, [[7, 8, 9, 12, 18, 42]] * 20)
@@ -0,0 +1,170 @@
+import math
+
+from markers import Markers
+
+
+class RoiTracker:
+    """
+    Predicts where the constellation is in the next frame and sizes the search area (ROI) around it.
+
+    Motion model is constant velocity, filtered with a Kalman filter. Both axes share the same
+    dynamics, so a single 2x2 covariance of (position, velocity) serves x and y.
+    ROI half size is the constellation extent in pixels (from the marker scale) times margin
+    plus sigma standard deviations of the predicted position.
+    With predictive=False the ROI is a fixed_size square on the last position, as it used to be.
+    """
+
+    def __init__(self, predictive=True, fixed_size=230, margin=1.2, sigma=3., min_size=64, max_size=None,
+                 acceleration_noise=2000., measurement_noise=1., radius=None):
+        """
+        :param predictive: predict position and size ROI adaptively, otherwise use fixed_size ROI on last position
+        :param fixed_size: ROI size in pixels in non-predictive mode
+        :param margin: ROI half size in constellation radii
+        :param sigma: ROI half size added in standard deviations of the predicted position
+        :param min_size: minimal ROI size in pixels
+        :param max_size: maximal ROI size in pixels, if the ROI would be larger the full frame is searched directly
+        :param acceleration_noise: process noise, px^2/s^3
+        :param measurement_noise: variance of measured position, px^2
+        :param radius: constellation radius in mm, distance from its center to the farthest marker corner
+        """
+        self.predictive = predictive
+        self.fixed_size = fixed_size
+        self.margin = margin
+        self.sigma = sigma
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acceleration_noise = acceleration_noise
+        self.measurement_noise = measurement_noise
+        if radius is None:
+            radius = Markers.radius
+        self.radius = radius
+        self.hits = 0
+        self.fallbacks = 0
+        self.losses = 0
+        self.reset()
+
+    def reset(self):
+        self.position = None
+        self._timestamp = None
+        self._state = None
+        self._covariance = None
+
+    @property
+    def hit_rate(self):
+        """
+        Share of searches where the marker was found in the ROI, without full-frame fallback
+        """
+        total = self.hits + self.fallbacks
+        return self.hits / total if total else 0.
+
+    def _predict(self, timestamp):
+        """
+        :return: (x, y, vx, vy), position variance
+        """
+        x, y, vx, vy = self._state
+        (pp, pv), (_, vv) = self._covariance
+        dt = max(0., timestamp - self._timestamp)
+        q = self.acceleration_noise
+        pp = pp + 2 * dt * pv + dt * dt * vv + q * dt ** 3 / 3
+        pv = pv + dt * vv + q * dt ** 2 / 2
+        vv = vv + q * dt
+        return (x + vx * dt, y + vy * dt, vx, vy), ((pp, pv), (pv, vv))
+
+    def predict(self, timestamp):
+        """
+        :return: predicted (x, y) at timestamp or None if nothing is tracked
+        """
+        if self.position is None:
+            return None
+        if not self.predictive or self._state is None:
+            return tuple(self.position.coordinates)
+        (x, y, _, _), _ = self._predict(timestamp)
+        return x, y
+
+    def roi(self, timestamp, resolution):
+        """
+        :return: (left, top, right, bottom) search area clipped to the frame, right and bottom exclusive,
+                 or None if the full frame has to be searched
+        """
+        if self.position is None:
+            return None
+        if not self.predictive:
+            half = self.fixed_size / 2
+            x, y = self.position.coordinates
+        else:
+            scale = math.hypot(self.position.rotscale[0], self.position.rotscale[1])
+            half = scale * self.radius * self.margin
+            if self._state is None:
+                x, y = self.position.coordinates
+            else:
+                (x, y, _, _), ((pp, _), _) = self._predict(timestamp)
+                half += self.sigma * math.sqrt(pp)
+            half = max(half, self.min_size / 2)
+            if self.max_size is not None and half * 2 > self.max_size:
+                return None
+        width, height = resolution
+        left = int(max(0, x - half))
+        top = int(max(0, y - half))
+        right = int(min(width, x + half + 1))
+        bottom = int(min(height, y + half + 1))
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right, bottom
+
+    def update(self, timestamp, position):
+        """
+        Corrects the prediction with the measured position
+        """
+        self.position = position
+        x, y = position.coordinates
+        if self._state is None:
+            self._state = (x, y, 0., 0.)
+            # unknown velocity
+            self._covariance = ((self.measurement_noise, 0.), (0., 1e6))
+        else:
+            (px, py, vx, vy), ((pp, pv), (_, vv)) = self._predict(timestamp)
+            s = pp + self.measurement_noise
+            kp = pp / s
+            kv = pv / s
+            ex = x - px
+            ey = y - py
+            self._state = (px + kp * ex, py + kp * ey, vx + kv * ex, vy + kv * ey)
+            self._covariance = (((1 - kp) * pp, (1 - kp) * pv), ((1 - kp) * pv, vv - kv * pv))
+        self._timestamp = timestamp
+
+    def searched(self, roi_hit, found):
+        """
+        Counts search outcomes
+        :param roi_hit: marker found in the ROI
+        :param found: marker found at all, in the ROI or in the full frame
+        """
+        if roi_hit:
+            self.hits += 1
+        else:
+            self.fallbacks += 1
+        if not found:
+            self.losses += 1
+
+
+class Robot:
+    """
+    Robot tracked in the camera stream: its marker constellation, its ROI tracker and optionally
+    the optical flow following its marker corners between detections
+    """
+
+    def __init__(self, markers, tracker, name=None, flow=None):
+        """
+        :param markers: Markers instance (or the Markers class for the default constellation)
+        :param tracker: RoiTracker
+        :param name: defaults to markers.name
+        :param flow: flow.CornerFlow or None to detect on every frame
+        """
+        self.markers = markers
+        self.tracker = tracker
+        self.flow = flow
+        self.name = name if name is not None else markers.name
+        tracker.radius = markers.radius
+
+    @property
+    def position(self):
+        return self.tracker.position
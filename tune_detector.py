@@ -0,0 +1,186 @@
+"""
+Detector parameter tuning: sweeps cv2.aruco.DetectorParameters over a dataset and writes the fastest
+setting reaching the target recall of the constellation markers into the config as detector_parameters,
+which WigglerCV loads on start or reload. Detection uses the dictionary restricted to the marker ids
+of the configured robots, as WigglerCV does with restrict_marker_ids.
+
+The dataset is synthetic frames of the first configured robot, or recorded frames: a flight recorder
+directory, a .npy array or a video file. Recorded frames have no ground truth, the markers found with
+the thorough REFERENCE parameters are taken as such.
+
+    python tune_detector.py [--dataset PATH] [--count 50] [--recall 0.99] [--config wiggler_cv.json] [--dry-run]
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from config import store
+from detection import detect_markers, parameters_from_dict, parameters_to_dict, restrict_dictionary
+from markers import Markers
+
+GRID = {
+    'adaptiveThreshWinSizeMin': [3, 7],
+    'adaptiveThreshWinSizeMax': [7, 15, 23],
+    'adaptiveThreshWinSizeStep': [4, 10, 20],
+    'minMarkerPerimeterRate': [0.01, 0.03, 0.08],
+    'polygonalApproxAccuracyRate': [0.03, 0.05],
+    'cornerRefinementMethod': [cv2.aruco.CORNER_REFINE_NONE, cv2.aruco.CORNER_REFINE_SUBPIX],
+}
+# slow and thorough, finds the ground truth of recorded frames
+REFERENCE = {
+    'adaptiveThreshWinSizeMin': 3,
+    'adaptiveThreshWinSizeMax': 33,
+    'adaptiveThreshWinSizeStep': 2,
+    'minMarkerPerimeterRate': 0.01,
+    'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_SUBPIX,
+}
+
+
+def settings(grid=GRID):
+    """
+    :return: list of {name: value} of all combinations of the grid, threshold windows from min to max only
+    """
+    names = sorted(grid)
+    combinations = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        setting = dict(zip(names, values))
+        if setting.get('adaptiveThreshWinSizeMin', 3) <= setting.get('adaptiveThreshWinSizeMax', 23):
+            combinations.append(setting)
+    return combinations
+
+
+def load_frames(path, count=None):
+    """
+    :param path: flight recorder directory, .npy array of gray or BGR frames, or a video file
+    :return: list of gray frames
+    """
+    if os.path.isdir(path):
+        from recorder import FlightRecording
+        recording = FlightRecording(path)
+        frames = [recording.frame(number) for number in recording.frames[:count]]
+        width, height = recording.resolution
+        if recording.format == 'yuv':
+            return [np.array(frame[:height, :width]) for frame in frames]
+        if recording.format == 'bgr':
+            return [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+        return [np.array(frame) for frame in frames]
+    if path.endswith('.npy'):
+        frames = np.load(path)[:count]
+        return [frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    capture = cv2.VideoCapture(path)
+    grays = []
+    while count is None or len(grays) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        grays.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    capture.release()
+    return grays
+
+
+def reference_truths(grays, dictionary, marker_ids):
+    """
+    :return: list of (corners, ids) per frame found with the REFERENCE parameters
+    """
+    parameters = parameters_from_dict(REFERENCE)
+    return [detect_markers(gray, dictionary, parameters, marker_ids) for gray in grays]
+
+
+def evaluate(grays, truths, dictionary, marker_ids, parameters, tolerance=2., repeat=3):
+    """
+    :param truths: list of (corners, ids) per frame
+    :param tolerance: largest mean corner distance of a found marker, px
+    :param repeat: the fastest of this many passes is timed
+    :return: (seconds per frame, share of the true markers found)
+    """
+    seconds = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        results = [detect_markers(gray, dictionary, parameters, marker_ids) for gray in grays]
+        seconds = min(seconds, (time.perf_counter() - start_time) / len(grays))
+    total = 0
+    found = 0
+    for (corners, ids), (true_corners, true_ids) in zip(results, truths):
+        if true_ids is None:
+            continue
+        total += len(true_ids)
+        if ids is None:
+            continue
+        detected = dict(zip(ids[:, 0], corners))
+        for marker_corners, marker_id in zip(true_corners, true_ids[:, 0]):
+            if marker_id in detected and \
+                    np.linalg.norm(detected[marker_id] - marker_corners, axis=-1).mean() <= tolerance:
+                found += 1
+    return seconds, found / total if total else 1.
+
+
+def tune(grays, truths, dictionary, marker_ids, grid=GRID, recall=0.99, tolerance=2., repeat=3, verbose=False):
+    """
+    :return: (setting, seconds per frame, recall) of the fastest setting reaching recall,
+             the one of the best recall if none does
+    """
+    results = []
+    for setting in settings(grid):
+        seconds, setting_recall = evaluate(grays, truths, dictionary, marker_ids, parameters_from_dict(setting),
+                                           tolerance=tolerance, repeat=repeat)
+        if verbose:
+            print('{:7.2f}ms {:6.1%} {}'.format(seconds * 1000, setting_recall, setting))
+        results.append((setting, seconds, setting_recall))
+    passing = [result for result in results if result[2] >= recall]
+    if passing:
+        return min(passing, key=lambda result: result[1])
+    return max(results, key=lambda result: (result[2], -result[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', help='recording directory, .npy frames or video file, synthetic if omitted')
+    parser.add_argument('--count', type=int, default=50, help='frames of the dataset used')
+    parser.add_argument('--recall', type=float, default=0.99, help='target share of the markers found')
+    parser.add_argument('--tolerance', type=float, default=2., help='largest mean corner error, px')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--config', default='wiggler_cv.json')
+    parser.add_argument('--dry-run', action='store_true', help='print the result only')
+    parser.add_argument('--verbose', action='store_true', help='print every setting')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    constellations = [Markers.from_config(robot) for robot in config.get('robots', [])] or [Markers]
+    marker_ids = sorted({marker_id for markers in constellations for marker_id in markers.marker_ids})
+    dictionary = restrict_dictionary(cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100), marker_ids)
+
+    if args.dataset:
+        grays = load_frames(args.dataset, args.count)
+        truths = reference_truths(grays, dictionary, marker_ids)
+    else:
+        from synthetic import marker_corners, random_frames
+        resolution = (config.get('input_res_h', 640), config.get('input_res_v', 480))
+        frames, poses = random_frames(args.count, resolution=resolution, markers=constellations[0])
+        grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+        truths = [marker_corners(constellations[0], pose[:2], pose[2:]) for pose in poses]
+    print('{} frames, marker ids {}'.format(len(grays), marker_ids))
+
+    default_seconds, default_recall = evaluate(grays, truths, dictionary, marker_ids,
+                                               parameters_from_dict(config.get('detector_parameters') or {}),
+                                               tolerance=args.tolerance, repeat=args.repeat)
+    print('configured: {:7.2f}ms {:6.1%}'.format(default_seconds * 1000, default_recall))
+    setting, seconds, recall = tune(grays, truths, dictionary, marker_ids, recall=args.recall,
+                                    tolerance=args.tolerance, repeat=args.repeat, verbose=args.verbose)
+    print('tuned:      {:7.2f}ms {:6.1%} {}'.format(seconds * 1000, recall, setting))
+    if recall < args.recall:
+        print('no setting reaches recall {:.1%}, config left unchanged'.format(args.recall))
+        return
+    if not args.dry_run:
+        store(args.config, 'detector_parameters',
+              parameters_to_dict(parameters_from_dict(setting), names=sorted(setting)))
+        print('written to ' + args.config)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,18 @@ class Motors:
         self.pi = pi
         self.pins = (23, 24, 25)
         self.count = len(self.pins)
+        self._dutycycles = [None] * self.count
         for pin in self.pins:
             self.pi.set_PWM_frequency(pin, hz)
 
     def set(self, speeds):
         self.speeds = tuple(speeds)
-        for speed, pin in zip(self.speeds, self.pins):
-            self.pi.set_PWM_dutycycle(pin, max(0, min(255, int(255 * speed))))
+        for i, (speed, pin) in enumerate(zip(self.speeds, self.pins)):
+            dutycycle = max(0, min(255, int(255 * speed)))
+            # every write is a round trip to pigpiod, skip unchanged pins
+            if dutycycle != self._dutycycles[i]:
+                self.pi.set_PWM_dutycycle(pin, dutycycle)
+                self._dutycycles[i] = dutycycle
 
     def off(self):
         self.set((0,) * self.count)
@@ -1,53 +1,61 @@
-import colorsys
+import math
 
 import pigpio
 import time
 
+from channel import EVERY, LATEST
+from controller import Controller
+from motor_driver import MotorDriver
 from vibromotors import Motors
-from wiggler_cv import WigglerCV, OsdText
+from wiggler_cv import WigglerCV, OsdText, OsdDot
 
 
 def main():
     pi = pigpio.pi()
     motors = Motors(pi)
     motors.off()
+    # motor updates at their own rate, not at the frame rate
+    driver = MotorDriver(motors, rate=50.)
     wcv = WigglerCV(pi)
     wcv.setup(cfg_file='wiggler_cv.json')
+    # kill -HUP reloads wiggler_cv.json
+    wcv.reload_on_signal()
+    # closed loop on the poses of the first robot, the controller runs at its own rate too
+    robots = getattr(wcv.config, 'robots', None) or [{}]
+    name = robots[0].get('name') or 'wigglebot'
+    controller = Controller(driver, rate=50.)
+    controller.follow(wcv.subscribe(LATEST, robot=name))
+    poses = wcv.subscribe(EVERY, robot=name)
+    width, height = wcv.config.input_res_h, wcv.config.input_res_v
+    # corners of a square around the center of the image, in pixels
+    waypoints = [(width / 2 + dx * height / 4, height / 2 + dy * height / 4)
+                 for dx, dy in ((-1, -1), (1, -1), (1, 1), (-1, 1))]
+    waypoint = 0
+    controller.set_target(waypoints[waypoint])
     wcv.run()
-    modes = [
-        (1., 0., 0.),
-        (0., 1., 0.),
-        (0., 0., 1.)
-    ]
+    controller.start()
     start_time = time.perf_counter()
-    old_mode = 0
-    motors.set(modes[old_mode])
-    for position in wcv:
-        # h, s, v = colorsys.rgb_to_hsv(modes[old_mode][0], modes[old_mode][1], modes[old_mode][2])
-        # print(position)
+    for position in poses:
         t = time.perf_counter() - start_time
-        v = t / 150.0
-        h = (t * 0.03) % 1.0
-        r, g, b = colorsys.hsv_to_rgb(h, 1.0, v)
-        motors.set((r, g, b))
+        target = waypoints[waypoint]
+        error = math.hypot(target[0] - position.coordinates[0], target[1] - position.coordinates[1])
+        if error <= controller.tolerance:
+            waypoint = (waypoint + 1) % len(waypoints)
+            controller.set_target(waypoints[waypoint])
         osd_list = [
-            OsdText(x=550, y=20, text='r {:.2f}'.format(r)),
-            OsdText(x=550, y=40, text='g {:.2f}'.format(g)),
-            OsdText(x=550, y=60, text='b {:.2f}'.format(b)),
-            OsdText(x=550, y=80, text='h {:.2f}'.format(h)),
-            OsdText(x=550, y=100, text='v {:.2f}'.format(v)),
+            OsdDot(x=target[0], y=target[1]),
+            OsdText(x=520, y=20, text='waypoint {}'.format(waypoint)),
+            OsdText(x=520, y=40, text='error {:4.0f}px'.format(error)),
         ]
         wcv.osd_update(osd_list)
-        # mode = int(t / 10) % len(modes)
-        # if mode != old_mode:
-        #     motors.set(modes[mode])
-        #     old_mode = mode
         if t > 150:
             break
+    controller.stop()
     wcv.terminate()
-    motors.off()
+    driver.close()
+    driver.off()
     pi.stop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
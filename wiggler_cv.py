@@ -1,104 +1,511 @@
 import io
-import json
 import math
-import queue
+import signal
 import threading
 import time
-from collections import namedtuple
-from subprocess import Popen, PIPE
 
 import cv2
-import picamera
-from picamera.array import bytes_to_rgb
+import numpy as np
 
-from markers import Markers
+from channel import EVERY, LATEST, Channel
+from config import RESTART, RUNTIME, STREAM, ConfigWatcher, changes, load
+from detection import (PyramidDetector, TiledDetector, detect_markers, parameters_from_dict, restrict_dictionary,
+                       scale_parameters)
+from frame_sources import PiCameraSource
+from markers import Markers, RobotLocation
+from metrics import Metrics, MetricsServer
+from osd import OsdDot, OsdLayer, OsdText, OsdVector, TextCache
+from pipeline import Pipeline
+from scheduler import DRAWING, FALLBACK, OSD, STREAMING, FrameScheduler
+from tracker import RoiTracker, Robot
 
-OsdText = namedtuple('OsdText', ['x', 'y', 'text'])
-OsdDot = namedtuple('OsdDot', ['x', 'y'])
-OsdVector = namedtuple('OsdVector', ['x1', 'y1', 'x2', 'y2'])
+
+class Frame:
+    """
+    Frame travelling through the processing stages.
+    A YUV420 frame keeps the Y plane as a view for detection, BGR image is converted
+    into the preallocated color_buffer on first access only.
+    """
+
+    def __init__(self, index, timestamp, capture_time, image=None, yuv=None, resolution=None, color_buffer=None):
+        """
+        :param timestamp: sensor time of the frame, seconds
+        :param capture_time: time.perf_counter() when the frame was received
+        """
+        self.index = index
+        self.timestamp = timestamp
+        self.capture_time = capture_time
+        self.yuv = yuv
+        self.gray = None
+        if yuv is not None:
+            self.gray = yuv[:resolution[1], :resolution[0]]
+        else:
+            resolution = image.shape[1::-1]
+        self.resolution = tuple(resolution)
+        self._image = image
+        self._color_buffer = color_buffer
+        self.corners = []
+        self.ids = None
+        self.rois = []
+        self.positions = {}
+        self.position = None
+        self.streamed = False
+        self.stream = None
+        self.detect_time = 0.
+        self.osd_time = 0.
+        self.stream_time = 0.
+
+    @property
+    def image(self):
+        if self._image is None and self.yuv is not None:
+            height, width = self.gray.shape
+            self._image = cv2.cvtColor(self.yuv, cv2.COLOR_YUV2BGR_I420, dst=self._color_buffer)[:height, :width]
+        return self._image
+
+    @property
+    def has_color(self):
+        return self._image is not None
+
+    def gray_area(self, left=0, top=0, right=None, bottom=None):
+        """
+        Gray image of the area, a view of the Y plane for YUV frames
+        """
+        if self.gray is not None:
+            return self.gray[top:bottom, left:right]
+        return cv2.cvtColor(self._image[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
 
 
 class WigglerCV(io.IOBase):
     font = cv2.FONT_HERSHEY_SIMPLEX
     Config = type('Config', (object,), {})
 
-    def __init__(self, pi, *args, **kwargs):
+    def __init__(self, pi, *args, source=None, **kwargs):
+        """
+        :param pi: pigpio.pi used for the status LED, may be None
+        :param source: FrameSource feeding write(), PiCameraSource is created on run() if None
+        """
         super().__init__(*args, **kwargs)
         self.config = WigglerCV.Config()
 
         self._thread = None
         self._terminate = False
         self._pi = pi
-        self._picamera = None
-        self._aruco_dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
-        self._stream_proc = None
-        self._gstreamer = None
+        self._source = source
+        self._full_dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+        self._aruco_dictionary = self._full_dictionary
+        self._marker_ids = None
+        self._detector_parameters = None
+        self._roi_parameters = {}
+        self._calibration = None
+        self._fallback_detector = None
+        self._debug_stream = None
+        self._cfg_file = None
+        self._config_values = {}
+        self._config_lock = threading.Lock()
+        self._stream_build_lock = threading.Lock()
+        self._pending_config = None
+        self._pending_stream = None
+        self._config_watcher = None
+        self._warmup_thread = None
+        self._start_time = None
+        self._first_pose = True
         self._osd_list = None
         self._osd_list_lock = threading.Lock()
-        self._position = None
-        self._position_queue = queue.Queue(2)
+        texts = TextCache()
+        self._own_osd = OsdLayer(texts)
+        self._user_osd = OsdLayer(texts)
+        self._robots = [Robot(Markers, RoiTracker(predictive=False), name='wigglebot')]
+        self.poses = Channel()
+        # iterating WigglerCV itself, subscribed from the start not to miss the first poses
+        self._subscription = self.poses.subscribe(EVERY, maxsize=100)
+        self._pipeline = None
+        self._frame_index = 0
+        self._last_timestamp = None
+        self._color_buffers = []
+        self._metrics_server = None
+        self._recorder = None
+        self._scheduler = None
+        self.metrics = Metrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self._configure_detection()
         self.streaming_time = 0
         self.osd_time = 0
         self.aruco_time = 0
 
     def setup(self, cfg_file='wiggler_cv.json'):
-        with open(cfg_file, 'r') as f:
-            config = json.load(f)
-
+        """
+        Loads the config file, see config.FIELDS
+        :raises ValueError: if a field is invalid
+        """
+        config = load(cfg_file)
         for k, v in config.items():
             setattr(self.config, k, v)
+        self._cfg_file = cfg_file
+        self._config_values = config
+
+    def reload(self):
+        """
+        Rereads the config file given to setup(), capture and tracking go on.
+        Runtime fields are applied between two frames, the debug stream is rebuilt in the background
+        and swapped in when ready, other fields need a restart.
+        :return: {group: changed field names}, see config.changes, None if the file is invalid
+        """
+        try:
+            values = load(self._cfg_file)
+        except (OSError, ValueError) as e:
+            print(e)
+            self.metrics.increment('config_errors')
+            return None
+        with self._config_lock:
+            changed = changes(self._config_values, values)
+            self._config_values = values
+            if RESTART in changed:
+                print('restart needed to apply ' + ', '.join(sorted(changed[RESTART])))
+            applied = changed.get(RUNTIME, set()) | changed.get(STREAM, set())
+            if applied:
+                config = WigglerCV.Config()
+                vars(config).update(vars(self._pending_config or self.config))
+                for name in applied:
+                    if name in values:
+                        setattr(config, name, values[name])
+                    elif hasattr(config, name):
+                        delattr(config, name)
+                if self._thread is None:
+                    self.config = config
+                else:
+                    self._pending_config = config
+        self.metrics.increment('config_reloads')
+        if STREAM in changed and self._thread is not None:
+            threading.Thread(target=self._rebuild_stream, args=(config,), name='stream-rebuild', daemon=True).start()
+        return changed
+
+    def reload_on_signal(self, signum=signal.SIGHUP):
+        """
+        Reloads the config on the signal, to be called from the main thread
+        """
+        signal.signal(signum, lambda *args: threading.Thread(target=self.reload, name='config-reload').start())
+
+    def _rebuild_stream(self, config):
+        with self._stream_build_lock:
+            try:
+                stream = self._create_debug_stream(config)
+            except Exception as e:
+                print(e)
+                return
+            with self._config_lock:
+                previous = self._pending_stream
+                self._pending_stream = (stream,)
+        if previous is not None and previous[0] is not None:
+            # built by an earlier reload and never used
+            previous[0].close()
+
+    def _apply_config(self):
+        """
+        Applies the runtime fields of a reloaded config, called by the detection stage between two frames
+        """
+        with self._config_lock:
+            config, self._pending_config = self._pending_config, None
+            if config is None:
+                return
+            # swapped under the lock, a reload copies either the pending config or this one
+            previous, self.config = self.config, config
+        changed = changes(vars(previous), vars(config)).get(RUNTIME, set())
+        if 'robots' in changed:
+            self._robots = self._create_robots()
+        elif changed & {'fast_area_size', 'roi_mode', 'roi_margin', 'roi_sigma', 'roi_min_size', 'roi_max_size'}:
+            for robot in self._robots:
+                self._configure_tracker(robot.tracker)
+        if 'robots' not in changed and any(name.startswith('flow_') for name in changed):
+            for robot in self._robots:
+                robot.flow = self._create_flow(robot.markers)
+        detection = changed & {'robots', 'detector_parameters', 'restrict_marker_ids'}
+        if detection:
+            self._configure_detection()
+        if detection or any(name.startswith('fallback_') and name != 'fallback_defer_every' for name in changed):
+            if self._fallback_detector is not None:
+                self._fallback_detector.close()
+            self._fallback_detector = self._create_fallback_detector()
+        if 'calibration' in changed:
+            self._calibration = self._create_calibration()
+        if changed & {'frame_scheduler', 'frame_budget', 'fallback_defer_every'}:
+            self._scheduler = self._create_scheduler()
+        if 'metrics_window' in changed:
+            self.metrics.window = config.metrics_window
+        self.metrics.increment('config_applied')
+
+    def _swap_stream(self):
+        """
+        Switches to a rebuilt debug stream, the previous one is closed in the background
+        """
+        with self._config_lock:
+            pending, self._pending_stream = self._pending_stream, None
+        if pending is None:
+            return
+        previous, self._debug_stream = self._debug_stream, pending[0]
+        if previous is not None:
+            threading.Thread(target=previous.close, name='stream-close', daemon=True).start()
+
+    def _create_robots(self):
+        """
+        Robots from the config: list of constellations with their name, marker_ids, marker_size,
+        marker_distance and angle_deg. Single robot with the default constellation if not configured.
+        """
+        constellations = [Markers.from_config(robot) for robot in getattr(self.config, 'robots', [])] or [Markers]
+        robots = []
+        for index, markers in enumerate(constellations):
+            tracker = self._configure_tracker(RoiTracker())
+            robots.append(Robot(markers, tracker, name=markers.name or 'wigglebot{}'.format(index if index else ''),
+                                flow=self._create_flow(markers)))
+        return robots
+
+    def _create_flow(self, markers):
+        """
+        Optical flow following the marker corners between detections, None if flow_tracking is off
+        """
+        if not getattr(self.config, 'flow_tracking', False):
+            return None
+        # optional paths are imported when configured only, they add to the start-up time
+        from flow import CornerFlow
+
+        return CornerFlow(markers.marker_ids, redetect_every=getattr(self.config, 'flow_redetect_every', 10),
+                          window=getattr(self.config, 'flow_window', 15),
+                          max_error=getattr(self.config, 'flow_max_error', 1.),
+                          max_residual=getattr(self.config, 'flow_max_residual', 1.5))
+
+    def _configure_tracker(self, tracker):
+        """
+        Sets the ROI parameters of the tracker from the config, keeps its state
+        """
+        tracker.predictive = getattr(self.config, 'roi_mode', 'fixed') == 'predictive'
+        tracker.fixed_size = self.config.fast_area_size
+        tracker.margin = getattr(self.config, 'roi_margin', 1.2)
+        tracker.sigma = getattr(self.config, 'roi_sigma', 3.)
+        tracker.min_size = getattr(self.config, 'roi_min_size', 64)
+        tracker.max_size = getattr(self.config, 'roi_max_size', None)
+        return tracker
+
+    def _configure_detection(self):
+        """
+        Dictionary and detector parameters shared by all detections: detector_parameters from the config
+        (written by tune_detector.py) and, with restrict_marker_ids, a dictionary of the marker ids of the
+        robots only so that other markers are discarded while decoding
+        """
+        if getattr(self.config, 'restrict_marker_ids', False):
+            self._marker_ids = sorted({marker_id for robot in self._robots for marker_id in robot.markers.marker_ids})
+            self._aruco_dictionary = restrict_dictionary(self._full_dictionary, self._marker_ids)
+        else:
+            self._marker_ids = None
+            self._aruco_dictionary = self._full_dictionary
+        self._detector_parameters = parameters_from_dict(getattr(self.config, 'detector_parameters', None) or {})
+        self._roi_parameters = {}
+
+    def _detect_area(self, gray, resolution):
+        """
+        Markers in a part of the frame, perimeter limits of the parameters kept those of the full frame
+        """
+        size = max(gray.shape[:2])
+        parameters = self._roi_parameters.get(size)
+        if parameters is None:
+            parameters = self._roi_parameters[size] = scale_parameters(self._detector_parameters,
+                                                                       max(resolution) / size)
+        return detect_markers(gray, self._aruco_dictionary, parameters, self._marker_ids)
+
+    def _create_calibration(self):
+        """
+        Lens calibration from the config (written by calibration.py) at the input resolution, None if not configured
+        """
+        values = getattr(self.config, 'calibration', None)
+        if not values:
+            return None
+        from calibration import Calibration
+
+        try:
+            return Calibration.from_config(values, (self.config.input_res_h, self.config.input_res_v))
+        except (KeyError, ValueError) as e:
+            print(e)
+            return None
+
+    def _create_fallback_detector(self):
+        """
+        Full-frame detector from the config: fallback_tiles grid detected in parallel and/or
+        fallback_scale coarse-to-fine detection. None for a single cv2.aruco.detectMarkers call.
+        """
+        detector = None
+        tiles = getattr(self.config, 'fallback_tiles', [1, 1])
+        scale = getattr(self.config, 'fallback_scale', 1)
+        if tiles[0] * tiles[1] > 1:
+            # tiles of the downscaled image, so is the overlap
+            detector = TiledDetector(self._aruco_dictionary, self._detector_parameters, grid=tiles,
+                                     overlap=getattr(self.config, 'fallback_tile_overlap', 80) // scale,
+                                     workers=getattr(self.config, 'fallback_workers', None),
+                                     marker_ids=self._marker_ids)
+        if scale > 1:
+            detector = PyramidDetector(self._aruco_dictionary, self._detector_parameters, scale=scale,
+                                       window=getattr(self.config, 'fallback_refine_window', None),
+                                       detector=detector, marker_ids=self._marker_ids)
+        return detector
+
+    def _detect_frame(self, gray):
+        """
+        Full-frame search
+        """
+        if self._fallback_detector is not None:
+            return self._fallback_detector.detect(gray)
+        return detect_markers(gray, self._aruco_dictionary, self._detector_parameters, self._marker_ids)
+
+    def _create_recorder(self):
+        """
+        Flight recorder from the config, None without record_path
+        """
+        if not getattr(self.config, 'record_path', None):
+            return None
+        from recorder import FlightRecorder
+
+        return FlightRecorder(self.config.record_path, (self.config.input_res_h, self.config.input_res_v),
+                              slots=getattr(self.config, 'record_slots', 750),
+                              format=getattr(self.config, 'record_format', 'gray'), framerate=self.config.input_fps)
+
+    def _create_scheduler(self):
+        if not getattr(self.config, 'frame_scheduler', False):
+            return None
+        return FrameScheduler(getattr(self.config, 'frame_budget', None) or 1. / self.config.input_fps,
+                              fallback_every=getattr(self.config, 'fallback_defer_every', 5))
+
+    def _create_debug_stream(self, config):
+        """
+        Debug stream from the config: stream_cmd and/or gstreamer_pipe at stream_res and stream_fps,
+        the input resolution and frame rate if not configured. None without sinks.
+        """
+        width, height = getattr(config, 'stream_res', None) or (config.input_res_h, config.input_res_v)
+        fps = min(getattr(config, 'stream_fps', None) or config.input_fps, config.input_fps)
+        host = getattr(config, 'streaming_host', 'brix.local')
+        port = getattr(config, 'streaming_port', 5000)
+        fields = dict(width=width, height=height, fps=fps, host=host, port=port, ds='{}:{}'.format(host, port))
+        stream_cmd = None
+        pipe = None
+        if hasattr(config, 'stream_cmd'):
+            stream_cmd = [part.format(**fields) for part in config.stream_cmd]
+        if hasattr(config, 'gstreamer_pipe'):
+            pipe = ' ! '.join(config.gstreamer_pipe).format(**fields)
+        if not stream_cmd and not pipe:
+            # frames are annotated and streamed only when somebody is watching
+            return None
+        from streaming import DebugStream
+
+        return DebugStream((width, height), fps, config.input_fps, stream_cmd=stream_cmd, gstreamer_pipe=pipe,
+                           process=getattr(config, 'stream_process', False),
+                           slots=getattr(config, 'stream_slots', 4),
+                           adaptive=getattr(config, 'stream_adaptive', False),
+                           min_fps=getattr(config, 'stream_min_fps', 1),
+                           budget=getattr(config, 'stream_budget', None))
 
     def run(self):
+        self._start_time = time.perf_counter()
         self._thread = threading.Thread(target=self._run)
         self._thread.start()
 
+    def _warm_up(self):
+        """
+        Locates the first robot in a synthetic frame, full frame and ROI sized, so that the detectors pay
+        their one-time allocation costs before the first camera frame
+        """
+        start_time = time.perf_counter()
+        try:
+            from synthetic import render_constellation
+
+            width, height = self.config.input_res_h, self.config.input_res_v
+            robot = self._robots[0]
+            gray = np.full((height, width), 200, np.uint8)
+            render_constellation(gray, (width / 2, height / 2), (2., 0.), markers=robot.markers,
+                                 dictionary=self._full_dictionary)
+            corners, ids = self._detect_frame(gray)
+            half = self.config.fast_area_size // 2
+            self._detect_area(gray[max(0, height // 2 - half):height // 2 + half,
+                                   max(0, width // 2 - half):width // 2 + half], (width, height))
+            self._locate(robot, corners, ids)
+        except Exception as e:
+            print(e)
+        self.metrics.observe('warmup', time.perf_counter() - start_time)
+
     def _run(self):
         """
         Thread function
         """
         try:
-            self._picamera = picamera.PiCamera(
-                resolution='{}x{}'.format(self.config.input_res_h, self.config.input_res_v),
-                framerate=self.config.input_fps)
-            if hasattr(self.config, 'stream_cmd'):
-                stream_cmd = self.config.stream_cmd.format(width=self.config.input_res_h,
-                                                           height=self.config.input_res_v,
-                                                           fps=self.config.input_fps, host='brix.local', port=5000,
-                                                           ds='brix.local:5000')
-                self._stream_proc = Popen(stream_cmd, stdin=PIPE)
-            if hasattr(self.config, 'gstreamer_pipe'):
-                pipe = ' ! '.join(self.config.gstreamer_pipe).format(width=self.config.input_res_h,
-                                                                     height=self.config.input_res_v,
-                                                                     fps=self.config.input_fps, host='brix.local',
-                                                                     port=5000,
-                                                                     ds='brix.local:5000')
-                # noinspection PyArgumentList
-                self._gstreamer = cv2.VideoWriter(pipe,
-                                                  cv2.CAP_GSTREAMER,
-                                                  self.config.input_fps,
-                                                  (self.config.input_res_h, self.config.input_res_v))
-
-            self._picamera.start_recording(self, format='bgr')
-            self._pi.write(26, 1)
-            while not self._terminate:
+            self._robots = self._create_robots()
+            self._configure_detection()
+            self._fallback_detector = self._create_fallback_detector()
+            if getattr(self.config, 'warmup', False):
+                # while the camera starts
+                self._warmup_thread = threading.Thread(target=self._warm_up, name='detector-warmup', daemon=True)
+                self._warmup_thread.start()
+            if self._source is None:
+                self._source = PiCameraSource(resolution=(self.config.input_res_h, self.config.input_res_v),
+                                              framerate=self.config.input_fps,
+                                              format=getattr(self.config, 'capture_format', 'bgr'))
+            self.config.input_res_h, self.config.input_res_v = self._source.resolution
+            self.config.input_fps = int(round(self._source.framerate))
+            self._calibration = self._create_calibration()
+            self._debug_stream = self._create_debug_stream(self.config)
+            self.metrics.window = getattr(self.config, 'metrics_window', 1000)
+            if getattr(self.config, 'metrics_port', None) is not None:
+                self._metrics_server = MetricsServer(self.metrics, host=getattr(self.config, 'metrics_host',
+                                                                                '127.0.0.1'),
+                                                     port=self.config.metrics_port)
+            self._scheduler = self._create_scheduler()
+            if getattr(self.config, 'config_watch', None) and self._cfg_file is not None:
+                self._config_watcher = ConfigWatcher(self._cfg_file, self.reload, interval=self.config.config_watch)
+            self._recorder = self._create_recorder()
+            if getattr(self.config, 'pipeline', False):
+                self._pipeline = Pipeline([('detect', self._detect),
+                                           ('annotate', self._annotate),
+                                           ('stream', self._stream)],
+                                          queue_size=getattr(self.config, 'pipeline_queue_size', 1),
+                                          drop_policy=getattr(self.config, 'pipeline_drop_policy', None))
+                self._pipeline.start()
+
+            if self._warmup_thread is not None:
+                self._warmup_thread.join()
+            self._source.start_recording(self)
+            if self._pi is not None:
+                self._pi.write(26, 1)
+            while not self._terminate and not self._source.finished:
                 try:
-                    self._picamera.wait_recording(1)
+                    self._source.wait_recording(1)
                 except KeyboardInterrupt:
                     break
         finally:
-            self._pi.write(26, 0)
-            try:
-                self._picamera.stop_recording()
-            except:
-                pass
+            if self._warmup_thread is not None:
+                self._warmup_thread.join()
+                self._warmup_thread = None
+            if self._pi is not None:
+                self._pi.write(26, 0)
             try:
-                self._picamera.close()
+                self._source.stop_recording()
             except:
                 pass
             try:
-                self._position_queue.put_nowait(StopIteration)
+                self._source.close()
             except:
                 pass
+            if self._pipeline is not None:
+                self._pipeline.stop()
+            if self._fallback_detector is not None:
+                self._fallback_detector.close()
+                self._fallback_detector = None
+            if self._metrics_server is not None:
+                self._metrics_server.close()
+                self._metrics_server = None
+            if self._config_watcher is not None:
+                self._config_watcher.close()
+                self._config_watcher = None
+            self._swap_stream()
+            if self._debug_stream is not None:
+                self._debug_stream.close()
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+            self.poses.close()
             print('thread finished')
 
     def writable(self):
@@ -106,100 +513,325 @@ class WigglerCV(io.IOBase):
 
     def write(self, buffer):
         """
-        Workhorse. Called by picamera and receives frame.
-        :param buffer: frame in picamera format
+        Workhorse. Called by the frame source and receives frame.
+        Runs the stages inline or hands the frame over to the pipeline when it is enabled.
+        :param buffer: frame in the source format
         """
+        capture_time = time.perf_counter()
+        timestamp = self._source.frame_timestamp
+        if timestamp is None:
+            # keep a single clock: extrapolate from the previous frame once the source gave a timestamp
+            timestamp = capture_time if self._last_timestamp is None \
+                else self._last_timestamp + 1. / self._source.framerate
+        self._last_timestamp = timestamp
+        # replayed recordings keep their frame numbers
+        index = self._source.frame_number
+        if index is None:
+            index = self._frame_index
+        data = self._source.to_array(buffer)
+        if self._source.format == 'yuv':
+            frame = Frame(index, timestamp, capture_time, yuv=data, resolution=self._source.resolution,
+                          color_buffer=self._color_buffer(data.shape))
+        else:
+            frame = Frame(index, timestamp, capture_time, image=data)
+        self._frame_index += 1
+        self.metrics.increment('frames')
+        if self._recorder is not None:
+            start_time = time.perf_counter()
+            try:
+                self._recorder.write(frame)
+            except Exception as e:
+                print(e)
+            self.metrics.observe('record', time.perf_counter() - start_time)
+        self._swap_stream()
+        frame.stream = self._debug_stream
+        if frame.stream is not None:
+            frame.streamed = frame.stream.rate.take(timestamp)
+        if self._pipeline is not None:
+            self._pipeline.put(frame)
+        else:
+            self._detect(frame)
+            if frame.streamed:
+                self._annotate(frame)
+                self._stream(frame)
+
+    def _color_buffer(self, yuv_shape):
+        """
+        Preallocated BGR buffer for YUV to BGR conversion.
+        Buffers are reused round-robin, there are enough of them for all frames in flight in the pipeline.
+        """
+        count = 1
+        if self._pipeline is not None:
+            count = len(self._pipeline.queues) * (self._pipeline.queues['detect'].maxsize + 1) + 1
+        shape = (yuv_shape[0] * 2 // 3, yuv_shape[1], 3)
+        if len(self._color_buffers) != count or self._color_buffers[0].shape != shape:
+            self._color_buffers = [np.empty(shape, dtype=np.uint8) for _ in range(count)]
+        buffer = self._color_buffers[self._frame_index % count]
+        return buffer
+
+    def _detect(self, frame):
+        """
+        Detection stage: finds markers and updates the position
+        """
+        self._apply_config()
         start_time = time.perf_counter()
-        input_frame = picamera.array.bytes_to_rgb(buffer, self._picamera.resolution)
+        resolution = (self.config.input_res_h, self.config.input_res_v)
         corners = []
-        ids = None
-        left = 0
-        top = 0
-        if self._position is not None:
-            left = int(max(0, self._position.coordinates[0] - self.config.fast_area_size / 2))
-            top = int(max(0, self._position.coordinates[1] - self.config.fast_area_size / 2))
-            right = int(min(self.config.input_res_h, self._position.coordinates[0] + self.config.fast_area_size / 2))
-            bottom = int(min(self.config.input_res_v, self._position.coordinates[1] + self.config.fast_area_size / 2))
-            gray = cv2.cvtColor(input_frame[top:bottom + 1, left:right + 1], cv2.COLOR_BGR2GRAY)
-            corners, ids, _ = cv2.aruco.detectMarkers(gray, self._aruco_dictionary)
-        if len(corners) == 0:
-            gray = cv2.cvtColor(input_frame, cv2.COLOR_BGR2GRAY)
-            corners, ids, _ = cv2.aruco.detectMarkers(gray, self._aruco_dictionary)
-        else:
-            for marker_idx in range(len(corners)):
-                for corner_idx in range(4):
-                    corners[marker_idx][0][corner_idx][0] += left
-                    corners[marker_idx][0][corner_idx][1] += top
+        ids = []
+        lost = []
+        located = []
+        for robot in self._robots:
+            if robot.flow is not None and not robot.flow.due:
+                # corners followed from the previous frame, no detection
+                tracked = robot.flow.track(frame.gray_area, resolution)
+                if tracked is not None:
+                    location = self._locate(robot, *tracked)
+                    if robot.flow.accept(location):
+                        self._track(robot, frame.timestamp, location)
+                        located.append((robot, location))
+                        corners.extend(tracked[0])
+                        ids.extend(tracked[1])
+                        self.metrics.increment('flow_tracked')
+                        continue
+                self.metrics.increment('flow_lost')
+            roi = robot.tracker.roi(frame.timestamp, resolution)
+            location = None
+            if roi is not None:
+                left, top, right, bottom = roi
+                roi_corners, roi_ids = self._detect_area(frame.gray_area(left, top, right, bottom), resolution)
+                for marker_corners in roi_corners:
+                    marker_corners += (left, top)
+                location = self._locate(robot, roi_corners, roi_ids)
+                corners.extend(roi_corners)
+                if roi_ids is not None:
+                    ids.extend(roi_ids)
+                frame.rois.append(roi)
+            if location is None:
+                lost.append(robot)
+            else:
+                self._track(robot, frame.timestamp, location)
+                robot.tracker.searched(True, True)
+                if robot.flow is not None:
+                    robot.flow.start(frame.gray_area, resolution, roi_corners, roi_ids)
+                located.append((robot, location))
+                self.metrics.increment('roi_hits')
 
-        if len(corners) > 0:
-            try:
-                new_position = Markers.get_location(corners, ids)
-                if new_position is not None:
-                    self._position = new_position
-            except:
-                pass
+        if lost and self._scheduler is not None and not self._scheduler.fallback(frame):
+            # out of time, the lost robots are searched on a later frame
+            self.metrics.increment('fallback_deferred')
+            lost = []
+        if lost:
+            # single full-frame search shared by all robots lost in their ROI
+            self.metrics.increment('full_frame_searches')
+            search_time = time.perf_counter()
+            frame_corners, frame_ids = self._detect_frame(frame.gray_area())
+            if self._scheduler is not None:
+                self._scheduler.observe(FALLBACK, time.perf_counter() - search_time)
+            for robot in lost:
+                location = self._locate(robot, frame_corners, frame_ids)
+                if location is not None:
+                    self._track(robot, frame.timestamp, location)
+                    located.append((robot, location))
+                    if robot.flow is not None:
+                        robot.flow.start(frame.gray_area, resolution, frame_corners, frame_ids)
+                else:
+                    self.metrics.increment('detection_failures')
+                robot.tracker.searched(False, location is not None)
+                self.metrics.increment('roi_fallbacks')
+            # markers found in the ROIs or tracked are kept for the OSD and the recorder, the full-frame
+            # search adds those not seen yet
+            if frame_ids is not None:
+                seen = {int(marker_id) for marker_id in np.asarray(ids).reshape(-1)}
+                for marker_corners, marker_id in zip(frame_corners, frame_ids):
+                    if int(marker_id[0]) not in seen:
+                        corners.append(marker_corners)
+                        ids.append(marker_id)
 
-        aruco_time = time.perf_counter()
+        frame.corners = corners
+        frame.ids = np.array(ids).reshape((-1, 1)) if len(corners) else None
+        for robot in self._robots:
+            if robot.position is not None:
+                frame.positions[robot.name] = robot.position
+        frame.position = self._robots[0].position
+        end_time = time.perf_counter()
+        self.aruco_time = frame.detect_time = end_time - start_time
+        self.metrics.observe('aruco', self.aruco_time)
+        if located:
+            latency = end_time - frame.capture_time
+            self.metrics.observe('capture_to_pose', latency)
+            if self._first_pose and self._start_time is not None:
+                self._first_pose = False
+                self.metrics.set_gauge('time_to_first_pose', end_time - self._start_time)
+            for robot, position in located:
+                floor = self._calibration.to_floor(position.coordinates) if self._calibration is not None else None
+                location = RobotLocation(robot.name, position.coordinates, position.rotscale, position.cost,
+                                         frame=frame.index, timestamp=frame.timestamp, latency=latency, floor=floor)
+                if self._recorder is not None:
+                    self._recorder.add_pose(location)
+                self.poses.publish(location)
+        if frame.streamed and self._scheduler is not None and not self._scheduler.fits(frame, OSD, STREAMING):
+            frame.streamed = False
+            self.metrics.increment('shed_streaming')
+        if not frame.streamed:
+            self._processed(frame)
+            return None
+        return frame
 
-        own_osd_list = []
-        if self._position is not None:
-            try:
-                self._position_queue.put_nowait(self._position)
-            except:
-                pass
+    def _locate(self, robot, corners, ids):
+        """
+        Pose of the robot, solved from the undistorted corners with a calibration
+        :param corners: detected corners in raw pixels
+        """
+        if len(corners) == 0:
+            return None
+        if self._calibration is not None:
+            corners = self._calibration.undistort_corners(corners)
+        try:
+            return robot.markers.get_location(corners, ids)
+        except Exception as e:
+            print(e)
+            return None
+
+    def _track(self, robot, timestamp, location):
+        """
+        Updates the ROI tracker with the pose mapped back to raw pixels, ROIs and OSD are in raw pixels
+        """
+        if self._calibration is not None:
+            location = location._replace(coordinates=self._calibration.distort(location.coordinates).tolist())
+        robot.tracker.update(timestamp, location)
 
+    def _annotate(self, frame):
+        """
+        OSD stage: draws debug information into the frame
+        """
+        start_time = osd_start_time = time.perf_counter()
+        position = frame.position
+        own_osd_list = []
+        if frame.positions:
             if self.config.debug_level >= 2:
-                cv2.aruco.drawDetectedMarkers(input_frame, corners, ids)
-                cv2.rectangle(input_frame,
-                              (int(self._position.coordinates[0]) - self.config.fast_area_size // 2,
-                               int(self._position.coordinates[1]) - self.config.fast_area_size // 2),
-                              (int(self._position.coordinates[0]) + self.config.fast_area_size // 2,
-                               int(self._position.coordinates[1]) + self.config.fast_area_size // 2),
-                              color=(0, 255, 255), thickness=1)
+                if self._scheduler is None or self._scheduler.fits(frame, DRAWING, OSD, STREAMING):
+                    cv2.aruco.drawDetectedMarkers(frame.image, frame.corners, frame.ids)
+                    for roi in frame.rois:
+                        cv2.rectangle(frame.image, roi[:2], (roi[2] - 1, roi[3] - 1), color=(0, 255, 255),
+                                      thickness=1)
+                    osd_start_time = time.perf_counter()
+                    if self._scheduler is not None:
+                        self._scheduler.observe(DRAWING, osd_start_time - start_time)
+                else:
+                    self.metrics.increment('shed_drawing')
 
             if self.config.debug_level >= 1:
-                scale = math.sqrt(self._position.rotscale[0] ** 2 + self._position.rotscale[1] ** 2)
-                own_osd_list = [
-                    OsdVector(x1=self._position.coordinates[0],
-                              y1=self._position.coordinates[1],
-                              x2=self._position.coordinates[0] + 20 * self._position.rotscale[0],
-                              y2=self._position.coordinates[1] + 20 * self._position.rotscale[1]),
-                    OsdText(x=5, y=20, text='x {:4.0f}px'.format(self._position.coordinates[0])),
-                    OsdText(x=5, y=40, text='y {:4.0f}px'.format(self._position.coordinates[1])),
-                    OsdText(x=5, y=60, text='angle {:4.0f}deg'.format(math.atan2(self._position.rotscale[1],
-                                                                                 self._position.rotscale[
-                                                                                     0]) / math.pi * 180)),
-                    OsdText(x=5, y=80, text='scale {:3.1f}px/mm'.format(scale)),
-                    OsdText(x=5, y=100, text='RMSE {:4.0f}px'.format(self._position.cost)),
-                    OsdText(x=5, y=120, text='{:3.0f}:{:3.0f}:{:3.0f}'.format(self.aruco_time * 1000,
-                                                                              self.osd_time * 1000,
-                                                                              self.streaming_time * 1000))
-                ]
-
-        self.draw_osd_list(input_frame, own_osd_list)
+                for name, robot_position in frame.positions.items():
+                    own_osd_list.append(OsdVector(x1=robot_position.coordinates[0],
+                                                  y1=robot_position.coordinates[1],
+                                                  x2=robot_position.coordinates[0] + 20 * robot_position.rotscale[0],
+                                                  y2=robot_position.coordinates[1] + 20 * robot_position.rotscale[1]))
+                    if len(self._robots) > 1:
+                        own_osd_list.append(OsdText(x=robot_position.coordinates[0] + 10,
+                                                    y=robot_position.coordinates[1] - 10, text=name))
+
+        if position is not None and self.config.debug_level >= 1:
+            scale = math.sqrt(position.rotscale[0] ** 2 + position.rotscale[1] ** 2)
+            own_osd_list += [
+                OsdText(x=5, y=20, text='x {:4.0f}px'.format(position.coordinates[0])),
+                OsdText(x=5, y=40, text='y {:4.0f}px'.format(position.coordinates[1])),
+                OsdText(x=5, y=60, text='angle {:4.0f}deg'.format(math.atan2(position.rotscale[1],
+                                                                             position.rotscale[
+                                                                                 0]) / math.pi * 180)),
+                OsdText(x=5, y=80, text='scale {:3.1f}px/mm'.format(scale)),
+                OsdText(x=5, y=100, text='RMSE {:4.0f}px'.format(position.cost)),
+                OsdText(x=5, y=120, text='{:3.0f}:{:3.0f}:{:3.0f}'.format(self.aruco_time * 1000,
+                                                                          self.osd_time * 1000,
+                                                                          self.streaming_time * 1000))
+            ]
+
+        self._own_osd.update(own_osd_list)
+        if own_osd_list:
+            self._own_osd.draw(frame.image)
         with self._osd_list_lock:
-            if self._osd_list is not None:
-                self.draw_osd_list(input_frame, self._osd_list)
-        osd_time = time.perf_counter()
+            if self._osd_list:
+                self._user_osd.draw(frame.image)
+        end_time = time.perf_counter()
+        self.osd_time = frame.osd_time = end_time - start_time
+        self.metrics.observe('osd', self.osd_time)
+        if self._scheduler is not None:
+            self._scheduler.observe(OSD, end_time - osd_start_time)
+        return frame
 
-        if self._stream_proc:
-            try:
-                self._stream_proc.stdin.write(cv2.cvtColor(input_frame, cv2.COLOR_BGR2YUV_I420).tobytes())
-            except Exception as e:
-                print(e)
-        if self._gstreamer:
-            try:
-                self._gstreamer.write(input_frame)
-            except Exception as e:
-                print(e)
+    def _stream(self, frame):
+        """
+        Streaming stage: sends the annotated frame to the debug stream, downscaled to stream_res
+        """
+        start_time = time.perf_counter()
+        frame.stream.write(frame)
+        end_time = time.perf_counter()
+        self.streaming_time = end_time - start_time
+        frame.stream_time = frame.osd_time + self.streaming_time
+        self.metrics.observe('streaming', self.streaming_time)
+        self.metrics.observe('capture_to_stream', end_time - frame.capture_time)
+        if self._scheduler is not None:
+            self._scheduler.observe(STREAMING, self.streaming_time)
+        self._processed(frame)
+        return frame
+
+    def _processed(self, frame):
+        """
+        Called once the last stage is done with the frame, feeds the adaptive stream rate
+        and counts the frames done after their deadline
+        """
+        if self._scheduler is not None and self._scheduler.missed(frame):
+            self.metrics.increment('deadline_misses')
+        if frame.stream is not None:
+            frame.stream.rate.update(frame.detect_time, frame.stream_time if frame.streamed else None)
 
-        streaming_time = time.perf_counter()
-        self.streaming_time = streaming_time - osd_time
-        self.osd_time = osd_time - aruco_time
-        self.aruco_time = aruco_time - start_time
-        # print('aruco {:3.0f}ms,osd {:3.0f}ms,stream {:3.0f}ms'.format(self.aruco_time * 1000,
-        #                                                               self.osd_time * 1000,
-        #                                                               self.streaming_time * 1000))
+    def _collect_metrics(self, metrics):
+        metrics.set_gauge('roi_hit_rate', self.roi_hit_rate)
+        metrics.set_gauge('positions_dropped', self._subscription.dropped)
+        metrics.set_gauge('pose_subscribers', self.poses.subscribers)
+        stream = self._debug_stream
+        if stream is not None:
+            metrics.set_gauge('stream_fps', stream.rate.fps)
+            if stream.sink is not None:
+                metrics.set_gauge('frames_streamed', stream.sink.streamed)
+                metrics.set_gauge('frames_stream_skipped', stream.sink.skipped)
+        if self._scheduler is not None:
+            for name, cost in self._scheduler.costs.items():
+                metrics.set_gauge('cost', cost, stage=name)
+        for robot in self._robots:
+            metrics.set_gauge('tracked', int(robot.position is not None), robot=robot.name)
+        if self._pipeline is not None:
+            for name, count in self._pipeline.dropped.items():
+                metrics.set_gauge('dropped_frames', count, stage=name)
+            for name, depth in self._pipeline.depth.items():
+                metrics.set_gauge('queue_depth', depth, stage=name)
+
+    def stats(self):
+        """
+        :return: metrics snapshot: stage and latency histograms (seconds), counters and gauges, see Metrics.snapshot
+        """
+        return self.metrics.snapshot()
+
+    @property
+    def robots(self):
+        return list(self._robots)
+
+    @property
+    def roi_hit_rate(self):
+        """
+        Share of frames where markers were found in the ROI without a full-frame search
+        """
+        hits = sum(robot.tracker.hits for robot in self._robots)
+        total = hits + sum(robot.tracker.fallbacks for robot in self._robots)
+        return hits / total if total else 0.
+
+    @property
+    def dropped_frames(self):
+        """
+        Frames dropped in front of each pipeline stage
+        """
+        if self._pipeline is None:
+            return {}
+        return self._pipeline.dropped
 
     def draw_osd_list(self, input_frame, osd_list):
         for item in osd_list:
@@ -218,6 +850,7 @@ class WigglerCV(io.IOBase):
     def osd_update(self, osd_list):
         with self._osd_list_lock:
             self._osd_list = osd_list[:]
+            self._user_osd.update(self._osd_list)
 
     def terminate(self):
         self._terminate = True
@@ -230,11 +863,21 @@ class WigglerCV(io.IOBase):
         return self.next()
 
     def next(self):
+        """
+        Next pose of any robot, the last 100 poses are buffered, older ones are dropped if the caller lags behind
+        """
         try:
-            position = self._position_queue.get()
+            return self._subscription.get()
         except KeyboardInterrupt:
             raise StopIteration
-        if position == StopIteration:
-            raise StopIteration
-        else:
-            return position
+
+    def subscribe(self, mode=LATEST, robot=None, maxsize=100):
+        """
+        Subscribes to the poses published from now on, see channel.Subscription
+        :param mode: 'latest' to get the newest pose only, 'every' to get all of them
+        :param robot: name of the robot to get the poses of, all robots if None
+        :param maxsize: poses buffered in 'every' mode
+        :return: Subscription, iterable with for and async for
+        """
+        predicate = None if robot is None else (lambda pose: pose.robot == robot)
+        return self.poses.subscribe(mode, maxsize=maxsize, predicate=predicate)